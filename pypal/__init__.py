@@ -16,12 +16,20 @@ a chain of API calls.
 
 """
 
-import logging
-import urllib2
-import json
 import time
+import zlib
 
-from pypal import settings, util
+from pypal import nvp, settings, trace, util
+from pypal.deadline import Timeout
+from pypal.limiter import RateLimited
+from pypal.metrics import Counters
+from pypal.pool import ConnectionPool
+
+auth = util.lazy_module('pypal.auth')
+json = util.lazy_module('json')
+logging = util.lazy_module('logging')
+urllib2 = util.lazy_module('urllib2')
+xmlcodec = util.lazy_module('pypal.xmlcodec')
 
 
 #: The uppercased value contained in ack on successful responses
@@ -41,7 +49,7 @@ class Response(dict):
     a dictionary which accurately reflects the data hierarchy.
 
     """
-    def __init__(self, raw, response_dict, http_error=False):
+    def __init__(self, raw, response_dict, http_error=False, error=None):
         """Initialize the response object and convert the shallow
         response dictionary into one that resembling the
         hierarchy set by PayPal.
@@ -51,9 +59,12 @@ class Response(dict):
                               by parsing the raw response body.
         :param http_error: The HTTPError exception in case it is caught
                            during execution of the request.
+        :param error: Any other exception which prevented the request from
+                      being sent or answered, e.g ``'RateLimited'``.
         """
         self.raw = raw
         self.http_error = http_error
+        self.error = error
         if response_dict:
             self.update(response_dict)
 
@@ -77,9 +88,16 @@ class Response(dict):
             return ack
         return ack.upper()
 
+    def get_correlation_id(self):
+        """Retrieve the correlation id which PayPal assigned the call."""
+        envelope = self.get_response_envelope()
+        if not envelope:
+            return None
+        return envelope.get('correlationId', None)
+
     def is_success(self):
         """Check whether the response resembles success or not."""
-        if self.http_error:
+        if self.http_error or self.error:
             return False
 
         ack = self.get_ack(as_upper=True)
@@ -89,9 +107,64 @@ class Response(dict):
 
     success = property(is_success)
 
+    @property
+    def is_rate_limited(self):
+        return isinstance(self.error, RateLimited)
+
+    @property
+    def is_timeout(self):
+        return isinstance(self.error, Timeout)
+
+class NVPResponse(Response):
+    """Response of the classic Name-Value Pair API which contains the
+    ack at the top level rather than in a response envelope.
+
+    """
+    def get_response_envelope(self):
+        return None
+
+    def get_ack(self, as_upper=False):
+        ack = self.get('ACK', None)
+        if not ack or not as_upper:
+            return ack
+        return ack.upper()
+
+    def get_correlation_id(self):
+        return self.get('CORRELATIONID', None)
+
+    def get_errors(self):
+        """Retrieve list of the error dictionaries contained in the
+        L_ERRORCODEn, L_SHORTMESSAGEn and L_LONGMESSAGEn fields.
+        """
+        return nvp.parse_indexed(self, fields=('ERRORCODE',
+                                               'SHORTMESSAGE',
+                                               'LONGMESSAGE',
+                                               'SEVERITYCODE'))
+
 PAYPAL_BASE_URL = 'https://www.paypal.com'
 PAYPAL_SANDBOX_BASE_URL = 'https://www.sandbox.paypal.com'
 
+#: Name of the client in ``'pypal.trace'``
+TRACE_SUBSYSTEM = 'client'
+
+#: Suffix of the render and parse methods per format, in case it differs
+#: from the lowercased format name.
+FORMAT_METHOD_SUFFIXES = {settings.NVP_FORMAT: 'nvp'}
+
+#: Modules which define the PRODUCTION_ENDPOINT and SANDBOX_ENDPOINT of
+#: the services connected to by ``'Client.warmup'``.
+ENDPOINT_MODULES = ('pypal.service.adaptive_payment',
+                    'pypal.service.permission',
+                    'pypal.ipn')
+
+#: Value of the Accept-Encoding header sent when compression is accepted
+ACCEPT_ENCODING = 'gzip, deflate'
+
+def gzip_compress(data):
+    """Compress given data into the gzip format."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
 class Client(object):
     """The client provides an unified interface to communicate with the
     PayPal API without having to deal with the lower-level implementation
@@ -100,26 +173,50 @@ class Client(object):
     Depending on configuration it will target the intended endpoint, encode
     given parameters and deal with application authentication.
     """
-    def __init__(self, config=None, **kwargs):
+    def __init__(self,
+                 config=None,
+                 pool=None,
+                 limiter=None,
+                 hedger=None,
+                 **kwargs):
         """Initialize a client with the given configurations.
         There is no need for more than one instance of the client
         unless the configuration has to vary.
 
         :param config: Prepared instance of ``'pypal.settings.Config``` which will
                        take precedence over any key-values given.
+        :param pool: Instance of ``'pypal.pool.ConnectionPool'`` to send
+                     requests with. Share one between clients in order to
+                     reuse connections, see ``'pypal.registry'``.
+        :param limiter: Instance of ``'pypal.limiter.Limiter'`` which every
+                        call has to acquire permission from.
+        :param hedger: Instance of ``'pypal.hedging.Hedger'`` which hedges
+                       calls of idempotent actions.
         :param kwargs: Key-value pairs which are passed along to a new instance
                        of ``'pypal.settings.Config'`` in case the config argument
                        was not given.
         """
         if not config:
             config = settings.Config(**kwargs)
-        else:
-            self.config = config
+        self.config = config
+        self.pool = pool or ConnectionPool()
+        self.limiter = limiter
+        self.hedger = hedger
+
+        #: Counters of the bytes sent and received, both as rendered or
+        #: parsed and as transferred after compression.
+        self.metrics = Counters()
+
+        #: Optional semaphore limiting the amount of concurrent calls
+        self.quota = None
 
     def call(self,
              api_group,
              api_action,
              endpoint=None,
+             credentials=None,
+             deadline=None,
+             timeout=None,
              **params):
         """Wrapper of our send method which simplifies URL generation
         depending on intended API group and actions.
@@ -129,6 +226,12 @@ class Client(object):
         :param endpoint: Override the endpoint which is otherwise determined
                          by the client. Useful in cases where the API group has
                          been issued a unique endpoint.
+        :param credentials: Tuple of the access token and token secret to
+                            utilize in order to execute the call on behalf of
+                            another account.
+        :param deadline: Instance of ``'pypal.deadline.Deadline'`` limiting
+                         the time spent on this and subsequent calls.
+        :param timeout: Override the timeout set in the configuration
         :param params: Dictionary containing the key-value pairs required
                        for the given action.
         """
@@ -138,34 +241,244 @@ class Client(object):
         if 'requestEnvelope' not in params:
             params['requestEnvelope'] = self.config.request_envelope
 
-        headers = self.get_headers()
+        if self.config.api_format.upper() == settings.XML_FORMAT:
+            # The root element of XML requests is named after the action
+            params = {'%sRequest' % api_action: params}
+
+        headers = self.get_headers(url=url, credentials=credentials)
         request_body = self.render_request_body(params)
 
+        limiter_key = (api_group, endpoint)
+        if (self.hedger is not None and
+                self.hedger.is_idempotent(api_group, api_action)):
+            return self.hedger.run((api_group, api_action),
+                                   lambda: self._execute(limiter_key, url,
+                                                         request_body,
+                                                         headers, timeout,
+                                                         deadline))
+
+        return self._execute(limiter_key, url, request_body,
+                             headers, timeout, deadline)
+
+    def call_nvp(self,
+                 method,
+                 params=None,
+                 body=None,
+                 endpoint=None,
+                 credentials=None,
+                 deadline=None,
+                 timeout=None):
+        """Execute a call against the classic Name-Value Pair API,
+        e.g MassPay or TransactionSearch, which authenticates using
+        parameters in the request body rather than headers.
+
+        :param method: The API method to execute
+        :param params: Dictionary of the arguments to send
+        :param body: Arguments already rendered in the NVP format,
+                     appended to the rendered params.
+        :param endpoint: Override the NVP endpoint of the configuration
+        :param credentials: Tuple of the access token and token secret to
+                            utilize in order to execute the call on behalf of
+                            another account.
+        :param deadline: Instance of ``'pypal.deadline.Deadline'``
+        :param timeout: Override the timeout set in the configuration
+        """
+        url = self.config.endpoint if not endpoint else endpoint
+
+        arguments = {'METHOD': method, 'VERSION': settings.NVP_API_VERSION}
+        if credentials:
+            access_token, token_secret = credentials
+            header = auth.get_authorization_header(self.config.api_username,
+                                                   self.config.api_password,
+                                                   access_token,
+                                                   token_secret,
+                                                   url)
+            headers = {'X-PAYPAL-AUTHORIZATION': header}
+        else:
+            headers = {}
+            arguments['USER'] = self.config.api_username
+            arguments['PWD'] = self.config.api_password
+            if self.config.token_authentication:
+                arguments['SIGNATURE'] = self.config.api_signature
+            set_nonempty = util.set_nonempty_param
+            set_nonempty(arguments, 'SUBJECT', self.config.api_subject)
+
+        if params:
+            arguments.update(params)
+
+        request_body = nvp.render(util.ensure_unicode(arguments))
+        if body:
+            request_body = '%s&%s' % (request_body, body)
+
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.config.accept_compression:
+            headers['Accept-Encoding'] = ACCEPT_ENCODING
+
+        return self._execute(('NVP', url), url, request_body, headers,
+                             timeout, deadline, format=settings.NVP_FORMAT,
+                             response_class=NVPResponse)
+
+    def _execute(self, limiter_key, url, request_body, headers, timeout,
+                 deadline, format=None, response_class=None):
+        if timeout is None:
+            timeout = self.config.timeout
+
+        args = (url, request_body, headers, timeout, deadline,
+                format, response_class or Response)
+        if self.limiter is None:
+            return self._send_and_parse(*args)
+
+        try:
+            self.limiter.acquire(limiter_key)
+        except RateLimited as e:
+            return args[-1](None, None, error=e)
+
+        success = False
+        try:
+            response = self._send_and_parse(*args)
+            success = response.success
+        finally:
+            self.limiter.release(limiter_key, success)
+        return response
+
+    def _send_and_parse(self, url, request_body, headers, timeout, deadline,
+                        format, response_class):
+        if self.quota is not None:
+            self.quota.acquire()
+
+        started_at = time.time()
         try:
-            response = self.send(url, request_body)
+            if deadline is not None:
+                timeout = deadline.get_timeout(timeout)
+            response = self.send(url, request_body, headers=headers,
+                                 timeout=timeout)
             response_body = response.read()
-            data = self.parse_response_body(response_body)
+            self._count_response(response)
+            data = self.parse_response_body(response_body, format=format)
         except urllib2.HTTPError as e:
-            logging.error(e.strerror)
-            return Response(None, None, http_error=e)
-        return Response(response_body, data)
+            logging.error('Request to %s failed with HTTP %s %s',
+                          url, e.code, e.msg)
+            if trace.enabled(TRACE_SUBSYSTEM, trace.LEVEL_ERROR):
+                trace.event(TRACE_SUBSYSTEM, 'http_error',
+                            level=trace.LEVEL_ERROR, url=url,
+                            code=e.code, reason=e.msg,
+                            elapsed=time.time() - started_at)
+            return response_class(None, None, http_error=e)
+        except Timeout as e:
+            logging.warning('Request to %s aborted: %s', url, e)
+            if trace.enabled(TRACE_SUBSYSTEM, trace.LEVEL_WARNING):
+                trace.event(TRACE_SUBSYSTEM, 'timeout',
+                            level=trace.LEVEL_WARNING, url=url,
+                            error=str(e), elapsed=time.time() - started_at)
+            return response_class(None, None, error=e)
+        finally:
+            if self.quota is not None:
+                self.quota.release()
+
+        if trace.enabled(TRACE_SUBSYSTEM):
+            trace.event(TRACE_SUBSYSTEM, 'call', url=url, headers=headers,
+                        request=lambda: self._parse_request_body(request_body,
+                                                                 format),
+                        response=data,
+                        elapsed=time.time() - started_at)
+        return response_class(response_body, data)
+
+    def _parse_request_body(self, request_body, format):
+        try:
+            return self.parse_response_body(request_body, format=format)
+        except Exception:
+            return None
 
-    def send(self, url, body):
+    def send(self, url, body, headers=None, timeout=None):
         """Send an API request against given url.
+        Raises ``'pypal.deadline.Timeout'`` in case PayPal does not
+        respond within the timeout.
 
         :param url: The PayPal URL to target
         :param body: The HTTP request body
+        :param headers: The HTTP headers to send, defaults to the
+                        ones retrieved using ``'get_headers'``.
+        :param timeout: Amount of seconds to wait for a response, defaults
+                        to the timeout set in the configuration.
+        """
+        if headers is None:
+            headers = self.get_headers()
+        if timeout is None:
+            timeout = self.config.timeout
+
+        self.metrics.incr('request_bytes', len(body))
+        if (self.config.compress_requests and
+                len(body) >= self.config.compression_threshold):
+            body = gzip_compress(body)
+            headers = dict(headers, **{'Content-Encoding': 'gzip'})
+        self.metrics.incr('request_bytes_sent', len(body))
+        return self.pool.urlopen(url, body, headers, timeout=timeout)
+
+    def _count_response(self, response):
+        received = getattr(response, 'bytes_received', None)
+        if received is None:
+            return
+        self.metrics.incr('response_bytes_received', received)
+        self.metrics.incr('response_bytes', response.bytes_decoded)
+
+    def get_endpoints(self):
+        """Retrieve sorted list of the endpoints utilized in the configured
+        mode, i.e sandbox or production.
+        """
+        endpoints = set([self.config.endpoint])
+        for module_name in ENDPOINT_MODULES:
+            module = __import__(module_name, None, None, ['__name__'], 0)
+            endpoint = (module.PRODUCTION_ENDPOINT, module.SANDBOX_ENDPOINT)
+            endpoints.add(endpoint[int(self.config.in_sandbox)])
+        return sorted(endpoints)
+
+    def warmup(self, timeout=None, workers=4):
+        """Prepare the client for its first call, e.g at process start or
+        right after forking a worker. Loads the lazily imported modules,
+        codecs and timezone data and opens a pooled connection to every
+        endpoint, which resolves the hosts and completes the TCP and TLS
+        handshakes ahead of time.
+
+        Returns dictionary of the exception raised per endpoint, or None
+        in case the connection was opened.
+
+        :param timeout: The timeout in seconds of each connection attempt
+        :param workers: Amount of endpoints to connect to concurrently
         """
-        headers = self.get_headers()
-        request = urllib2.Request(url, body, headers)
-        return urllib2.urlopen(request)
+        for format in settings.SUPPORTED_FORMATS:
+            rendered = self.render_request_body({'warmup': '1'},
+                                                format=format)
+            self.parse_response_body(rendered, format=format)
 
-    def get_headers(self):
+        util.load_module(auth)
+        try:
+            util.get_timezones()
+        except ImportError:
+            # pytz is optional
+            pass
+
+        def connect(url):
+            try:
+                self.pool.connect(url, timeout=timeout or self.config.timeout)
+            except Exception as e:
+                logging.warning('Failed to connect to %s: %s', url, e)
+                return (url, e)
+            return (url, None)
+
+        return dict(util.concurrent_imap(connect, self.get_endpoints(),
+                                         workers=workers))
+
+    def get_headers(self, url=None, credentials=None):
         """Retrieve dictionary containing the necessary HTTP headers
         to set when sending requests to PayPal.
 
         They contain the credentials required to successfully authenticate
         your application along with specification of which format to utilize.
+
+        :param url: The URL which the request is sent to. Required in case
+                    credentials are given since it is part of the signature.
+        :param credentials: Tuple of the access token and token secret to
+                            sign the request with, see ``'pypal.auth'``.
         """
         ret = {}
         if self.config.application_id:
@@ -174,15 +487,27 @@ class Client(object):
         ret['X-PAYPAL-REQUEST-DATA-FORMAT'] = self.config.api_format
         ret['X-PAYPAL-RESPONSE-DATA-FORMAT'] = self.config.api_format
 
+        if self.config.accept_compression:
+            ret['Accept-Encoding'] = ACCEPT_ENCODING
+
+        if credentials:
+            access_token, token_secret = credentials
+            header = auth.get_authorization_header(self.config.api_username,
+                                                   self.config.api_password,
+                                                   access_token,
+                                                   token_secret,
+                                                   url)
+            ret['X-PAYPAL-AUTHORIZATION'] = header
+            return ret
+
         if self.config.token_authentication:
             ret['X-PAYPAL-SECURITY-USERID'] = self.config.api_username
             ret['X-PAYPAL-SECURITY-PASSWORD'] = self.config.api_password
             ret['X-PAYPAL-SECURITY-SIGNATURE'] = self.config.api_signature
             return ret
 
-        # TODO: Implement the authentication method utilizing given
-        # certificate instead of using tokens.
-        ret['X-PAYPAL-SECURITY-SUBJECT'] = None
+        if self.config.api_subject:
+            ret['X-PAYPAL-SECURITY-SUBJECT'] = self.config.api_subject
         return ret
 
     def get_paypal_url(self, path):
@@ -210,8 +535,7 @@ class Client(object):
 
     @classmethod
     def parse_nvp(cls, response):
-        from pypal.nvp import parse
-        return parse(response)
+        return nvp.parse(response)
 
     def render_request_body(self, params, format=None):
         params = util.ensure_unicode(params)
@@ -224,14 +548,21 @@ class Client(object):
 
     @classmethod
     def render_nvp(cls, params):
-        from pypal.nvp import render
-        return render(params)
+        return nvp.render(params)
+
+    @classmethod
+    def parse_xml(cls, response):
+        return xmlcodec.parse(response)
+
+    @classmethod
+    def render_xml(cls, params):
+        return xmlcodec.render(params)
 
     def _get_format_method(self, parse_method, format=None):
         if not format:
             format = self.config.api_format
 
-        format = format.lower()
+        format = FORMAT_METHOD_SUFFIXES.get(format.upper(), format.lower())
         method_prefixes = ('render', 'parse')
         method_name = '%s_%s' % (method_prefixes[parse_method], format)
         return getattr(self, method_name)
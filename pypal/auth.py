@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Generation of the ``X-PAYPAL-AUTHORIZATION`` header which is required
+when executing API calls on behalf of another account, i.e utilizing the
+access token and token secret retrieved using
+``'pypal.service.permission.get_credentials'``.
+
+The signature is an OAuth-like HMAC-SHA1 digest. Since it is computed on
+every third-party request both the signing keys and the generated header
+values are cached.
+"""
+
+import hmac
+import time
+
+from base64 import b64encode
+from hashlib import sha1
+from urllib import quote
+
+SIGNATURE_METHOD = 'HMAC-SHA1'
+SIGNATURE_VERSION = '1.0'
+
+#: Maximum amount of entries contained in each cache before it is cleared
+MAX_CACHE_SIZE = 4096
+
+#: Prepared HMAC instances keyed by (api_password, token_secret)
+_signers = {}
+
+#: Generated header values keyed by all inputs of the signature
+_headers = {}
+
+def encode(value):
+    return quote(value, safe='~')
+
+def get_signer(api_password, token_secret):
+    """Retrieve the HMAC instance keyed for given password and secret.
+    The instance should be copied before being updated.
+
+    :param api_password: The API password of the application
+    :param token_secret: The token secret issued along with the access token
+    """
+    cache_key = (api_password, token_secret)
+    signer = _signers.get(cache_key, None)
+    if signer is not None:
+        return signer
+
+    key = '%s&%s' % (encode(api_password), encode(token_secret))
+    signer = hmac.new(key, digestmod=sha1)
+    if len(_signers) >= MAX_CACHE_SIZE:
+        _signers.clear()
+    _signers[cache_key] = signer
+    return signer
+
+def generate_signature(api_username,
+                       api_password,
+                       access_token,
+                       token_secret,
+                       url,
+                       timestamp,
+                       method='POST'):
+    """Generate the signature of a third-party API request.
+
+    :param api_username: The API username of the application
+    :param api_password: The API password of the application
+    :param access_token: The access token granted by the account owner
+    :param token_secret: The token secret issued along with the access token
+    :param url: The URL which the request is sent to
+    :param timestamp: Integer timestamp which is part of the signature
+    :param method: The HTTP method of the request
+    """
+    params = ('oauth_consumer_key=%s&oauth_signature_method=%s'
+              '&oauth_timestamp=%s&oauth_token=%s&oauth_version=%s'
+              % (encode(api_username), SIGNATURE_METHOD, timestamp,
+                 encode(access_token), SIGNATURE_VERSION))
+    base = '%s&%s&%s' % (method, encode(url), encode(params))
+
+    signer = get_signer(api_password, token_secret).copy()
+    signer.update(base)
+    return b64encode(signer.digest())
+
+def get_authorization_header(api_username,
+                             api_password,
+                             access_token,
+                             token_secret,
+                             url,
+                             timestamp=None):
+    """Retrieve the value of the ``X-PAYPAL-AUTHORIZATION`` header.
+    Values are reused as long as the timestamp, which has a resolution
+    of one second, remains the same.
+
+    :param api_username: The API username of the application
+    :param api_password: The API password of the application
+    :param access_token: The access token granted by the account owner
+    :param token_secret: The token secret issued along with the access token
+    :param url: The URL which the request is sent to
+    :param timestamp: Override the current timestamp
+    """
+    if timestamp is None:
+        timestamp = int(time.time())
+
+    cache_key = (api_username, api_password, access_token,
+                 token_secret, url, timestamp)
+    header = _headers.get(cache_key, None)
+    if header is not None:
+        return header
+
+    signature = generate_signature(api_username, api_password, access_token,
+                                   token_secret, url, timestamp)
+    header = 'token=%s,signature=%s,timestamp=%s' % (access_token,
+                                                     signature,
+                                                     timestamp)
+    if len(_headers) >= MAX_CACHE_SIZE:
+        _headers.clear()
+    _headers[cache_key] = header
+    return header
+
+def clear_caches():
+    _signers.clear()
+    _headers.clear()
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the hot paths of pypal; the codecs, request signing,
+tracing, import time, IPN dispatching and complete API calls against a
+local loopback HTTP server standing in for PayPal.
+
+Payloads are generated to resemble real API traffic at various sizes.
+Results are reported in microseconds per operation and may be written
+as JSON and compared to a stored baseline::
+
+    python -m pypal.bench --output results.json
+    python -m pypal.bench --baseline results.json
+
+The process exits with a non-zero status on regressions, i.e benchmarks
+exceeding their budget or being slower than the baseline by more than
+the tolerance.
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import SocketServer
+import subprocess
+import sys
+import threading
+import time
+import timeit
+import urllib
+
+from pypal import Client, auth, nvp, trace, util, xmlcodec
+from pypal.ipn import Listener
+
+#: Amount of times each benchmarked function is called per measurement
+DEFAULT_NUMBER = 10000
+
+#: Modules whose cold import time is measured
+IMPORT_MODULES = ('pypal', 'pypal.ipn')
+
+#: Amount of interpreters started per measured import
+IMPORT_NUMBER = 10
+
+#: Maximum amount of microseconds a benchmark may take before it is
+#: considered a regression.
+BUDGETS = {'import.pypal': 20000,
+           'import.pypal.ipn': 25000}
+
+#: Relative slowdown compared to the baseline considered a regression
+DEFAULT_TOLERANCE = 0.2
+
+#: Amount of receivers in the generated payloads per size
+PAYLOAD_SIZES = {'small': 1, 'medium': 20, 'large': 200}
+
+#: Depths of the generated trees utilized to benchmark recursion
+TREE_DEPTHS = (2, 8)
+
+def measure(func, number=DEFAULT_NUMBER, repeat=3):
+    """Measure the best average amount of microseconds spent per call
+    to given function.
+
+    :param func: The function to benchmark, called without arguments
+    :param number: Amount of calls per measurement
+    :param repeat: Amount of measurements to take the best one of
+    """
+    elapsed = min(timeit.repeat(func, number=number, repeat=repeat))
+    return elapsed / number * 1e6
+
+def bench_signing():
+    """Cost of generating the third-party authorization header with
+    cold caches, with a cached signing key and with a cached header.
+    """
+    args = ('username', 'password', 'access-token', 'token-secret',
+            'https://svcs.sandbox.paypal.com/AdaptivePayments/Pay')
+
+    def cold():
+        auth.clear_caches()
+        auth.get_authorization_header(*args, timestamp=1325376000)
+
+    timestamps = iter(xrange(1325376000, 1325376000 + 10 ** 9))
+    def cached_key():
+        auth.get_authorization_header(*args, timestamp=next(timestamps))
+
+    def cached_header():
+        auth.get_authorization_header(*args, timestamp=1325376000)
+
+    return {'cold': measure(cold),
+            'cached_key': measure(cached_key),
+            'cached_header': measure(cached_header)}
+
+def measure_command(args, number=IMPORT_NUMBER):
+    """Measure the fastest execution of given command in microseconds."""
+    timings = []
+    for _ in range(number):
+        started_at = time.time()
+        subprocess.check_call(args)
+        timings.append(time.time() - started_at)
+    return min(timings) * 1e6
+
+def bench_import():
+    """Cold import time of the package in a new interpreter, excluding
+    the time it takes to start the interpreter itself.
+    """
+    startup = measure_command([sys.executable, '-c', 'pass'])
+    ret = {}
+    for module in IMPORT_MODULES:
+        usec = measure_command([sys.executable, '-c', 'import %s' % module])
+        ret[module] = max(0.0, usec - startup)
+    return ret
+
+def generate_payment_details(receivers=20):
+    """Generate a PaymentDetails-like response of the given size."""
+    return {'responseEnvelope': {'ack': 'Success',
+                                 'build': '2486531',
+                                 'correlationId': 'b2c1a7d4e5f60',
+                                 'timestamp': '2012-01-01T00:00:00.000-08:00'},
+            'payKey': 'AP-1234567890ABCDEFG',
+            'status': 'COMPLETED',
+            'currencyCode': 'USD',
+            'paymentInfoList': {'paymentInfo': [
+                {'receiver': {'amount': '%d.00' % index,
+                              'email': 'receiver%d@example.com' % index,
+                              'primary': 'false'},
+                 'transactionId': '%017d' % index,
+                 'transactionStatus': 'COMPLETED',
+                 'senderTransactionStatus': 'COMPLETED'}
+                for index in range(receivers)]}}
+
+def generate_tree(depth, width=3):
+    """Generate a nested dictionary of the given depth."""
+    if not depth:
+        return 'value'
+    return dict(('key%d' % index, generate_tree(depth - 1, width))
+                for index in range(width))
+
+def generate_ipn(index=0):
+    """Generate the body of an Adaptive Payment IPN."""
+    return urllib.urlencode([
+        ('transaction_type', 'Adaptive Payment PAY'),
+        ('status', 'COMPLETED'),
+        ('pay_key', 'AP-%017d' % index),
+        ('sender_email', 'sender@example.com'),
+        ('action_type', 'PAY'),
+        ('fees_payer', 'EACHRECEIVER'),
+        ('transaction[0].id', '%017d' % index),
+        ('transaction[0].status', 'Completed'),
+        ('transaction[0].amount', 'USD 10.00'),
+        ('transaction[0].receiver', 'receiver@example.com'),
+        ('verify_sign', 'AFcWxV21C7fd0v3bYYYRCpSSRl31A'),
+        ('test_ipn', '1')])
+
+class _LoopbackHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length', 0))
+        self.rfile.read(length)
+
+        if self.path.startswith('/cgi-bin/webscr'):
+            body = 'VERIFIED'
+        elif self.path.startswith('/nvp'):
+            body = 'ACK=Success&CORRELATIONID=b2c1a7d4e5f60'
+        else:
+            body = self.server.json_response
+
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class LoopbackServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local HTTP server standing in for PayPal which answers API calls
+    with a generated response, IPN verifications with VERIFIED and
+    classic NVP calls with a successful ack.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _LoopbackHandler)
+        self.json_response = json.dumps(generate_payment_details())
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+class LoopbackClient(Client):
+    """Client which sends every request to the loopback server."""
+    def __init__(self, server, **kwargs):
+        Client.__init__(self, api_username='username',
+                        api_password='password',
+                        api_signature='signature', **kwargs)
+        self.server = server
+
+    def send(self, url, body, headers=None, timeout=None):
+        path = url.split('/', 3)[-1]
+        url = '%s/%s' % (self.server.url, path)
+        return Client.send(self, url, body, headers=headers, timeout=timeout)
+
+def bench_nvp():
+    """Parsing and rendering of NVP payloads of various sizes."""
+    ret = {}
+    for name, receivers in sorted(PAYLOAD_SIZES.items()):
+        payload = generate_payment_details(receivers)
+        raw = nvp.render(payload)
+        number = max(10, 2000 // receivers)
+        ret['render_%s' % name] = measure(lambda: nvp.render(payload), number)
+        ret['parse_%s' % name] = measure(lambda: nvp.parse(raw), number)
+
+    for depth in TREE_DEPTHS:
+        tree = generate_tree(depth)
+        raw = nvp.render(tree)
+        ret['render_depth%d' % depth] = measure(lambda: nvp.render(tree), 50)
+        ret['parse_depth%d' % depth] = measure(lambda: nvp.parse(raw), 50)
+    return ret
+
+def bench_ensure_unicode():
+    """Recursive unicode conversion of deep trees and large payloads."""
+    ret = {}
+    for depth in TREE_DEPTHS:
+        tree = generate_tree(depth)
+        ret['depth%d' % depth] = measure(lambda: util.ensure_unicode(tree), 50)
+
+    payload = generate_payment_details(PAYLOAD_SIZES['large'])
+    ret['large'] = measure(lambda: util.ensure_unicode(payload), 100)
+    return ret
+
+def bench_client_codecs():
+    """Client.render_request_body and parse_response_body per format."""
+    client = Client()
+    payload = generate_payment_details(PAYLOAD_SIZES['medium'])
+    ret = {}
+    for format in ('JSON', 'NV'):
+        raw = client.render_request_body(payload, format=format)
+        name = format.lower()
+        ret['render_%s' % name] = measure(
+            lambda: client.render_request_body(payload, format=format), 500)
+        ret['parse_%s' % name] = measure(
+            lambda: client.parse_response_body(raw, format=format), 500)
+    return ret
+
+def bench_loopback():
+    """Complete API calls and IPN dispatching against the loopback server.
+    """
+    server = LoopbackServer().start()
+    try:
+        client = LoopbackClient(server)
+        listener = Listener(client)
+        listener.add('Adaptive Payment PAY', lambda response: None)
+        notification = generate_ipn()
+
+        def call_json():
+            client.call('AdaptivePayments', 'PaymentDetails',
+                        endpoint=server.url, payKey='AP-1234567890')
+
+        def call_nvp():
+            client.call_nvp('GetBalance', endpoint=server.url + '/nvp')
+
+        return {'call_json': measure(call_json, 200),
+                'call_nvp': measure(call_nvp, 200),
+                'ipn_dispatch': measure(
+                    lambda: listener.dispatch(notification), 200)}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def bench_codecs():
+    """Parsing cost of equivalent JSON and XML responses."""
+    payload = generate_payment_details()
+    raw_json = json.dumps(payload)
+    raw_xml = xmlcodec.render(payload, root='PaymentDetailsResponse')
+    return {'parse_json': measure(lambda: json.loads(raw_json), number=1000),
+            'parse_xml': measure(lambda: xmlcodec.parse(raw_xml), number=1000)}
+
+def bench_tracing():
+    """Cost of rendering NVP with tracing disabled, of a disabled trace
+    point on its own and of rendering with tracing enabled.
+    """
+    params = {'METHOD': 'MassPay', 'USER': 'username', 'PWD': 'password',
+              'receiver': [{'email': 'receiver%d@example.com' % index,
+                            'amount': '%d.00' % index}
+                           for index in range(10)]}
+
+    def trace_point():
+        if trace.enabled(nvp.TRACE_SUBSYSTEM):
+            trace.event(nvp.TRACE_SUBSYSTEM, 'render', params=params)
+
+    ret = {'render_disabled': measure(lambda: nvp.render(params), 1000),
+           'trace_point_disabled': measure(trace_point)}
+
+    def discard(data):
+        pass
+
+    trace.configure(nvp.TRACE_SUBSYSTEM)
+    trace.add_handler(discard)
+    try:
+        ret['render_enabled'] = measure(lambda: nvp.render(params), 1000)
+    finally:
+        trace.remove_handler(discard)
+        trace.disable(nvp.TRACE_SUBSYSTEM)
+    return ret
+
+BENCHMARKS = {'signing': bench_signing,
+              'import': bench_import,
+              'codecs': bench_codecs,
+              'tracing': bench_tracing,
+              'nvp': bench_nvp,
+              'ensure_unicode': bench_ensure_unicode,
+              'client_codecs': bench_client_codecs,
+              'loopback': bench_loopback}
+
+def run(names=None):
+    """Run the benchmarks and return a dictionary of the results in
+    microseconds keyed by ``<benchmark>.<case>``.
+
+    :param names: The benchmarks to run, defaults to all of them
+    """
+    results = {}
+    for name in sorted(names or BENCHMARKS):
+        for case, usec in BENCHMARKS[name]().items():
+            results['%s.%s' % (name, case)] = usec
+    return results
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Retrieve list of ``(key, baseline, result)`` tuples of the results
+    which are slower than the baseline by more than the tolerance.
+
+    :param results: Dictionary of results as returned by ``'run'``
+    :param baseline: Dictionary of previously stored results
+    :param tolerance: The allowed relative slowdown, e.g 0.2
+    """
+    regressions = []
+    for key, usec in sorted(results.items()):
+        expected = baseline.get(key, None)
+        if expected is not None and usec > expected * (1 + tolerance):
+            regressions.append((key, expected, usec))
+    return regressions
+
+def check_budgets(results):
+    """Retrieve list of the keys of results exceeding their budget."""
+    return [key for key, usec in sorted(results.items())
+            if key in BUDGETS and usec > BUDGETS[key]]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*',
+                        help='The benchmarks to run, all by default; %s'
+                             % ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('--output', help='Write the results as JSON')
+    parser.add_argument('--baseline', help='Compare to stored results')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed relative slowdown to the baseline')
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    results = run(args.benchmarks)
+    for key, usec in sorted(results.items()):
+        print('%s: %.2f usec' % (key, usec))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    failed = False
+    for key in check_budgets(results):
+        failed = True
+        print('%s exceeded its budget of %.2f usec' % (key, BUDGETS[key]))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key, expected, usec in compare(results, baseline, args.tolerance):
+            failed = True
+            print('%s regressed from %.2f to %.2f usec' % (key, expected, usec))
+    return int(failed)
+
+if __name__ == '__main__':
+    sys.exit(main())
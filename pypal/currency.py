@@ -1,5 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import re
+
+from decimal import Decimal, InvalidOperation
+
 # North America
 US_DOLLAR = 'USD'
 CANADIAN_DOLLAR = 'CAD'
@@ -59,6 +63,26 @@ ALL_CODES = frozenset([US_DOLLAR,
                        AUSTRALIAN_DOLLAR,
                        NEW_ZEALAND_DOLLAR])
 
+#: Currencies which do not support decimals
+ZERO_DECIMAL_CODES = frozenset([HUNGARIAN_FORINT,
+                                JAPANEASE_YEN,
+                                TAIWAN_NEW_DOLLAR])
+
+#: Amount of decimals, i.e minor units, supported per currency
+MINOR_UNITS = dict((code, 0 if code in ZERO_DECIMAL_CODES else 2)
+                   for code in ALL_CODES)
+
+#: Precomputed exponents to quantize amounts with per currency
+_EXPONENTS = dict((code, Decimal(1).scaleb(-units))
+                  for code, units in MINOR_UNITS.items())
+
+#: Plain non-negative decimal amounts which are normalized without
+#: having to construct a decimal.
+_PLAIN_AMOUNT = re.compile(r'^(\d+)(?:\.(\d*))?$')
+
+#: The numpy module once loaded, False if it is not installed
+_numpy = None
+
 NAME_MAPPING = {
     US_DOLLAR: 'United States dollar',
     CANADIAN_DOLLAR: 'Canadian dollar',
@@ -93,3 +117,243 @@ def is_supported_internationally(code):
 
 def get_name(code):
     return NAME_MAPPING[code.upper()]
+
+def get_minor_units(code):
+    return MINOR_UNITS[code.upper()]
+
+def to_decimal(amount, code):
+    """Convert given amount into a decimal quantized to the precision of
+    given currency. Raises ``ValueError`` in case the amount is invalid or
+    more precise than supported by the currency.
+
+    :param amount: The amount as a string, integer, float or decimal
+    :param code: The currency code
+    """
+    code = code.upper()
+    exponent = _EXPONENTS.get(code, None)
+    if exponent is None:
+        raise ValueError('Given currency code (%s) is not supported' % code)
+
+    if isinstance(amount, Money):
+        if amount.code != code:
+            raise ValueError('Cannot convert %s into %s' % (amount, code))
+        return amount.amount
+
+    text = amount
+    if isinstance(amount, float):
+        # The shortest representation is exact for floats such as 0.1,
+        # whereas binary floats which are not exactly representable using
+        # the supported decimals, e.g 0.1 + 0.2, are rejected below.
+        text = repr(amount)
+
+    try:
+        value = Decimal(text)
+        quantized = value.quantize(exponent)
+    except (InvalidOperation, TypeError):
+        raise ValueError('Invalid amount (%r)' % (amount,))
+
+    if quantized != value:
+        raise ValueError('Amount (%r) is more precise than the %d decimals '
+                         'supported by %s' % (amount, MINOR_UNITS[code], code))
+    return quantized
+
+def format_amount(amount, code):
+    """Format given amount in its canonical form, as sent to PayPal."""
+    return str(to_decimal(amount, code))
+
+class Money(object):
+    """An immutable amount in a given currency, stored as a decimal
+    quantized to the minor units of the currency.
+    """
+    __slots__ = ('amount', 'code')
+
+    def __init__(self, amount, code):
+        """
+        :param amount: The amount as a string, integer, float or decimal
+        :param code: The currency code
+        """
+        code = code.upper()
+        object.__setattr__(self, 'code', code)
+        object.__setattr__(self, 'amount', to_decimal(amount, code))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Money is immutable')
+
+    def __str__(self):
+        return str(self.amount)
+
+    def __repr__(self):
+        return 'Money(%r, %r)' % (str(self.amount), self.code)
+
+    def format(self):
+        return str(self.amount)
+
+    def _check_code(self, other):
+        if not isinstance(other, Money):
+            raise TypeError('Expected an instance of Money')
+        if other.code != self.code:
+            raise ValueError('Currency mismatch: %s and %s'
+                             % (self.code, other.code))
+
+    def __add__(self, other):
+        self._check_code(other)
+        return Money(self.amount + other.amount, self.code)
+
+    def __radd__(self, other):
+        # Allow usage of the sum builtin which starts with zero
+        if other == 0:
+            return self
+        return self.__add__(other)
+
+    def __sub__(self, other):
+        self._check_code(other)
+        return Money(self.amount - other.amount, self.code)
+
+    def __eq__(self, other):
+        if not isinstance(other, Money):
+            return NotImplemented
+        return self.code == other.code and self.amount == other.amount
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __lt__(self, other):
+        self._check_code(other)
+        return self.amount < other.amount
+
+    def __le__(self, other):
+        self._check_code(other)
+        return self.amount <= other.amount
+
+    def __gt__(self, other):
+        self._check_code(other)
+        return self.amount > other.amount
+
+    def __ge__(self, other):
+        self._check_code(other)
+        return self.amount >= other.amount
+
+    def __hash__(self):
+        return hash((self.amount, self.code))
+
+def sum_amounts(amounts, code):
+    """Sum given amounts exactly, returning an instance of ``'Money'``.
+
+    :param amounts: Iterable of amounts in given currency
+    :param code: The currency code
+    """
+    code = code.upper()
+    total = Decimal(0)
+    for amount in amounts:
+        total += to_decimal(amount, code)
+    return Money(total, code)
+
+def validate_amounts(amounts, code, allow_zero=False):
+    """Validate and normalize a whole column of amounts at once, e.g the
+    amounts of a payout file. Returns a tuple of the normalized amounts,
+    with ``None`` in place of invalid ones, and a dictionary of the errors
+    keyed by index.
+
+    NumPy arrays are validated using vectorized operations.
+
+    :param amounts: Sequence or NumPy array of amounts
+    :param code: The currency code
+    :param allow_zero: Whether zero amounts are valid
+    """
+    code = code.upper()
+    if code not in MINOR_UNITS:
+        raise ValueError('Given currency code (%s) is not supported' % code)
+
+    numpy = _get_numpy()
+    if numpy and isinstance(amounts, numpy.ndarray):
+        return _validate_array(numpy, amounts, code, allow_zero)
+
+    units = MINOR_UNITS[code]
+    normalized = []
+    errors = {}
+    for index, amount in enumerate(amounts):
+        if isinstance(amount, float):
+            text = repr(amount)
+        elif isinstance(amount, (int, long)):
+            text = str(amount)
+        elif isinstance(amount, basestring):
+            text = amount
+        else:
+            text = ''
+
+        match = _PLAIN_AMOUNT.match(text)
+        if match:
+            whole, fraction = match.groups()
+            fraction = fraction or ''
+            if fraction[units:].strip('0'):
+                errors[index] = ('Amount (%r) is more precise than the %d '
+                                 'decimals supported by %s'
+                                 % (amount, units, code))
+                normalized.append(None)
+                continue
+
+            whole = whole.lstrip('0') or '0'
+            fraction = fraction[:units].ljust(units, '0')
+            if not allow_zero and whole == '0' and not fraction.strip('0'):
+                errors[index] = 'Amount (%s) is not positive' % amount
+                normalized.append(None)
+                continue
+
+            if units:
+                normalized.append('%s.%s' % (whole, fraction))
+            else:
+                normalized.append(whole)
+            continue
+
+        # Anything but plain amounts, e.g decimals, exponents or
+        # negative amounts, are handled using a decimal.
+        try:
+            value = to_decimal(amount, code)
+        except ValueError as e:
+            errors[index] = str(e)
+            normalized.append(None)
+            continue
+
+        if value < 0 or (not allow_zero and not value):
+            errors[index] = 'Amount (%s) is not positive' % value
+            normalized.append(None)
+            continue
+        normalized.append(str(value))
+    return (normalized, errors)
+
+def _validate_array(numpy, amounts, code, allow_zero):
+    units = MINOR_UNITS[code]
+    try:
+        values = amounts.astype(numpy.float64)
+    except ValueError:
+        # Contains values which cannot be converted; validate one by one
+        return validate_amounts(amounts.tolist(), code, allow_zero)
+
+    scaled = values * (10 ** units)
+    valid = numpy.isfinite(values)
+    valid &= numpy.abs(scaled - numpy.round(scaled)) < 1e-6
+    if allow_zero:
+        valid &= values >= 0
+    else:
+        valid &= values > 0
+
+    template = '%%.%df' % units
+    normalized = [template % value if ok else None
+                  for value, ok in zip(values.tolist(), valid.tolist())]
+    errors = dict((int(index), 'Invalid amount (%r) for %s'
+                   % (values[index], code))
+                  for index in numpy.flatnonzero(~valid))
+    return (normalized, errors)
+
+def _get_numpy():
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy
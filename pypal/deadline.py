@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Deadlines which limit the total amount of time spent on a chain of
+API calls, e.g ``'pypal.service.adaptive_payment.get_payment_url'``.
+
+A deadline is created once and passed along to every call in the chain.
+Each request is then sent with a timeout no greater than the remaining
+time and calls made after the deadline has passed fail right away.
+"""
+
+import time
+
+class Timeout(Exception):
+    """The request did not complete within its timeout."""
+
+
+class DeadlineExceeded(Timeout):
+    """The deadline passed before the request could be sent."""
+
+
+class Deadline(object):
+    def __init__(self, seconds):
+        """
+        :param seconds: The total amount of seconds available
+        """
+        self.expires_at = time.time() + seconds
+
+    def remaining(self):
+        """Amount of seconds left, never less than zero."""
+        return max(0.0, self.expires_at - time.time())
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def get_timeout(self, timeout=None):
+        """Retrieve the timeout to utilize for the next request.
+        Raises ``'DeadlineExceeded'`` in case no time remains.
+
+        :param timeout: The timeout which would otherwise be utilized
+        """
+        remaining = self.remaining()
+        if not remaining:
+            raise DeadlineExceeded('Deadline passed %.3f seconds ago'
+                                   % (time.time() - self.expires_at))
+
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Request hedging of idempotent API calls in order to cut tail latency.
+
+In case the first attempt of a call has not been answered once the
+configured percentile of recent latencies has passed, a second attempt
+is sent and whichever answers first is returned. The other attempt is
+abandoned; its response is discarded once it arrives, though its latency
+is still recorded. The amount of hedged requests is capped to a fraction
+of all requests.
+"""
+
+import threading
+import time
+
+from collections import deque
+
+from pypal.util import lazy_module
+
+Queue = lazy_module('Queue')
+
+#: The (api_group, api_action) combinations which are safe to send twice
+IDEMPOTENT_ACTIONS = frozenset([('AdaptivePayments', 'ConvertCurrency'),
+                                ('AdaptivePayments', 'GetPaymentOptions'),
+                                ('AdaptivePayments', 'GetShippingAddresses'),
+                                ('AdaptivePayments', 'PaymentDetails'),
+                                ('AdaptivePayments', 'PreapprovalDetails'),
+                                ('Permissions', 'GetPermissions'),
+                                ('Permissions', 'GetBasicPersonalData'),
+                                ('Permissions', 'GetAdvancedPersonalData'),
+                                ('IPN', '_notify-validate')])
+
+DEFAULT_PERCENTILE = 95
+
+#: Maximum fraction of requests which may be hedged
+DEFAULT_BUDGET = 0.05
+
+#: Delay utilized until enough latencies have been recorded
+DEFAULT_INITIAL_DELAY = 1.0
+
+#: Amount of recent latencies kept per action
+DEFAULT_WINDOW = 1000
+
+#: Amount of latencies recorded between recalculations of the delay
+RECALCULATE_INTERVAL = 50
+
+class _Key(object):
+    def __init__(self, window, initial_delay):
+        self.latencies = deque(maxlen=window)
+        self.delay = initial_delay
+        self.recorded = 0
+
+
+class Hedger(object):
+    def __init__(self,
+                 percentile=DEFAULT_PERCENTILE,
+                 budget=DEFAULT_BUDGET,
+                 initial_delay=DEFAULT_INITIAL_DELAY,
+                 window=DEFAULT_WINDOW,
+                 idempotent_actions=IDEMPOTENT_ACTIONS):
+        """
+        :param percentile: The percentile of recent latencies to wait
+                           before hedging a request.
+        :param budget: Maximum fraction of requests which may be hedged
+        :param initial_delay: Seconds to wait before hedging until enough
+                              latencies have been recorded.
+        :param window: Amount of recent latencies to keep per action
+        :param idempotent_actions: Set of the (api_group, api_action)
+                                   combinations which may be hedged.
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.window = window
+        self.idempotent_actions = idempotent_actions
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def is_idempotent(self, api_group, api_action):
+        return (api_group, api_action) in self.idempotent_actions
+
+    def get_delay(self, key):
+        state = self._keys.get(key, None)
+        if state is None:
+            return self.initial_delay
+        return state.delay
+
+    def run(self, key, func):
+        """Call the function, and call it once more in case it has not
+        returned within the hedging delay of the key. The first result
+        which is not a failure wins.
+
+        :param key: Identifies the latency distribution, e.g the action
+        :param func: The function to call without arguments
+        """
+        with self._lock:
+            self.requests += 1
+
+        results = Queue.Queue()
+        self._attempt(key, 0, func, results)
+
+        try:
+            outcome = results.get(timeout=self.get_delay(key))
+        except Queue.Empty:
+            outcome = None
+
+        attempts = 1
+        if outcome is None and self._reserve_hedge():
+            attempts = 2
+            self._attempt(key, 1, func, results)
+
+        failures = 0
+        while True:
+            if outcome is None:
+                outcome = results.get()
+
+            index, succeeded, value = outcome
+            if succeeded or failures + 1 >= attempts:
+                break
+            # Wait for the other attempt rather than returning a failure
+            failures += 1
+            outcome = None
+
+        if index:
+            with self._lock:
+                self.hedge_wins += 1
+
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def get_metrics(self):
+        requests = self.requests or 1
+        hedges = self.hedges or 1
+        return {'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'hedge_rate': float(self.hedges) / requests,
+                'win_rate': float(self.hedge_wins) / hedges,
+                'delays': dict((key, state.delay)
+                               for key, state in self._keys.items())}
+
+    def _attempt(self, key, index, func, results):
+        def attempt():
+            started_at = time.time()
+            try:
+                value = func()
+                # Responses of failed requests lose, be it transport or
+                # HTTP errors, while answers of PayPal win either way.
+                succeeded = not (getattr(value, 'error', None) or
+                                 getattr(value, 'http_error', None))
+            except Exception as e:
+                value = e
+                succeeded = False
+            # Every attempt is recorded, including the slow ones which
+            # lost, since recording only the winners biases the delay low.
+            self._record(key, time.time() - started_at)
+            results.put((index, succeeded, value))
+
+        thread = threading.Thread(target=attempt)
+        thread.daemon = True
+        thread.start()
+
+    def _reserve_hedge(self):
+        with self._lock:
+            if self.hedges >= self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def _record(self, key, elapsed):
+        with self._lock:
+            state = self._keys.get(key, None)
+            if state is None:
+                state = self._keys[key] = _Key(self.window,
+                                               self.initial_delay)
+            state.latencies.append(elapsed)
+            state.recorded += 1
+            if state.recorded % RECALCULATE_INTERVAL:
+                return
+            latencies = sorted(state.latencies)
+
+        index = int(len(latencies) * self.percentile / 100.0)
+        state.delay = latencies[min(index, len(latencies) - 1)]
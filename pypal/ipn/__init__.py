@@ -1,19 +1,38 @@
 # -*- coding: utf-8 -*-
 
-import logging
 from pypal import Response, Client, util
-from pypal import nvp
+from pypal import nvp, trace
+
+logging = util.lazy_module('logging')
 
 VERIFICATION_RESPONSE = 'VERIFIED'
+INVALID_RESPONSE = 'INVALID'
 
 EVENT_ADAPTIVE = 'Adaptive Payment PAY'
+EVENT_PREAPPROVAL = 'Adaptive Payment PREAPPROVAL'
 EVENT_INVALID_NOTIFICATION = 'Invalid-notification'
 
-MODULE_MAPPING = {EVENT_ADAPTIVE: 'pay'}
+MODULE_MAPPING = {EVENT_ADAPTIVE: 'pay',
+                  EVENT_PREAPPROVAL: 'preapproval'}
+
+#: Response classes of the modules in MODULE_MAPPING once imported
+_response_classes = {}
+
+#: Identifies the verification postback in ``'pypal.hedging'``
+VERIFY_ACTION = ('IPN', '_notify-validate')
 
 PRODUCTION_ENDPOINT = 'https://www.paypal.com'
 SANDBOX_ENDPOINT = 'https://www.sandbox.paypal.com'
 
+#: Name of the IPN listener in ``'pypal.trace'``
+TRACE_SUBSYSTEM = 'ipn'
+
+class VerificationError(Exception):
+    """PayPal answered the verification postback with neither VERIFIED
+    nor INVALID.
+    """
+
+
 def parse(request_body):
     assert request_body
     return nvp.parse(request_body)
@@ -37,29 +56,57 @@ class Listener(object):
         for callback in callbacks:
             callback(*args, **kwargs)
 
-    def verify(self, request_body):
+    def verify(self, request_body, deadline=None):
+        """Verify the notification using the postback to PayPal. Returns
+        False only in case PayPal answers INVALID.
+
+        Raises ``'pypal.deadline.Timeout'`` in case PayPal does not answer
+        in time and ``'VerificationError'`` in case of any other answer;
+        the notification must not be acknowledged since PayPal resends it.
+        """
         endpoint = (PRODUCTION_ENDPOINT, SANDBOX_ENDPOINT)
         endpoint = endpoint[int(self.client.config.in_sandbox)]
 
         url = endpoint + '/cgi-bin/webscr'
         body = 'cmd=_notify-validate&%s' % request_body
 
-        response = self.client.send(url, body)
-        http_code = response.getcode()
-        raw_response = response.read()
-
-        if http_code == 200 and raw_response == VERIFICATION_RESPONSE:
+        def postback():
+            timeout = None
+            if deadline is not None:
+                timeout = deadline.get_timeout(self.client.config.timeout)
+            response = self.client.send(url, body, timeout=timeout)
+            return (response.getcode(), response.read())
+
+        hedger = getattr(self.client, 'hedger', None)
+        if hedger is not None and hedger.is_idempotent(*VERIFY_ACTION):
+            http_code, raw_response = hedger.run(VERIFY_ACTION, postback)
+        else:
+            http_code, raw_response = postback()
+
+        verified = (http_code == 200 and
+                    raw_response == VERIFICATION_RESPONSE)
+        if trace.enabled(TRACE_SUBSYSTEM):
+            trace.event(TRACE_SUBSYSTEM, 'verify', http_code=http_code,
+                        response=raw_response, verified=verified)
+
+        if verified:
             return True
 
+        if http_code != 200 or raw_response != INVALID_RESPONSE:
+            raise VerificationError('Unexpected answer to the verification '
+                                    'postback: HTTP %s %r'
+                                    % (http_code, raw_response[:100]))
+
         self.trigger(EVENT_INVALID_NOTIFICATION,
                      http_code,
                      request_body,
                      raw_response)
         return False
 
-    def dispatch(self, request_body):
-        arguments = parse(request_body)
-        if not self.verify(request_body):
+    def dispatch(self, request_body, deadline=None, arguments=None):
+        if arguments is None:
+            arguments = parse(request_body)
+        if not self.verify(request_body, deadline=deadline):
             return False
 
         event_name = self.get_response_event_type(arguments)
@@ -70,6 +117,10 @@ class Listener(object):
                                               request_body,
                                               arguments)
 
+        if trace.enabled(TRACE_SUBSYSTEM):
+            trace.event(TRACE_SUBSYSTEM, 'dispatch', event_name=event_name,
+                        arguments=arguments, handled=bool(response))
+
         if not response:
             return False
 
@@ -78,15 +129,20 @@ class Listener(object):
 
     @staticmethod
     def get_response_instance(event_name, request_body, arguments):
-        module_name = MODULE_MAPPING.get(event_name, None)
-        if not module_name:
-            return None
-
-        module_name = 'pypal.ipn.%s' % module_name
-        module_response = __import__(module_name, None, None, ['Response'], 0)
-        if not (module_response or hasattr(module_response, 'Response')):
-            return None
-        return module_response.Response(request_body, arguments)
+        cls = _response_classes.get(event_name, None)
+        if cls is None:
+            module_name = MODULE_MAPPING.get(event_name, None)
+            if not module_name:
+                return None
+
+            module_name = 'pypal.ipn.%s' % module_name
+            module_response = __import__(module_name, None, None,
+                                         ['Response'], 0)
+            cls = getattr(module_response, 'Response', None)
+            if cls is None:
+                return None
+            _response_classes[event_name] = cls
+        return cls(request_body, arguments)
 
     @staticmethod
     def get_response_event_type(response):
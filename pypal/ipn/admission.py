@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control and load shedding in front of ``'Listener.dispatch'``.
+
+Every notification takes a slot among a fixed amount of concurrent
+dispatches. Notifications which cannot be dispatched right away wait in
+a bounded queue ordered by priority, completed payments first. Once the
+queue is full the notification is shed and PayPal is answered with a
+retryable status code, which makes it redeliver the notification later
+instead of the listener running out of memory or workers. The same goes
+for notifications which could not be verified in time.
+"""
+
+import heapq
+import itertools
+import threading
+
+from pypal import util
+from pypal.deadline import Timeout
+from pypal.ipn import EVENT_ADAPTIVE, Listener, parse
+from pypal.metrics import Counters
+
+logging = util.lazy_module('logging')
+
+HTTP_OK = 200
+HTTP_SERVICE_UNAVAILABLE = 503
+
+PRIORITY_COMPLETED = 0
+PRIORITY_PAYMENT = 1
+PRIORITY_INFORMATIONAL = 2
+
+#: Notifications of these event types are considered to be payments
+PAYMENT_EVENTS = frozenset([EVENT_ADAPTIVE])
+
+#: Statuses of payment notifications which are dispatched first
+COMPLETED_STATUSES = frozenset(['COMPLETED', 'COMPLETE'])
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_QUEUE = 256
+
+#: Fraction of the queue informational notifications may occupy, which
+#: keeps room for payments when volume spikes.
+DEFAULT_INFORMATIONAL_RATIO = 0.75
+
+def get_priority(arguments):
+    """Return the priority of a parsed notification. Lower values are
+    dispatched first.
+    """
+    event_name = Listener.get_response_event_type(arguments)
+    if event_name not in PAYMENT_EVENTS:
+        return PRIORITY_INFORMATIONAL
+
+    status = arguments.get('status', None) or ''
+    if status.upper() in COMPLETED_STATUSES:
+        return PRIORITY_COMPLETED
+    return PRIORITY_PAYMENT
+
+
+class AdmissionController(object):
+    def __init__(self,
+                 listener,
+                 concurrency=DEFAULT_CONCURRENCY,
+                 max_queue=DEFAULT_MAX_QUEUE,
+                 informational_ratio=DEFAULT_INFORMATIONAL_RATIO,
+                 get_priority=get_priority):
+        """
+        :param listener: Instance of ``'pypal.ipn.Listener'``
+        :param concurrency: Maximum amount of concurrent dispatches
+        :param max_queue: Maximum amount of notifications waiting to be
+                          dispatched before notifications are shed.
+        :param informational_ratio: Fraction of the queue notifications of
+                                    informational priority may occupy.
+        :param get_priority: Function returning the priority of a parsed
+                             notification.
+        """
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+
+        self.listener = listener
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.informational_ratio = informational_ratio
+        self.get_priority = get_priority
+        self.metrics = Counters()
+        self._running = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def queue_depth(self):
+        return len(self._waiting)
+
+    def get_queue_limit(self, priority):
+        if priority >= PRIORITY_INFORMATIONAL:
+            return int(self.max_queue * self.informational_ratio)
+        return self.max_queue
+
+    def handle(self, request_body, deadline=None):
+        """Dispatch the notification unless it has to be shed and return
+        the HTTP status code to answer PayPal with.
+
+        :param request_body: The raw body of the IPN request
+        :param deadline: Instance of ``'pypal.deadline.Deadline'`` bounding
+                         both the time spent queued and the verification.
+        """
+        if not request_body:
+            return HTTP_OK
+
+        arguments = parse(request_body)
+        priority = self.get_priority(arguments)
+        if not self._admit(priority, deadline):
+            self.metrics.incr('shed')
+            self.metrics.incr('shed.%d' % priority)
+            return HTTP_SERVICE_UNAVAILABLE
+
+        self.metrics.incr('admitted')
+        try:
+            self.listener.dispatch(request_body,
+                                   deadline=deadline,
+                                   arguments=arguments)
+        except Timeout as e:
+            logging.warning('IPN verification aborted: %s', e)
+            self.metrics.incr('timeouts')
+            return HTTP_SERVICE_UNAVAILABLE
+        except Exception:
+            # Let PayPal redeliver the notification rather than lose it
+            logging.exception('IPN dispatch failed')
+            self.metrics.incr('failures')
+            return HTTP_SERVICE_UNAVAILABLE
+        finally:
+            self._leave()
+        return HTTP_OK
+
+    def get_metrics(self):
+        metrics = self.metrics.snapshot()
+        metrics.update(queue_depth=len(self._waiting), running=self._running)
+        return metrics
+
+    def _admit(self, priority, deadline):
+        with self._condition:
+            if self._running < self.concurrency and not self._waiting:
+                self._running += 1
+                return True
+
+            if len(self._waiting) >= self.get_queue_limit(priority):
+                return False
+
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+            while (self._running >= self.concurrency or
+                   self._waiting[0] != entry):
+                timeout = None
+                if deadline is not None:
+                    timeout = deadline.remaining()
+                    if timeout <= 0:
+                        self._waiting.remove(entry)
+                        heapq.heapify(self._waiting)
+                        self._condition.notify_all()
+                        return False
+                self._condition.wait(timeout)
+
+            heapq.heappop(self._waiting)
+            self._running += 1
+            # The next entry may be admitted as well if slots are left
+            self._condition.notify_all()
+            return True
+
+    def _leave(self):
+        with self._condition:
+            self._running -= 1
+            self._condition.notify_all()
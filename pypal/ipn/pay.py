@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from pypal.ipn import Response
+from pypal.util import convert_timestamp_into_utc
 
 
 STATUS_CREATED = 'CREATED'
@@ -55,6 +56,4 @@ class Response(Response):
         timestamp = self.get('payment_request_date', None)
         if not timestamp:
             return None
-
-        from pypal.util import convert_timestamp_into_utc
         return convert_timestamp_into_utc(timestamp)
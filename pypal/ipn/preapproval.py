@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+from pypal.ipn import Response
+from pypal.util import parse_iso_timestamp
+
+
+STATUS_ACTIVE = 'ACTIVE'
+STATUS_CANCELED = 'CANCELED'
+STATUS_DEACTIVED = 'DEACTIVED'
+
+class Response(Response):
+    @property
+    def preapproval_key(self):
+        return self.get('preapproval_key', None)
+
+    @property
+    def status(self):
+        return (self.get('status', None) or '').upper()
+
+    @property
+    def is_approved(self):
+        return (self.get('approved', None) or '').lower() == 'true'
+
+    @property
+    def is_status_active(self):
+        return self.status == STATUS_ACTIVE
+
+    @property
+    def is_status_canceled(self):
+        return self.status == STATUS_CANCELED
+
+    @property
+    def is_status_deactived(self):
+        return self.status == STATUS_DEACTIVED
+
+    def get_ending_timestamp(self):
+        return parse_iso_timestamp(self.get('ending_date', None))
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end latency tracking of payments, from the Pay call returning a
+pay key to the matching IPN notifications being dispatched.
+
+Payments are recorded when created and joined with incoming
+``'pypal.ipn.pay.Response'`` notifications by pay key, or tracking id,
+in a bounded in-memory index. Payments whose notification does not
+arrive within the deadline are flagged as missing.
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from pypal import trace, util
+from pypal.ipn import EVENT_ADAPTIVE
+from pypal.ipn.pay import STATUS_COMPLETED
+from pypal.metrics import Counters, Histogram
+
+logging = util.lazy_module('logging')
+
+#: Name of the payment tracker in ``'pypal.trace'``
+TRACE_SUBSYSTEM = 'ipn.tracking'
+
+DEFAULT_MAX_PAYMENTS = 10000
+
+#: Seconds to wait for the first notification of a payment
+DEFAULT_IPN_DEADLINE = 3600
+
+class Payment(object):
+    __slots__ = ('pay_key', 'tracking_id', 'correlation_id', 'status',
+                 'created_at', 'notified_at', 'completed_at', 'missing')
+
+    def __init__(self, pay_key, tracking_id=None, correlation_id=None,
+                 status=None, created_at=None):
+        self.pay_key = pay_key
+        self.tracking_id = tracking_id
+        self.correlation_id = correlation_id
+        self.status = status
+        self.created_at = created_at or time.time()
+        self.notified_at = None
+        self.completed_at = None
+        self.missing = False
+
+
+class PaymentTracker(object):
+    def __init__(self,
+                 max_payments=DEFAULT_MAX_PAYMENTS,
+                 ipn_deadline=DEFAULT_IPN_DEADLINE):
+        """
+        :param max_payments: Maximum amount of payments kept in the index.
+                             The oldest payment is evicted first.
+        :param ipn_deadline: Seconds after which a payment without any
+                             notification is flagged as missing.
+        """
+        self.max_payments = max_payments
+        self.ipn_deadline = ipn_deadline
+        self.metrics = Counters()
+        #: Seconds from creation to the first notification
+        self.ipn_delay = Histogram()
+        #: Seconds from creation to the notification of completion
+        self.completion = Histogram()
+        #: Seconds from creation until the callbacks of the completion
+        #: notification have finished.
+        self.callbacks = Histogram()
+        self._payments = OrderedDict()
+        self._tracking_ids = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._payments)
+
+    def get(self, pay_key=None, tracking_id=None):
+        if pay_key is None:
+            pay_key = self._tracking_ids.get(tracking_id, None)
+        return self._payments.get(pay_key, None)
+
+    def record(self, response, tracking_id=None):
+        """Record the payment created by a successful Pay call.
+
+        :param response: The ``'pypal.Response'`` of the Pay call
+        :param tracking_id: The trackingId sent along with the call
+        """
+        pay_key = response.get('payKey', None)
+        if not pay_key:
+            return None
+
+        payment = Payment(pay_key,
+                          tracking_id=tracking_id,
+                          correlation_id=response.get_correlation_id(),
+                          status=response.get('paymentExecStatus', None))
+
+        with self._lock:
+            self._payments[pay_key] = payment
+            if tracking_id:
+                self._tracking_ids[tracking_id] = pay_key
+            while len(self._payments) > self.max_payments:
+                self._evict()
+        self.metrics.incr('recorded')
+
+        if trace.enabled(TRACE_SUBSYSTEM):
+            trace.event(TRACE_SUBSYSTEM, 'created', pay_key=pay_key,
+                        tracking_id=tracking_id,
+                        correlation_id=payment.correlation_id)
+        return payment
+
+    def observe(self, notification):
+        """Join the ``'pypal.ipn.pay.Response'`` notification with its
+        recorded payment. Returns the payment or None if unknown.
+        """
+        payment = self._find(notification)
+        if payment is None:
+            self.metrics.incr('unknown')
+            return None
+
+        now = time.time()
+        status = notification.get('status', None)
+        if status:
+            payment.status = status.upper()
+
+        if payment.notified_at is None:
+            payment.notified_at = now
+            self.ipn_delay.observe(now - payment.created_at)
+            if payment.missing:
+                self.metrics.incr('late')
+
+        if (payment.status == STATUS_COMPLETED and
+                payment.completed_at is None):
+            payment.completed_at = now
+            self.completion.observe(now - payment.created_at)
+
+        self.metrics.incr('notified')
+        if trace.enabled(TRACE_SUBSYSTEM):
+            trace.event(TRACE_SUBSYSTEM, 'notified',
+                        pay_key=payment.pay_key, status=payment.status,
+                        latency=now - payment.created_at)
+        return payment
+
+    def finish(self, notification):
+        """Record that the callbacks of the notification have finished."""
+        payment = self._find(notification)
+        if payment is None or payment.completed_at is None:
+            return
+        self.callbacks.observe(time.time() - payment.created_at)
+
+    def attach(self, listener):
+        """Observe the payment notifications dispatched by the listener.
+        Should be called once the other callbacks have been added, which
+        makes ``'finish'`` run after them.
+
+        :param listener: Instance of ``'pypal.ipn.Listener'``
+        """
+        callbacks = listener.callbacks.setdefault(EVENT_ADAPTIVE, [])
+        callbacks.insert(0, self.observe)
+        callbacks.append(self.finish)
+
+    def check_missing(self, now=None):
+        """Flag and return the payments which have not received any
+        notification within the deadline.
+        """
+        now = now or time.time()
+        threshold = now - self.ipn_deadline
+        ret = []
+        with self._lock:
+            for payment in self._payments.values():
+                if payment.created_at > threshold:
+                    # Payments are ordered by creation
+                    break
+                if payment.notified_at is None and not payment.missing:
+                    payment.missing = True
+                    ret.append(payment)
+
+        for payment in ret:
+            self.metrics.incr('missing')
+            logging.warning('No IPN received for payment %s within %s '
+                            'seconds', payment.pay_key, self.ipn_deadline)
+            if trace.enabled(TRACE_SUBSYSTEM, trace.LEVEL_WARNING):
+                trace.event(TRACE_SUBSYSTEM, 'missing',
+                            level=trace.LEVEL_WARNING, pay_key=payment.pay_key,
+                            tracking_id=payment.tracking_id,
+                            correlation_id=payment.correlation_id)
+        return ret
+
+    def get_metrics(self):
+        metrics = self.metrics.snapshot()
+        metrics.update(payments=len(self._payments),
+                       ipn_delay=self.ipn_delay.snapshot(),
+                       completion=self.completion.snapshot(),
+                       callbacks=self.callbacks.snapshot())
+        return metrics
+
+    def _find(self, notification):
+        payment = self._payments.get(notification.get('pay_key', None))
+        if payment is None:
+            payment = self.get(tracking_id=notification.get('tracking_id',
+                                                            None))
+        return payment
+
+    def _evict(self):
+        pay_key, payment = self._payments.popitem(last=False)
+        if payment.tracking_id:
+            self._tracking_ids.pop(payment.tracking_id, None)
+        if payment.notified_at is None:
+            self.metrics.incr('evicted_unnotified')
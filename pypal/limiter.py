@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Client side rate limiting and adaptive concurrency control.
+
+Every API group and endpoint combination is given its own token bucket,
+limiting the sustained request rate, along with a concurrency limit which
+is adjusted using additive increase / multiplicative decrease (AIMD).
+Successful responses slowly raise the limit while failure acks and HTTP
+errors cut it, which keeps the client just below the rate at which
+PayPal starts to throttle.
+
+Requests exceeding the limits are either queued or rejected depending
+on configuration. Rejected calls result in a failed ``'pypal.Response'``
+which has its error set to an instance of ``'RateLimited'``.
+"""
+
+import threading
+import time
+
+DEFAULT_INITIAL_LIMIT = 8
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 64
+
+#: Factor the concurrency limit is multiplied by on failure
+DEFAULT_BACKOFF = 0.5
+
+class RateLimited(Exception):
+    """Raised when a call is rejected by the limiter."""
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Amount of tokens added per second
+        :param capacity: Maximum amount of tokens, i.e the allowed burst.
+                         Defaults to the rate.
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """Take a token if one is available without waiting."""
+        with self._lock:
+            self._refill(time.time())
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def reserve(self):
+        """Take a token and return the amount of seconds to wait before
+        it may be utilized.
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class _State(object):
+    def __init__(self, limit, bucket):
+        self.limit = float(limit)
+        self.bucket = bucket
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+        self.condition = threading.Condition()
+
+
+class Limiter(object):
+    def __init__(self,
+                 rate=None,
+                 burst=None,
+                 initial_limit=DEFAULT_INITIAL_LIMIT,
+                 min_limit=DEFAULT_MIN_LIMIT,
+                 max_limit=DEFAULT_MAX_LIMIT,
+                 backoff=DEFAULT_BACKOFF,
+                 block=True,
+                 max_queue=None):
+        """
+        :param rate: Maximum amount of requests per second per key,
+                     unlimited if not given.
+        :param burst: Maximum amount of requests sent in a burst
+        :param initial_limit: The initial amount of concurrent requests
+        :param min_limit: Lower bound of the concurrency limit
+        :param max_limit: Upper bound of the concurrency limit
+        :param backoff: Factor to multiply the limit with on failure
+        :param block: Whether to queue calls exceeding the limits or
+                      to reject them right away.
+        :param max_queue: Maximum amount of queued calls per key before
+                          further calls are rejected.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.block = block
+        self.max_queue = max_queue
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get_state(self, key):
+        state = self._states.get(key, None)
+        if state is not None:
+            return state
+
+        with self._lock:
+            if key not in self._states:
+                bucket = None
+                if self.rate:
+                    bucket = TokenBucket(self.rate, self.burst)
+                self._states[key] = _State(self.initial_limit, bucket)
+            return self._states[key]
+
+    def acquire(self, key, block=None):
+        """Wait for permission to send a request, raises ``'RateLimited'``
+        in case the request is rejected.
+
+        :param key: Identifies the limits, e.g (api_group, endpoint)
+        :param block: Override whether to queue or reject the request
+        """
+        if block is None:
+            block = self.block
+
+        state = self.get_state(key)
+        with state.condition:
+            if state.in_flight >= int(state.limit):
+                queue_full = (self.max_queue is not None and
+                              state.waiting >= self.max_queue)
+                if not block or queue_full:
+                    state.rejected += 1
+                    raise RateLimited('Concurrency limit (%d) of %s '
+                                      'reached' % (state.limit, key))
+
+                state.waiting += 1
+                try:
+                    while state.in_flight >= int(state.limit):
+                        state.condition.wait()
+                finally:
+                    state.waiting -= 1
+            state.in_flight += 1
+
+        if not state.bucket:
+            return
+
+        if not block:
+            if state.bucket.try_acquire():
+                return
+            self._release_slot(state)
+            with state.condition:
+                state.rejected += 1
+            raise RateLimited('Request rate of %s exceeded' % (key,))
+
+        delay = state.bucket.reserve()
+        if delay:
+            time.sleep(delay)
+
+    def release(self, key, success):
+        """Return the permission acquired and adjust the concurrency limit
+        depending on the outcome of the request.
+
+        :param key: Identifies the limits, e.g (api_group, endpoint)
+        :param success: Whether the request succeeded
+        """
+        state = self.get_state(key)
+        with state.condition:
+            if success:
+                state.successes += 1
+                state.limit = min(self.max_limit,
+                                  state.limit + 1.0 / state.limit)
+            else:
+                state.failures += 1
+                state.limit = max(self.min_limit,
+                                  state.limit * self.backoff)
+        self._release_slot(state)
+
+    def _release_slot(self, state):
+        with state.condition:
+            state.in_flight -= 1
+            state.condition.notify_all()
+
+    def get_metrics(self):
+        """Retrieve dictionary of the current state per key."""
+        ret = {}
+        for key, state in self._states.items():
+            ret[key] = {'limit': int(state.limit),
+                        'in_flight': state.in_flight,
+                        'queue_depth': state.waiting,
+                        'rejected': state.rejected,
+                        'successes': state.successes,
+                        'failures': state.failures}
+        return ret
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight instrumentation shared by the components of pypal.
+"""
+
+import bisect
+import threading
+
+class Counters(object):
+    """Thread-safe collection of named counters."""
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def get(self, name):
+        return self._values.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+#: Upper bounds in seconds of the buckets of a ``'Histogram'``
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+
+class Histogram(object):
+    """Thread-safe histogram of observed values in fixed buckets."""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = None
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += value
+            if self._max is None or value > self._max:
+                self._max = value
+
+    @property
+    def count(self):
+        return self._count
+
+    def get_percentile(self, percentile):
+        """Return the upper bound of the bucket containing the given
+        percentile, or None in case nothing has been observed.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            count = self._count
+            maximum = self._max
+
+        if not count:
+            return None
+
+        rank = count * percentile / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return maximum
+                return min(self.buckets[index], maximum)
+        return maximum
+
+    def snapshot(self):
+        with self._lock:
+            count = self._count
+            ret = {'count': count,
+                   'sum': self._sum,
+                   'max': self._max,
+                   'mean': self._sum / count if count else None,
+                   'buckets': dict(zip(self.buckets + ('inf',),
+                                       self._counts))}
+        for percentile in (50, 90, 99):
+            ret['p%d' % percentile] = self.get_percentile(percentile)
+        return ret
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._count = 0
+            self._sum = 0.0
+            self._max = None
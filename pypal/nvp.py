@@ -11,12 +11,14 @@ encoded / decoded according to the PayPal standards.
 For more information regarding this format read the PayPal NVP documentation::
     http://bit.ly/ssWiEH
 """
-import logging
+from pypal import trace
+from pypal.util import lazy_module
 
-from urlparse import parse_qs
-from urllib import urlencode
+urllib = lazy_module('urllib')
+urlparse = lazy_module('urlparse')
 
-DO_LOG = False
+#: Name of this module in ``'pypal.trace'``
+TRACE_SUBSYSTEM = 'nvp'
 
 #: The string which we should split all keys by in order to
 #: retreive the hierarchical structure intended by PayPal.
@@ -32,10 +34,9 @@ KEY_LIST_CLOSE_INDICATORS = frozenset([']', ')'])
 KEY_LIST_INDICATOR_MAPPING = {']': '[',
                               ')': '('}
 
-def log(message, *args):
-    if not DO_LOG:
-        return
-    logging.debug(message, *args)
+#: The prefix of the indexed fields utilized by the classic NVP API,
+#: e.g L_EMAIL0 and L_AMT0.
+INDEXED_KEY_PREFIX = 'L_'
 
 def parse(response):
     """Iterate through the one-level deep dictionary and construct another
@@ -53,7 +54,7 @@ def parse(response):
                      by previously parsing the response using the parse function.
     """
     if not isinstance(response, dict):
-        response = parse_qs(response)
+        response = urlparse.parse_qs(response)
 
     dictionary = {}
     for k, v in response.items():
@@ -62,14 +63,68 @@ def parse(response):
     return dictionary
 
 def render(dictionary):
-    log('%s: Pre-render: %s' % (id(dictionary), dictionary))
-    dictionary = _prepare_hierarchical_rendering(dictionary)
-    log('%s: Render: %s' % (id(dictionary), dictionary))
-    generated = urlencode(dictionary)
-    log('%s: Generated %s' % (id(dictionary), dictionary))
+    pairs = _prepare_hierarchical_rendering(dictionary)
+    generated = urllib.urlencode(pairs)
+    if trace.enabled(TRACE_SUBSYSTEM):
+        trace.event(TRACE_SUBSYSTEM, 'render', params=dictionary,
+                    pairs=pairs, size=len(generated))
     return generated
 
-def _prepare_hierarchical_rendering(source, target=[], prefix=''):
+def render_indexed(rows, fields, prefix=INDEXED_KEY_PREFIX, start=0):
+    """Render a sequence of rows directly into the indexed format utilized
+    by the classic NVP API, e.g ``L_EMAIL0=...&L_AMT0=...&L_EMAIL1=...``.
+
+    Empty values are omitted.
+
+    :param rows: Iterable of dictionaries
+    :param fields: Sequence of tuples containing the key of the value in
+                   each row and the name of the NVP field, e.g
+                   ``('amount', 'AMT')``.
+    :param prefix: The prefix of all indexed fields
+    :param start: The index of the first row
+    """
+    quote = urllib.quote_plus
+    parts = []
+    append = parts.append
+    for index, row in enumerate(rows, start):
+        for key, name in fields:
+            value = row.get(key, None)
+            if value is None or value == '':
+                continue
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            append('%s%s%d=%s' % (prefix, name, index, quote(str(value))))
+    return '&'.join(parts)
+
+def parse_indexed(response, fields, prefix=INDEXED_KEY_PREFIX):
+    """Retrieve list of the rows contained in a response of the classic NVP
+    API, i.e the inverse of ``'render_indexed'``. Rows are read in order
+    until none of the fields are present for an index.
+
+    :param response: Dictionary retrieved by parsing the response
+    :param fields: Sequence of the NVP field names to read, e.g AMT
+    :param prefix: The prefix of all indexed fields
+    """
+    return list(iter_indexed(response, fields, prefix=prefix))
+
+def iter_indexed(response, fields, prefix=INDEXED_KEY_PREFIX):
+    """Generator version of ``'parse_indexed'``."""
+    index = 0
+    while True:
+        row = {}
+        for name in fields:
+            value = response.get('%s%s%d' % (prefix, name, index), None)
+            if value is not None:
+                row[name] = value
+        if not row:
+            return
+        yield row
+        index += 1
+
+def _prepare_hierarchical_rendering(source, target=None, prefix=''):
+    if target is None:
+        target = []
+
     if isinstance(source, (list, tuple, set, frozenset)):
         index = 0
         for inner_value in source:
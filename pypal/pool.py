@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of persistent HTTP connections utilized by ``'pypal.Client'``.
+
+Connections are kept per scheme and host which allows a single pool to be
+shared by any amount of clients, e.g one per merchant configuration,
+as long as they target the same endpoints.
+
+Pools are fork-aware. Connections opened before a fork are dropped by
+the child rather than shared with the parent.
+"""
+
+import os
+import threading
+import time
+import zlib
+
+from pypal.deadline import Timeout
+from pypal.util import lazy_module
+
+httplib = lazy_module('httplib')
+select = lazy_module('select')
+socket = lazy_module('socket')
+ssl = lazy_module('ssl')
+urllib2 = lazy_module('urllib2')
+StringIO = lazy_module('StringIO')
+urlparse = lazy_module('urlparse')
+
+#: Maximum amount of idle connections kept per host
+DEFAULT_MAX_IDLE = 10
+
+#: Amount of seconds an idle connection is kept before being discarded
+#: rather than risking reuse of a connection closed by PayPal.
+DEFAULT_IDLE_TIMEOUT = 30
+
+#: Name of the httplib connection class utilized per URL scheme
+CONNECTION_CLASSES = {'http': 'HTTPConnection',
+                      'https': 'HTTPSConnection'}
+
+#: Content encodings which are decoded transparently
+SUPPORTED_ENCODINGS = frozenset(['gzip', 'deflate'])
+
+#: Amount of compressed bytes read per chunk when streaming
+CHUNK_SIZE = 16384
+
+#: Content-Type sent unless given, as done by ``'urllib2.urlopen'``
+DEFAULT_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+def is_timeout_error(error):
+    if isinstance(error, socket.timeout):
+        return True
+    # Timeouts on SSL sockets are raised as generic SSL errors
+    return isinstance(error, ssl.SSLError) and 'timed out' in str(error)
+
+def is_transport_error(error):
+    return isinstance(error, (socket.error, httplib.HTTPException))
+
+def is_connection_dropped(connection):
+    """Check whether an idle connection has been closed by the server.
+    Nothing is expected to be received while idle, hence a readable
+    socket means it has reached EOF or is in an unknown state.
+    """
+    if connection.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (select.error, ValueError):
+        return True
+    return bool(readable)
+
+class PooledResponse(object):
+    """Wraps the response retrieved using a pooled connection in order to
+    mimic the interface of the responses returned by ``'urllib2.urlopen'``.
+    The connection is returned to the pool once the body has been read.
+
+    Bodies compressed using gzip or deflate are decoded while being read.
+    The amount of bytes received and decoded are kept in
+    ``'bytes_received'`` and ``'bytes_decoded'``.
+    """
+    def __init__(self, pool, key, connection, response):
+        self.pool = pool
+        self.key = key
+        self.pid = os.getpid()
+        self.connection = connection
+        self.response = response
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+
+        self.decoder = None
+        encoding = (response.getheader('content-encoding') or '').lower()
+        if encoding in SUPPORTED_ENCODINGS:
+            # Automatically detects both gzip and zlib headers
+            self.decoder = zlib.decompressobj(32 + zlib.MAX_WBITS)
+
+    def read(self, amt=None):
+        """Read the response body. When the body is compressed the amount
+        given is a hint; a decoded chunk of arbitrary size is returned.
+        """
+        if self.decoder is None:
+            data = self._read_raw(amt)
+            self.bytes_received += len(data)
+            self.bytes_decoded += len(data)
+            return data
+
+        while True:
+            raw = self._read_raw(CHUNK_SIZE if amt is not None else None)
+            self.bytes_received += len(raw)
+            if raw:
+                data = self.decoder.decompress(raw)
+            else:
+                data = self.decoder.flush()
+
+            if amt is None and raw:
+                data += self.decoder.flush()
+            # Keep reading in case the decoder buffered the entire chunk
+            # since an empty string would otherwise signal the end.
+            if data or not raw:
+                self.bytes_decoded += len(data)
+                return data
+
+    def _read_raw(self, amt):
+        try:
+            if amt is None:
+                data = self.response.read()
+            else:
+                data = self.response.read(amt)
+        except Exception as e:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+            if is_timeout_error(e):
+                raise Timeout('Timed out reading the response: %s' % e)
+            raise
+
+        if self.response.isclosed():
+            self._release()
+        return data
+
+    def getcode(self):
+        return self.response.status
+
+    def info(self):
+        return self.response.msg
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def close(self):
+        if not self.connection:
+            return
+        if not self.response.isclosed():
+            # Unread data remains on the socket; it cannot be reused.
+            self.connection.close()
+            self.connection = None
+            return
+        self._release()
+
+    def _release(self):
+        if not self.connection:
+            return
+        connection, self.connection = self.connection, None
+        if self.response.will_close:
+            connection.close()
+            return
+        self.pool.put_connection(self.key, connection, pid=self.pid)
+
+
+class ConnectionPool(object):
+    def __init__(self,
+                 max_idle=DEFAULT_MAX_IDLE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """
+        :param max_idle: Maximum amount of idle connections per host
+        :param idle_timeout: Amount of seconds before idle connections
+                             are discarded.
+        """
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        """Drop the connections inherited from the parent in case the
+        process has been forked since they were opened.
+        """
+        if self._pid == os.getpid():
+            return
+        # The sockets are shared with the parent; closing them could
+        # interfere with its requests, hence they are merely dropped.
+        # The lock is replaced since it might have been held by a thread
+        # which does not exist in the child.
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get_connection(self, key, timeout=None):
+        """Retrieve an idle connection to given host or open a new one.
+
+        :param key: Tuple of the scheme and network location
+        :param timeout: The socket timeout to set on the connection
+        """
+        self._check_pid()
+        connection = None
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, None)
+            while idle:
+                candidate, released_at = idle.pop()
+                if (now - released_at <= self.idle_timeout and
+                        not is_connection_dropped(candidate)):
+                    connection = candidate
+                    break
+                candidate.close()
+
+        if connection is None:
+            scheme, netloc = key
+            cls = getattr(httplib, CONNECTION_CLASSES[scheme])
+            return cls(netloc, timeout=timeout)
+
+        connection.timeout = timeout
+        if connection.sock:
+            connection.sock.settimeout(timeout)
+        return connection
+
+    def put_connection(self, key, connection, pid=None):
+        """Return the connection to the pool.
+
+        :param pid: The id of the process the connection was opened in,
+                    connections of other processes are discarded.
+        """
+        self._check_pid()
+        if pid is not None and pid != self._pid:
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def connect(self, url, timeout=None):
+        """Open a connection to the host of given URL and keep it idle in
+        the pool, which resolves the host and completes the TCP and TLS
+        handshakes ahead of the first request.
+
+        :param url: Any URL of the host
+        :param timeout: The socket timeout in seconds
+        """
+        parts = urlparse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        connection = self.get_connection(key, timeout=timeout)
+        try:
+            if connection.sock is None:
+                connection.connect()
+        except Exception as e:
+            connection.close()
+            if is_timeout_error(e):
+                raise Timeout('No connection within %s seconds: %s'
+                              % (timeout, e))
+            if is_transport_error(e):
+                raise urllib2.URLError(e)
+            raise
+        self.put_connection(key, connection)
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection, released_at in connections:
+                connection.close()
+
+    def urlopen(self, url, body, headers, timeout=None):
+        """Send a POST request using a pooled connection.
+
+        Raises ``'urllib2.HTTPError'`` on error status codes and
+        ``'urllib2.URLError'`` on transport errors in order to behave like
+        ``'urllib2.urlopen'``, and ``'pypal.deadline.Timeout'`` in case no
+        response is received within the timeout.
+
+        Idle connections may have been closed by the server in the
+        meantime. A request which fails to be sent on a reused connection
+        is therefore sent once more using a new connection. Requests are
+        never sent again once fully written, since PayPal might already
+        have executed them.
+
+        :param url: The URL to send the request to
+        :param body: The HTTP request body
+        :param headers: Dictionary of HTTP headers
+        :param timeout: The socket timeout in seconds
+        """
+        parts = urlparse.urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path = '%s?%s' % (path, parts.query)
+
+        headers = dict(headers or {})
+        if not any(name.lower() == 'content-type' for name in headers):
+            headers['Content-Type'] = DEFAULT_CONTENT_TYPE
+
+        key = (parts.scheme, parts.netloc)
+        retried = False
+        while True:
+            connection = self.get_connection(key, timeout=timeout)
+            reused = connection.sock is not None
+            sent = False
+            try:
+                connection.request('POST', path, body, headers)
+                sent = True
+                response = connection.getresponse()
+                break
+            except Exception as e:
+                connection.close()
+                if is_timeout_error(e):
+                    raise Timeout('No response within %s seconds: %s'
+                                  % (timeout, e))
+                if not is_transport_error(e):
+                    raise
+                if reused and not sent and not retried:
+                    # Most likely closed by the server while idle
+                    retried = True
+                    continue
+                raise urllib2.URLError(e)
+
+        pooled = PooledResponse(self, key, connection, response)
+        if response.status >= 400:
+            # Read the error body right away in order to release the
+            # connection no matter whether the caller reads it or not.
+            body = StringIO.StringIO(pooled.read())
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.msg, body)
+        return pooled
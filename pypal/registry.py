@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of clients for processes acting on behalf of many merchants,
+i.e one ``'pypal.settings.Config'`` per merchant or application credential.
+
+Equal configurations are interned into a single frozen instance and all
+clients share one connection pool, which keeps connections per endpoint.
+Every tenant may be given a concurrency quota and the least recently used
+tenants are evicted once the registry is full.
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from pypal import Client, settings
+from pypal.pool import ConnectionPool
+
+DEFAULT_MAX_TENANTS = 1024
+
+class ClientRegistry(object):
+    def __init__(self,
+                 max_tenants=DEFAULT_MAX_TENANTS,
+                 max_concurrency=None,
+                 pool=None):
+        """
+        :param max_tenants: Maximum amount of clients to keep
+        :param max_concurrency: Maximum amount of concurrent calls
+                                per tenant, unlimited if not given.
+        :param pool: The ``'pypal.pool.ConnectionPool'`` to share
+        """
+        self.max_tenants = max_tenants
+        self.max_concurrency = max_concurrency
+        self.pool = pool or ConnectionPool()
+        self._configs = {}
+        self._clients = OrderedDict()
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, config):
+        return config in self._clients
+
+    def intern(self, config):
+        """Retrieve the frozen configuration equal to given one.
+
+        :param config: Instance of ``'pypal.settings.Config'``
+        """
+        with self._lock:
+            return self._intern(config)
+
+    def get(self, config=None, **kwargs):
+        """Retrieve the client of given configuration, creating it in
+        case the tenant is not yet registered.
+
+        :param config: Instance of ``'pypal.settings.Config'``
+        :param kwargs: Key-value pairs passed along to a new instance of
+                       ``'pypal.settings.Config'`` in case the config
+                       argument was not given.
+        """
+        if not config:
+            config = settings.Config(**kwargs)
+
+        with self._lock:
+            config = self._intern(config)
+            client = self._clients.pop(config, None)
+            if client is None:
+                client = self._create_client(config)
+            self._clients[config] = client
+            self._last_used[config] = time.time()
+
+            while len(self._clients) > self.max_tenants:
+                self._evict(next(iter(self._clients)))
+        return client
+
+    def evict(self, config):
+        with self._lock:
+            return self._evict(config)
+
+    def evict_idle(self, max_idle):
+        """Evict all tenants which have not been retrieved within
+        given amount of seconds. Returns the amount of evicted tenants.
+
+        :param max_idle: Amount of seconds
+        """
+        threshold = time.time() - max_idle
+        evicted = 0
+        with self._lock:
+            for config in list(self._clients):
+                if self._last_used[config] >= threshold:
+                    break
+                self._evict(config)
+                evicted += 1
+        return evicted
+
+    def _intern(self, config):
+        interned = self._configs.get(config, None)
+        if interned is not None:
+            return interned
+
+        config.freeze()
+        self._configs[config] = config
+        return config
+
+    def _create_client(self, config):
+        client = Client(config, pool=self.pool)
+        if self.max_concurrency:
+            client.quota = threading.BoundedSemaphore(self.max_concurrency)
+        return client
+
+    def _evict(self, config):
+        client = self._clients.pop(config, None)
+        self._last_used.pop(config, None)
+        self._configs.pop(config, None)
+        return client is not None
@@ -1,9 +1,19 @@
 # -*- coding: utf-8 -*-
 
-import logging
+import binascii
+import os
+import threading
+import time
 
-from pypal import currency
-from pypal.util import check_required, set_nonempty_param
+from decimal import Decimal, ROUND_HALF_UP
+
+from pypal import Response, currency, util
+from pypal.deadline import Timeout
+from pypal.store import Store
+from pypal.util import check_required, parse_iso_timestamp, set_nonempty_param
+
+logging = util.lazy_module('logging')
+urllib2 = util.lazy_module('urllib2')
 
 PRODUCTION_ENDPOINT = 'https://svcs.paypal.com'
 SANDBOX_ENDPOINT = 'https://svcs.sandbox.paypal.com'
@@ -35,6 +45,76 @@ EXECUTE_STATUS_REVERSAL_ERROR = 'REVERSALERROR'
 EXECUTE_STATUS_PROCESSING = 'PROCESSING'
 EXECUTE_STATUS_PENDING = 'PENDING'
 
+#: Statuses of payments which never change once reached
+FINAL_EXECUTE_STATUSES = frozenset([EXECUTE_STATUS_COMPLETED,
+                                    EXECUTE_STATUS_ERROR,
+                                    EXECUTE_STATUS_REVERSAL_ERROR])
+
+#: Seconds after which the indexed status of a payment is refreshed
+PAYMENT_STATUS_TTL = 300
+
+REFUND_STATUS_REFUNDED = 'REFUNDED'
+REFUND_STATUS_PENDING = 'REFUNDED_PENDING'
+REFUND_STATUS_ALREADY_REFUNDED = 'ALREADY_REVERSED_OR_REFUNDED'
+
+#: Refund statuses of receivers whose part of the payment has been refunded
+SUCCESSFUL_REFUND_STATUSES = frozenset([REFUND_STATUS_REFUNDED,
+                                        REFUND_STATUS_PENDING,
+                                        REFUND_STATUS_ALREADY_REFUNDED])
+
+PREAPPROVAL_STATUS_ACTIVE = 'ACTIVE'
+PREAPPROVAL_STATUS_CANCELED = 'CANCELED'
+PREAPPROVAL_STATUS_DEACTIVED = 'DEACTIVED'
+
+#: Fields of PreapprovalDetails responses mapped to their local names
+PREAPPROVAL_DETAILS_FIELDS = {'senderEmail': 'buyer',
+                              'currencyCode': 'currency_code',
+                              'status': 'status',
+                              'maxTotalAmountOfAllPayments': 'max_total',
+                              'maxAmountPerPayment': 'max_per_payment',
+                              'curPaymentsAmount': 'spent',
+                              'curPayments': 'payments',
+                              'maxNumberOfPayments': 'max_payments'}
+
+#: Fields of preapproval IPN notifications mapped to their local names
+PREAPPROVAL_NOTIFICATION_FIELDS = {
+    'sender_email': 'buyer',
+    'currency_code': 'currency_code',
+    'status': 'status',
+    'max_total_amount_of_all_payments': 'max_total',
+    'max_amount_per_payment': 'max_per_payment',
+    'current_total_amount_of_all_payments': 'spent',
+    'current_number_of_payments': 'payments',
+    'max_number_of_payments': 'max_payments'}
+
+LEDGER_STATE_PENDING = 'pending'
+LEDGER_STATE_CREATED = 'created'
+LEDGER_STATE_FAILED = 'failed'
+
+#: Name of the parameter in the errors PayPal answers with in case a
+#: tracking id is invalid, e.g since it has already been utilized.
+TRACKING_ID_PARAMETER = 'trackingId'
+
+#: Amount of times ``'pay_once'`` retries after transient failures
+DEFAULT_PAY_RETRIES = 2
+
+#: Seconds to wait before the first retry, doubled on every retry
+DEFAULT_PAY_BACKOFF = 0.2
+
+#: Seconds after which cached exchange rates are refreshed in the background
+RATE_CACHE_REFRESH_AFTER = 900
+
+#: Seconds after which cached exchange rates are refreshed before use
+RATE_CACHE_MAX_AGE = 3600
+
+#: Seconds a failure to refresh the exchange rates is remembered before
+#: they are fetched again, during which stale rates keep being utilized.
+RATE_CACHE_FAILURE_TTL = 30
+
+#: Amount of each currency converted in order to determine the rates; large
+#: enough for the rounding of the converted amounts not to skew the rates.
+RATE_BASE_AMOUNT = 10000
+
 ##############################################################################
 # FUNCTIONS WHICH FURTHER AIDS IMPLEMENTATION OF THIS SERVICE
 ##############################################################################
@@ -54,8 +134,11 @@ class ReceiverList(list):
         if not email and not amount:
             return False
 
+        if isinstance(amount, currency.Money):
+            amount = amount.format()
+
         sanitized = {'email': obj.get('email'),
-                     'amount': obj.get('amount'),
+                     'amount': amount,
                      'primary': obj.get('primary', 'false')}
         super(type(self), self).append(sanitized)
 
@@ -63,7 +146,551 @@ class ReceiverList(list):
         for obj in iterable:
             self.append(obj)
 
-def call(client, method, params):
+def ensure_list(value):
+    """Ensure repeated response elements are a list, since single
+    elements are not wrapped in one by every format.
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+class RateCache(object):
+    """Cache of the exchange rates between currencies.
+
+    The full matrix of rates is fetched using a single ConvertCurrency
+    API call and conversions are answered from memory. Once the rates
+    are older than ``'refresh_after'`` they keep being utilized while
+    refreshed in the background, until they are older than ``'max_age'``.
+    In case PayPal cannot be reached the stale rates keep being utilized,
+    and no refresh is attempted until the failure TTL has passed.
+    """
+    def __init__(self,
+                 client,
+                 codes=currency.ALL_CODES,
+                 refresh_after=RATE_CACHE_REFRESH_AFTER,
+                 max_age=RATE_CACHE_MAX_AGE,
+                 failure_ttl=RATE_CACHE_FAILURE_TTL):
+        """
+        :param client: An instance of ``'pypal.Client'``
+        :param codes: The currency codes to fetch the rates between
+        :param refresh_after: Seconds after which the rates are refreshed
+                              in the background.
+        :param max_age: Seconds after which the rates are refreshed before
+                        answering any conversion.
+        :param failure_ttl: Seconds before the rates are fetched again once
+                            a refresh has failed.
+        """
+        if refresh_after > max_age:
+            raise ValueError('refresh_after cannot exceed max_age')
+
+        self.client = client
+        self.codes = sorted(codes)
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self.failure_ttl = failure_ttl
+        self.fetched_at = None
+        self.failed_at = None
+        self._rates = {}
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """Fetch the full matrix of rates from PayPal. Returns whether the
+        rates were updated.
+        """
+        try:
+            amounts = [(RATE_BASE_AMOUNT, code) for code in self.codes]
+            response = convert_currency(self.client, amounts, self.codes)
+        except (urllib2.URLError, Timeout) as e:
+            response = Response(None, None, error=e)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+        if not response.success:
+            logging.warning('Failed to refresh exchange rates')
+            self.failed_at = time.time()
+            return False
+
+        rates = {}
+        table = response.get('estimatedAmountTable', None) or {}
+        for conversion in ensure_list(table.get('currencyConversionList')):
+            base = conversion['baseAmount']
+            base_amount = Decimal(base['amount'])
+            converted = conversion.get('currencyList', None) or {}
+            for target in ensure_list(converted.get('currency')):
+                rate = Decimal(target['amount']) / base_amount
+                rates[(base['code'], target['code'])] = rate
+
+        self._rates = rates
+        self.fetched_at = time.time()
+        self.failed_at = None
+        return True
+
+    def get_rates(self):
+        """Retrieve dictionary of the rates keyed by tuples of the source
+        and target currency codes. Stale rates are returned in case they
+        could not be refreshed, and an empty dictionary in case no rates
+        have ever been fetched.
+        """
+        age = self._get_age()
+        if age is None or age > self.max_age:
+            if not self._has_failed_recently():
+                # Only a single caller fetches the rates, the rest wait for it
+                with self._refresh_lock:
+                    age = self._get_age()
+                    if ((age is None or age > self.max_age) and
+                            not self._has_failed_recently()):
+                        self.refresh()
+        elif age > self.refresh_after:
+            self._refresh_in_background()
+        return self._rates
+
+    def get_rate(self, source_code, target_code):
+        """Retrieve the rate amounts in the source currency are multiplied
+        by to convert them, or None in case it is unavailable.
+        """
+        if source_code == target_code:
+            return Decimal(1)
+        return self.get_rates().get((source_code, target_code), None)
+
+    def convert(self, amount, source_code, target_code):
+        """Convert given amount into an instance of ``'pypal.currency.Money'``
+        in the target currency, or None in case no rate is available.
+        """
+        rate = self.get_rate(source_code, target_code)
+        if rate is None:
+            return None
+
+        value = currency.to_decimal(amount, source_code) * rate
+        exponent = Decimal(1).scaleb(-currency.get_minor_units(target_code))
+        return currency.Money(value.quantize(exponent, ROUND_HALF_UP),
+                              target_code)
+
+    def convert_many(self, amounts, source_code, target_code):
+        """Convert a whole array of amounts at once, e.g the prices of a
+        page. Returns a list of the converted amounts formatted as
+        strings, or None in case no rate is available.
+
+        Amounts are rounded half up exactly like ``'convert'``, which is
+        why NumPy arrays are converted using decimals as well.
+
+        :param amounts: Sequence or NumPy array of amounts
+        """
+        rate = self.get_rate(source_code, target_code)
+        if rate is None:
+            return None
+
+        if hasattr(amounts, 'tolist'):
+            amounts = amounts.tolist()
+
+        to_decimal = currency.to_decimal
+        exponent = Decimal(1).scaleb(-currency.get_minor_units(target_code))
+        return [str((to_decimal(amount, source_code) * rate)
+                    .quantize(exponent, ROUND_HALF_UP))
+                for amount in amounts]
+
+    def _get_age(self):
+        if self.fetched_at is None:
+            return None
+        return time.time() - self.fetched_at
+
+    def _has_failed_recently(self):
+        return (self.failed_at is not None and
+                time.time() - self.failed_at <= self.failure_ttl)
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or self._has_failed_recently():
+                return
+            self._refreshing = True
+
+        thread = threading.Thread(target=self.refresh)
+        thread.daemon = True
+        thread.start()
+
+class _PendingRefresh(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = None
+
+
+class PaymentStatusIndex(object):
+    """Local index of the execution status per pay key, which answers
+    status reads from memory instead of polling PayPal.
+
+    The index is fed by the pay notifications of an ``'pypal.ipn.Listener'``
+    it is attached to. The PaymentDetails API call is only executed for
+    pay keys which are missing or whose status is stale, and concurrent
+    refreshes of the same pay key are coalesced into a single call.
+    Statuses which are final never become stale.
+    """
+    def __init__(self, client, store=None, ttl=PAYMENT_STATUS_TTL):
+        """
+        :param client: An instance of ``'pypal.Client'``
+        :param store: Instance of ``'pypal.store.Store'`` to persist the
+                      statuses in, e.g using sqlite. Persisted statuses
+                      are loaded into memory on initialization.
+        :param ttl: Seconds after which a status which is not final is
+                    refreshed on read.
+        """
+        self.client = client
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._statuses = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        if store is not None:
+            for pay_key, entry in store.items():
+                self._statuses[pay_key] = tuple(entry)
+
+    def __len__(self):
+        return len(self._statuses)
+
+    def __contains__(self, pay_key):
+        return pay_key in self._statuses
+
+    def peek(self, pay_key):
+        """Retrieve the indexed status without ever calling PayPal."""
+        entry = self._statuses.get(pay_key, None)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def update(self, pay_key, status, updated_at=None):
+        """Index the status of the payment. Final statuses are never
+        replaced by statuses which are not, since notifications may
+        arrive out of order.
+        """
+        status = status.upper()
+        entry = (status, updated_at or time.time())
+        with self._lock:
+            current = self._statuses.get(pay_key, None)
+            if (current is not None and
+                    current[0] in FINAL_EXECUTE_STATUSES and
+                    status not in FINAL_EXECUTE_STATUSES):
+                return current[0]
+            self._statuses[pay_key] = entry
+
+        if self.store is not None:
+            self.store.set(pay_key, entry)
+        return status
+
+    def update_from_notification(self, notification):
+        """Index the status of a ``'pypal.ipn.pay.Response'``."""
+        pay_key = notification.get('pay_key', None)
+        status = notification.get('status', None)
+        if not pay_key or not status:
+            return None
+        return self.update(pay_key, status)
+
+    def attach(self, listener):
+        """Index the statuses of the pay notifications dispatched by given
+        ``'pypal.ipn.Listener'``.
+        """
+        from pypal.ipn import EVENT_ADAPTIVE
+        listener.add(EVENT_ADAPTIVE, self.update_from_notification)
+
+    def is_stale(self, entry, now=None):
+        status, updated_at = entry
+        if status in FINAL_EXECUTE_STATUSES:
+            return False
+        return (now or time.time()) - updated_at > self.ttl
+
+    def get_status(self, pay_key):
+        """Retrieve the status of the payment, calling PaymentDetails in
+        case it is missing or stale. The stale status is returned in case
+        the refresh fails.
+
+        :param pay_key: The pay key of the payment
+        """
+        entry = self._statuses.get(pay_key, None)
+        if entry is not None and not self.is_stale(entry):
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        status = self.refresh(pay_key)
+        if status is None and entry is not None:
+            return entry[0]
+        return status
+
+    def get_statuses(self, pay_keys, workers=4):
+        """Retrieve dictionary of the status per pay key, refreshing the
+        missing and stale ones concurrently.
+        """
+        now = time.time()
+        ret = {}
+        refresh = []
+        for pay_key in pay_keys:
+            entry = self._statuses.get(pay_key, None)
+            if entry is None or self.is_stale(entry, now):
+                refresh.append(pay_key)
+            else:
+                ret[pay_key] = entry[0]
+
+        self.hits += len(ret)
+        self.misses += len(refresh)
+        refreshed = util.concurrent_imap(lambda pay_key:
+                                         (pay_key, self.refresh(pay_key)),
+                                         refresh, workers=workers)
+        for pay_key, status in refreshed:
+            ret[pay_key] = status or self.peek(pay_key)
+        return ret
+
+    def refresh(self, pay_key):
+        """Fetch the status of the payment using PaymentDetails. Callers
+        refreshing the same pay key at once share a single call. Returns
+        the status or None on failure.
+        """
+        with self._lock:
+            pending = self._pending.get(pay_key, None)
+            leader = pending is None
+            if leader:
+                pending = self._pending[pay_key] = _PendingRefresh()
+
+        if not leader:
+            pending.event.wait()
+            return pending.status
+
+        try:
+            response = payment_details(self.client, pay_key=pay_key)
+            status = response.get('status', None)
+            if response.success and status:
+                pending.status = self.update(pay_key, status)
+        except (urllib2.URLError, Timeout):
+            # Unreachable, handled like any other failed response
+            pass
+        finally:
+            with self._lock:
+                self._pending.pop(pay_key, None)
+            pending.event.set()
+        return pending.status
+
+def get_total_amount(receivers, currency_code):
+    """Retrieve the amount the sender pays, i.e the amount of the primary
+    receiver in chained payments and the sum of all amounts otherwise.
+    """
+    for receiver in receivers:
+        if str(receiver.get('primary', 'false')).lower() == 'true':
+            return currency.to_decimal(receiver['amount'], currency_code)
+    amounts = [receiver['amount'] for receiver in receivers]
+    return currency.sum_amounts(amounts, currency_code).amount
+
+def format_date(value):
+    """Format given date or datetime as expected by the Adaptive APIs."""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+class PreapprovalStore(object):
+    """Local cache of the preapprovals given by buyers, which allows
+    repeat payments to be executed server-side using ``'pay_preapproved'``
+    rather than redirecting the buyer to PayPal.
+
+    Entries are kept up to date from PreapprovalDetails responses and
+    preapproval IPN notifications instead of being polled.
+    """
+    def __init__(self, store=None):
+        """
+        :param store: Instance of ``'pypal.store.Store'`` to keep the
+                      preapprovals in, e.g to persist them using sqlite.
+        """
+        self.store = store if store is not None else Store()
+        self._lock = threading.Lock()
+
+    def get(self, preapproval_key):
+        return self.store.get('key:%s' % preapproval_key)
+
+    def update(self, preapproval_key, **fields):
+        """Update the fields of the given preapproval and return it. Fields
+        which are None are left as is.
+        """
+        with self._lock:
+            entry = self.get(preapproval_key) or {'key': preapproval_key}
+            for name, value in fields.items():
+                if value is not None:
+                    entry[name] = value
+            self.store.set('key:%s' % preapproval_key, entry)
+            if entry.get('buyer', None):
+                self.store.set('buyer:%s' % entry['buyer'], preapproval_key)
+        return entry
+
+    def update_from_details(self, preapproval_key, response):
+        """Update the preapproval from a PreapprovalDetails response."""
+        fields = self._map_fields(response, PREAPPROVAL_DETAILS_FIELDS)
+        return self.update(preapproval_key,
+                           approved=self._is_true(response.get('approved')),
+                           expires_at=parse_iso_timestamp(
+                               response.get('endingDate', None)),
+                           **fields)
+
+    def update_from_notification(self, notification):
+        """Update the preapproval from a ``'pypal.ipn.preapproval.Response'``
+        notification.
+        """
+        preapproval_key = notification.get('preapproval_key', None)
+        if not preapproval_key:
+            return None
+
+        fields = self._map_fields(notification,
+                                  PREAPPROVAL_NOTIFICATION_FIELDS)
+        return self.update(preapproval_key,
+                           approved=self._is_true(notification.get('approved')),
+                           expires_at=parse_iso_timestamp(
+                               notification.get('ending_date', None)),
+                           **fields)
+
+    def attach(self, listener):
+        """Update the store from the preapproval notifications dispatched
+        by given ``'pypal.ipn.Listener'``.
+        """
+        from pypal.ipn import EVENT_PREAPPROVAL
+        listener.add(EVENT_PREAPPROVAL, self.update_from_notification)
+
+    def cancel(self, preapproval_key):
+        return self.update(preapproval_key,
+                           status=PREAPPROVAL_STATUS_CANCELED)
+
+    def record_payment(self, preapproval_key, amount):
+        """Account for a payment made using the preapproval until the
+        notification of the change arrives.
+        """
+        with self._lock:
+            entry = self.get(preapproval_key)
+            if entry is None:
+                return None
+
+            code = entry['currency_code']
+            spent = currency.to_decimal(entry.get('spent', None) or 0, code)
+            entry['spent'] = str(spent + currency.to_decimal(amount, code))
+            entry['payments'] = int(entry.get('payments', None) or 0) + 1
+            self.store.set('key:%s' % preapproval_key, entry)
+        return entry
+
+    def get_remaining(self, preapproval_key):
+        """Retrieve the amount which is left to spend, or None in case the
+        preapproval is unknown or has no maximum total amount.
+        """
+        entry = self.get(preapproval_key)
+        if entry is None or entry.get('max_total', None) is None:
+            return None
+
+        code = entry['currency_code']
+        spent = currency.to_decimal(entry.get('spent', None) or 0, code)
+        return currency.to_decimal(entry['max_total'], code) - spent
+
+    def is_valid(self, entry, amount=None, currency_code=None, now=None):
+        """Check whether given preapproval may be utilized in order to pay
+        the amount.
+        """
+        if not entry.get('approved', False):
+            return False
+
+        if entry.get('status', None) != PREAPPROVAL_STATUS_ACTIVE:
+            return False
+
+        if currency_code and entry.get('currency_code', None) != currency_code:
+            return False
+
+        expires_at = entry.get('expires_at', None)
+        if expires_at is not None and expires_at <= (now or time.time()):
+            return False
+
+        max_payments = entry.get('max_payments', None)
+        if (max_payments is not None and
+                int(entry.get('payments', None) or 0) >= int(max_payments)):
+            return False
+
+        if amount is None:
+            return True
+
+        code = entry['currency_code']
+        amount = currency.to_decimal(amount, code)
+        max_per_payment = entry.get('max_per_payment', None)
+        if (max_per_payment is not None and
+                amount > currency.to_decimal(max_per_payment, code)):
+            return False
+
+        remaining = self.get_remaining(entry['key'])
+        return remaining is None or amount <= remaining
+
+    def get_key(self, buyer, amount=None, currency_code=None, now=None):
+        """Retrieve the preapproval key of the buyer in case it is valid
+        for a payment of given amount, otherwise None.
+
+        :param buyer: The email address of the buyer
+        :param amount: The amount which is about to be paid
+        :param currency_code: The currency of the payment
+        """
+        preapproval_key = self.store.get('buyer:%s' % buyer)
+        if not preapproval_key:
+            return None
+
+        entry = self.get(preapproval_key)
+        if entry is None or not self.is_valid(entry, amount=amount,
+                                              currency_code=currency_code,
+                                              now=now):
+            return None
+        return preapproval_key
+
+    @staticmethod
+    def _map_fields(source, mapping):
+        return dict((name, source.get(field, None))
+                    for field, name in mapping.items())
+
+    @staticmethod
+    def _is_true(value):
+        if value is None:
+            return None
+        return str(value).lower() == 'true'
+
+def generate_tracking_id():
+    """Generate a unique tracking id to identify a payment by."""
+    return binascii.hexlify(os.urandom(16)).decode('ascii')
+
+class PaymentLedger(object):
+    """Local ledger of the state and pay key of the payments submitted by
+    ``'pay_once'``, keyed by tracking id.
+
+    Every payment is recorded as pending before the Pay call is sent,
+    which allows a payment whose outcome is unknown, e.g since the
+    connection dropped or the process crashed, to be looked up before
+    it is ever submitted again.
+    """
+    def __init__(self, store=None):
+        """
+        :param store: Instance of ``'pypal.store.Store'`` to keep the
+                      ledger in, e.g to persist it using sqlite.
+        """
+        self.store = (store if store is not None
+                      else Store(table='ledger'))
+
+    def get(self, tracking_id):
+        return self.store.get(tracking_id)
+
+    def get_state(self, tracking_id):
+        entry = self.get(tracking_id)
+        if entry is None:
+            return None
+        return entry['state']
+
+    def set(self, tracking_id, state, pay_key=None):
+        entry = {'state': state, 'pay_key': pay_key,
+                 'updated_at': time.time()}
+        self.store.set(tracking_id, entry)
+        return entry
+
+    def delete(self, tracking_id):
+        self.store.delete(tracking_id)
+
+def call(client, method, params, credentials=None, deadline=None):
     """A wrapper of the ``'pypal.Client.call'`` method which
     will set the API endpoints for this service depending
     on the environment, i.e sandbox or not.
@@ -71,11 +698,15 @@ def call(client, method, params):
     :param client: An instance of ``'pypal.Client'``
     :param method: The API method to execute
     :param params: The arguments to send
+    :param credentials: Tuple of access token and token secret in case
+                        the call is executed on behalf of another account.
+    :param deadline: Instance of ``'pypal.deadline.Deadline'`` limiting
+                     the time available to complete the call.
     """
     endpoint = (PRODUCTION_ENDPOINT, SANDBOX_ENDPOINT)
     endpoint = endpoint[int(client.config.in_sandbox)]
-    return client.call('AdaptivePayments', method,
-                       endpoint=endpoint, **params)
+    return client.call('AdaptivePayments', method, endpoint=endpoint,
+                       credentials=credentials, deadline=deadline, **params)
 
 def get_payment_url(client,
                     action_type,
@@ -86,14 +717,26 @@ def get_payment_url(client,
                     receivers=None,
                     fees_payer=None,
                     extra={},
-                    embedded=False):
+                    embedded=False,
+                    deadline=None,
+                    tracker=None):
     """Executes the Pay API call and returns the intended redirect URL
     directly using the necessary pay key returned in the PayPal response.
 
     This function is a wrapper of ``'pay'`` which will execute the necessary
     API calls and using the response this function will generate the URL.
     """
-    response = pay(**locals())
+    response = pay(client,
+                   action_type,
+                   currency_code,
+                   cancel_url,
+                   return_url,
+                   ipn_callback_url,
+                   receivers=receivers,
+                   fees_payer=fees_payer,
+                   extra=extra,
+                   deadline=deadline,
+                   tracker=tracker)
     if not response.success:
         return None
 
@@ -116,6 +759,16 @@ def generate_pay_url(client, pay_key, embedded=False):
              '/webapps/adaptivepayment/flow/pay?paykey=%s')
     return client.get_paypal_url(paths[embedded] % pay_key)
 
+def generate_preapproval_url(client, preapproval_key):
+    """Generate the URL to redirect end-users to in order to approve
+    the preapproval identified by given key.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param preapproval_key: The preapproval key received from PayPal
+    """
+    path = '/cgi-bin/webscr?cmd=_ap-preapproval&preapprovalkey=%s'
+    return client.get_paypal_url(path % preapproval_key)
+
 ##############################################################################
 # FUNCTIONS WHICH DIRECTLY CORRESPONDS TO PAYPAL API CALLS
 ##############################################################################
@@ -128,7 +781,10 @@ def pay(client,
         ipn_callback_url,
         receivers=None,
         fees_payer=None,
-        extra={}):
+        extra={},
+        deadline=None,
+        tracker=None,
+        preapproval_key=None):
     """Execute the Pay API call which will prepare the payment procedure.
     Most importantly it will return a pay key which should be utilized in
     order to identify the transaction.
@@ -148,6 +804,12 @@ def pay(client,
     :param receivers: A list of the receivers of this transaction
     :param fees_payer: Who will pay the PayPal fees
     :param extra: Additional key-value arguments to send to PayPal
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    :param tracker: Instance of ``'pypal.ipn.tracking.PaymentTracker'``
+                    which records the created payment.
+    :param preapproval_key: Key of a preapproval given by the sender,
+                            which executes the payment without any
+                            further approval.
     """
     check_required(locals(), ('cancel_url', 'return_url', 'currency_code',
                               'action_type', 'receivers', 'ipn_callback_url'))
@@ -170,6 +832,13 @@ def pay(client,
             receivers = [receivers]
         receivers = ReceiverList(receivers)
 
+    # Copy in order to not leak arguments into the shared default
+    extra = dict(extra)
+    for receiver in receivers:
+        if receiver['amount'] is not None:
+            receiver['amount'] = currency.format_amount(receiver['amount'],
+                                                        currency_code)
+
     extra.update({'actionType': action_type,
                   'receiverList': { 'receiver': receivers },
                   'currencyCode': currency_code,
@@ -178,10 +847,446 @@ def pay(client,
 
     set_nonempty_param(extra, 'ipnNotificationUrl', ipn_callback_url)
     set_nonempty_param(extra, 'feesPayer', fees_payer)
-    return call(client, 'Pay', extra)
+    set_nonempty_param(extra, 'preapprovalKey', preapproval_key)
+    response = call(client, 'Pay', extra, deadline=deadline)
+    if tracker is not None and response.success:
+        tracker.record(response, tracking_id=extra.get('trackingId', None))
+    return response
+
+def pay_preapproved(client,
+                    preapprovals,
+                    sender_email,
+                    currency_code,
+                    cancel_url,
+                    return_url,
+                    ipn_callback_url,
+                    receivers=None,
+                    fees_payer=None,
+                    extra={},
+                    deadline=None,
+                    tracker=None):
+    """Execute a repeat payment server-side using a cached preapproval
+    of the sender. Returns None in case the sender has no preapproval
+    valid for the payment, in which case the sender has to be redirected
+    to PayPal, e.g using ``'get_payment_url'``.
+
+    :param preapprovals: Instance of ``'PreapprovalStore'``
+    :param sender_email: The email address of the sender
+
+    See ``'pay'`` for the remaining arguments.
+    """
+    if not isinstance(receivers, ReceiverList):
+        if not isinstance(receivers, (list, tuple)):
+            receivers = [receivers]
+        receivers = ReceiverList(receivers)
+
+    amount = get_total_amount(receivers, currency_code)
+    preapproval_key = preapprovals.get_key(sender_email,
+                                           amount=amount,
+                                           currency_code=currency_code)
+    if not preapproval_key:
+        return None
+
+    extra = dict(extra, senderEmail=sender_email)
+    response = pay(client,
+                   ACTION_PAY,
+                   currency_code,
+                   cancel_url,
+                   return_url,
+                   ipn_callback_url,
+                   receivers=receivers,
+                   fees_payer=fees_payer,
+                   extra=extra,
+                   deadline=deadline,
+                   tracker=tracker,
+                   preapproval_key=preapproval_key)
+    if response.success:
+        preapprovals.record_payment(preapproval_key, amount)
+    return response
+
+def pay_once(client,
+             action_type,
+             currency_code,
+             cancel_url,
+             return_url,
+             ipn_callback_url,
+             receivers=None,
+             fees_payer=None,
+             extra={},
+             deadline=None,
+             tracker=None,
+             tracking_id=None,
+             ledger=None,
+             retries=DEFAULT_PAY_RETRIES,
+             backoff=DEFAULT_PAY_BACKOFF):
+    """Execute the Pay API call and retry it on transient failures, e.g
+    timeouts and dropped connections, while creating at most one payment
+    per tracking id.
+
+    Before the call is sent again, the ledger and the PaymentDetails API
+    call are consulted by tracking id. The call is only resubmitted once
+    they prove that PayPal never created the payment. PayPal rejects
+    reused tracking ids as well. Once the payment is known to exist, the
+    PaymentDetails response is returned, which contains its pay key.
+
+    A rejected tracking id proves that the payment exists even though
+    PaymentDetails might not know about it yet. The payment is then kept
+    pending in the ledger, never failed, and PaymentDetails is retried.
+
+    The response in case no payment has been created is the one of the
+    last attempt, which is failed unless the outcome was unknown.
+
+    The ledger is required. Payments are only deduplicated against the
+    ledger given, thus it has to be shared by every call which might
+    submit the same payment, and persisted for the guarantee to hold
+    across processes.
+
+    :param tracking_id: Identifies the payment, generated if not given.
+                        Calling this function again with the same
+                        tracking id and ledger never creates a second
+                        payment.
+    :param ledger: Instance of ``'PaymentLedger'``
+    :param retries: Amount of times to retry after transient failures
+    :param backoff: Seconds to wait before the first retry, doubled on
+                    every further retry.
+
+    See ``'pay'`` for the remaining arguments.
+    """
+    check_required(locals(), ('ledger',))
+    tracking_id = tracking_id or generate_tracking_id()
+    extra = dict(extra, trackingId=tracking_id)
+
+    response = None
+    rejected = False
+    attempt = 0
+    while True:
+        state = ledger.get_state(tracking_id)
+        if state == LEDGER_STATE_CREATED:
+            return payment_details(client, tracking_id=tracking_id,
+                                   deadline=deadline)
+
+        if state == LEDGER_STATE_PENDING:
+            # A previous attempt might have created the payment
+            details = payment_details(client, tracking_id=tracking_id,
+                                      deadline=deadline)
+            if details.success and details.get('payKey', None):
+                ledger.set(tracking_id, LEDGER_STATE_CREATED,
+                           pay_key=details['payKey'])
+                return details
+            if rejected or not is_definite_failure(details):
+                # The payment exists or might exist; never resubmit it
+                if not rejected:
+                    response = details
+                if not _wait_for_retry(attempt, retries, backoff, deadline):
+                    return response
+                attempt += 1
+                continue
+
+        ledger.set(tracking_id, LEDGER_STATE_PENDING)
+        try:
+            response = pay(client,
+                           action_type,
+                           currency_code,
+                           cancel_url,
+                           return_url,
+                           ipn_callback_url,
+                           receivers=receivers,
+                           fees_payer=fees_payer,
+                           extra=extra,
+                           deadline=deadline,
+                           tracker=tracker)
+        except ValueError:
+            # Invalid arguments, i.e nothing was sent
+            ledger.delete(tracking_id)
+            raise
+        except Exception as e:
+            # The payment may or may not have been created
+            response = Response(None, None, error=e)
+
+        if response.success:
+            ledger.set(tracking_id, LEDGER_STATE_CREATED,
+                       pay_key=response.get('payKey', None))
+            return response
+
+        if response.is_rate_limited:
+            # Never sent, thus nothing can have been created
+            ledger.delete(tracking_id)
+        elif is_tracking_id_rejected(response):
+            # Created by an earlier attempt which PaymentDetails lags
+            # behind; kept pending until PaymentDetails confirms it.
+            rejected = True
+        elif is_definite_failure(response):
+            ledger.set(tracking_id, LEDGER_STATE_FAILED)
+            return response
+
+        if not _wait_for_retry(attempt, retries, backoff, deadline):
+            return response
+        attempt += 1
+
+def is_definite_failure(response):
+    """Check whether the response is a failure acknowledged by PayPal, as
+    opposed to a failure where the outcome of the call is unknown.
+    """
+    return not (response.success or response.error or response.http_error)
+
+def is_tracking_id_rejected(response):
+    """Check whether PayPal rejected the call due to its tracking id, i.e
+    since a payment has already been created using it.
+    """
+    for error in ensure_list(response.get('error', None)):
+        parameters = ensure_list(error.get('parameter', None))
+        if TRACKING_ID_PARAMETER in parameters:
+            return True
+        message = error.get('message', None) or ''
+        if TRACKING_ID_PARAMETER.lower() in message.lower():
+            return True
+    return False
+
+def _wait_for_retry(attempt, retries, backoff, deadline):
+    if attempt >= retries:
+        return False
+
+    delay = backoff * (2 ** attempt)
+    if deadline is not None and deadline.remaining() <= delay:
+        return False
+    time.sleep(delay)
+    return True
+
+def preapproval(client,
+                currency_code,
+                cancel_url,
+                return_url,
+                starting_date,
+                ending_date=None,
+                max_total_amount=None,
+                max_amount_per_payment=None,
+                max_number_of_payments=None,
+                sender_email=None,
+                ipn_callback_url=None,
+                extra={},
+                deadline=None,
+                preapprovals=None):
+    """Execute the Preapproval API call which will prepare the approval of
+    future payments by the sender. The returned preapproval key has to be
+    approved by the sender, see ``'generate_preapproval_url'``.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param currency_code: Which currency code the payments are made in
+    :param cancel_url: The URL which the end-user is sent to on
+                       cancellation of the approval.
+    :param return_url: The URL which the end-user is sent to once the
+                       preapproval has been approved.
+    :param starting_date: Date or ISO 8601 string of when the
+                          preapproval becomes valid.
+    :param ending_date: Date or ISO 8601 string of when the preapproval
+                        expires.
+    :param max_total_amount: Maximum total amount of all payments
+    :param max_amount_per_payment: Maximum amount of a single payment
+    :param max_number_of_payments: Maximum amount of payments
+    :param sender_email: The email address of the sender
+    :param ipn_callback_url: The URL which will receive the IPN
+                             notifications related to the preapproval.
+    :param extra: Additional key-value arguments to send to PayPal
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    :param preapprovals: Instance of ``'PreapprovalStore'`` which records
+                         the created preapproval.
+    """
+    check_required(locals(), ('currency_code', 'cancel_url', 'return_url',
+                              'starting_date'))
+
+    if not currency.is_valid_code(currency_code):
+        raise ValueError('Given currency code (%s) '
+                         'is not supported' % currency_code)
+
+    if max_total_amount is not None:
+        max_total_amount = currency.format_amount(max_total_amount,
+                                                  currency_code)
+    if max_amount_per_payment is not None:
+        max_amount_per_payment = currency.format_amount(max_amount_per_payment,
+                                                        currency_code)
+
+    extra = dict(extra)
+    extra.update({'currencyCode': currency_code,
+                  'cancelUrl': cancel_url,
+                  'returnUrl': return_url,
+                  'startingDate': format_date(starting_date)})
+
+    set_nonempty_param(extra, 'endingDate', format_date(ending_date))
+    set_nonempty_param(extra, 'maxTotalAmountOfAllPayments', max_total_amount)
+    set_nonempty_param(extra, 'maxAmountPerPayment', max_amount_per_payment)
+    set_nonempty_param(extra, 'maxNumberOfPayments', max_number_of_payments)
+    set_nonempty_param(extra, 'senderEmail', sender_email)
+    set_nonempty_param(extra, 'ipnNotificationUrl', ipn_callback_url)
+    response = call(client, 'Preapproval', extra, deadline=deadline)
+
+    preapproval_key = response.get('preapprovalKey', None)
+    if preapprovals is not None and response.success and preapproval_key:
+        ending_date = extra.get('endingDate', None)
+        preapprovals.update(preapproval_key,
+                            buyer=sender_email,
+                            currency_code=currency_code,
+                            approved=False,
+                            status=PREAPPROVAL_STATUS_ACTIVE,
+                            max_total=max_total_amount,
+                            max_per_payment=max_amount_per_payment,
+                            max_payments=max_number_of_payments,
+                            expires_at=parse_iso_timestamp(ending_date))
+    return response
+
+def preapproval_details(client, preapproval_key, deadline=None,
+                        preapprovals=None):
+    """Execute the PreapprovalDetails API call which will retrieve the
+    current state of the preapproval.
+
+    :param preapproval_key: The preapproval key received from PayPal
+    :param preapprovals: Instance of ``'PreapprovalStore'`` to update
+    """
+    response = call(client, 'PreapprovalDetails',
+                    {'preapprovalKey': preapproval_key}, deadline=deadline)
+    if preapprovals is not None and response.success:
+        preapprovals.update_from_details(preapproval_key, response)
+    return response
+
+def cancel_preapproval(client, preapproval_key, deadline=None,
+                       preapprovals=None):
+    """Execute the CancelPreapproval API call which will revoke the
+    preapproval, preventing any further payments.
+
+    :param preapproval_key: The preapproval key received from PayPal
+    :param preapprovals: Instance of ``'PreapprovalStore'`` to update
+    """
+    response = call(client, 'CancelPreapproval',
+                    {'preapprovalKey': preapproval_key}, deadline=deadline)
+    if preapprovals is not None and response.success:
+        preapprovals.cancel(preapproval_key)
+    return response
+
+def convert_currency(client,
+                     amounts,
+                     currency_codes,
+                     country_code=None,
+                     conversion_type=None,
+                     deadline=None):
+    """Execute the ConvertCurrency API call which will estimate the
+    amounts in each of the given currencies.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param amounts: List of amount and currency code tuples, or instances
+                    of ``'pypal.currency.Money'``, to convert.
+    :param currency_codes: The currency codes to convert the amounts into
+    :param country_code: The country code of the conversion rates to use
+    :param conversion_type: The type of conversion, e.g SENDER_SIDE
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    """
+    base_amounts = []
+    for amount in amounts:
+        if isinstance(amount, currency.Money):
+            amount = (amount.amount, amount.code)
+        amount, code = amount
+        if not currency.is_valid_code(code):
+            raise ValueError('Given currency code (%s) '
+                             'is not supported' % code)
+        base_amounts.append({'code': code,
+                             'amount': currency.format_amount(amount, code)})
+
+    for code in currency_codes:
+        if not currency.is_valid_code(code):
+            raise ValueError('Given currency code (%s) '
+                             'is not supported' % code)
+
+    params = {'baseAmountList': {'currency': base_amounts},
+              'convertToCurrencyList': {'currencyCode': list(currency_codes)}}
+    set_nonempty_param(params, 'countryCode', country_code)
+    set_nonempty_param(params, 'conversionType', conversion_type)
+    return call(client, 'ConvertCurrency', params, deadline=deadline)
+
+def get_payment_key_params(pay_key=None,
+                           transaction_id=None,
+                           tracking_id=None):
+    """Retrieve the arguments identifying a payment by either of its pay
+    key, transaction id or tracking id.
+    """
+    params = {}
+    set_nonempty_param(params, 'payKey', pay_key)
+    set_nonempty_param(params, 'transactionId', transaction_id)
+    set_nonempty_param(params, 'trackingId', tracking_id)
+    if not params:
+        raise ValueError('Either of pay_key, transaction_id or tracking_id '
+                         'is required')
+    return params
+
+def payment_details(client,
+                    pay_key=None,
+                    transaction_id=None,
+                    tracking_id=None,
+                    deadline=None):
+    """Execute the PaymentDetails API call which will retrieve the
+    current state of the payment identified by either of the keys.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param pay_key: The pay key of the payment
+    :param transaction_id: The id of one of the transactions of the payment
+    :param tracking_id: The tracking id given when creating the payment
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    """
+    params = get_payment_key_params(pay_key, transaction_id, tracking_id)
+    return call(client, 'PaymentDetails', params, deadline=deadline)
+
+def refund(client,
+           pay_key=None,
+           transaction_id=None,
+           tracking_id=None,
+           currency_code=None,
+           receivers=None,
+           extra={},
+           credentials=None,
+           deadline=None):
+    """Execute the Refund API call which will refund the payment
+    identified by either of the keys, either in full or only the given
+    amounts of the receivers.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param pay_key: The pay key of the payment
+    :param transaction_id: The id of one of the transactions of the payment
+    :param tracking_id: The tracking id given when creating the payment
+    :param currency_code: The currency of the payment, required in case
+                          receivers are given.
+    :param receivers: A list of the receivers and the amounts to refund
+    :param extra: Additional key-value arguments to send to PayPal
+    :param credentials: Tuple of access token and token secret in case the
+                        refund is executed on behalf of the receiver.
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    """
+    extra = dict(extra)
+    extra.update(get_payment_key_params(pay_key, transaction_id, tracking_id))
+
+    if receivers:
+        if not currency_code:
+            raise ValueError('currency_code is required to refund the '
+                             'amounts of given receivers')
+        if not isinstance(receivers, ReceiverList):
+            receivers = ReceiverList(receivers)
+        for receiver in receivers:
+            if receiver['amount'] is not None:
+                receiver['amount'] = currency.format_amount(
+                    receiver['amount'], currency_code)
+        extra['receiverList'] = {'receiver': receivers}
+
+    set_nonempty_param(extra, 'currencyCode', currency_code)
+    return call(client, 'Refund', extra, credentials=credentials,
+                deadline=deadline)
+
+def get_refund_statuses(response):
+    """Retrieve list of the refund statuses of each receiver contained in
+    the response of the Refund API call.
+    """
+    info_list = response.get('refundInfoList', None) or {}
+    return [info.get('refundStatus', None)
+            for info in ensure_list(info_list.get('refundInfo'))]
 
-def get_payment_options(client, pay_key):
-    return call(client, 'GetPaymentOptions', {'payKey': pay_key})
+def get_payment_options(client, pay_key, deadline=None):
+    return call(client, 'GetPaymentOptions', {'payKey': pay_key},
+                deadline=deadline)
 
 def set_payment_options(client,
                         pay_key,
@@ -190,7 +1295,8 @@ def set_payment_options(client,
                         sender_options=None,
                         shipping_address_id=None,
                         initiating_entity=None,
-                        extra={}):
+                        extra={},
+                        deadline=None):
     """Execute the SetPaymentOptions API call which will customize
     behavior of the payment procedure at PayPal.
 
@@ -204,6 +1310,7 @@ def set_payment_options(client,
     :param initiating_entity: Dictionary containing initiating entity
                               customizations.
     :param extra: Additional key-value arguments to send to PayPal
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
     """
     extra['payKey'] = pay_key
     set_nonempty_param(extra, 'initiatingEntity', initiating_entity)
@@ -211,15 +1318,18 @@ def set_payment_options(client,
     set_nonempty_param(extra, 'shippingAddressId', shipping_address_id)
     set_nonempty_param(extra, 'senderOptions', sender_options)
     set_nonempty_param(extra, 'receiverOptions', receiver_options)
-    return call(client, 'SetPaymentOptions', extra)
+    return call(client, 'SetPaymentOptions', extra, deadline=deadline)
 
-def execute(client, pay_key):
-    return call(client, 'ExecutePayment', {'payKey': pay_key})
+def execute(client, pay_key, deadline=None):
+    return call(client, 'ExecutePayment', {'payKey': pay_key},
+                deadline=deadline)
 
-def get_shipping_addresses(client, key):
+def get_shipping_addresses(client, key, deadline=None):
     """Execute the GetShippingAddresses API call which will retrieve
     the shipping address which was set by the buyer.
 
     :param token: Either a payment or preapproval key
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
     """
-    return call(client, 'GetShippingAddresses', {'key': key})
+    return call(client, 'GetShippingAddresses', {'key': key},
+                deadline=deadline)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk refunds of Adaptive Payments, e.g once an event has been cancelled.
+
+Pay keys and transaction ids are streamed and refunded concurrently,
+within the rate limits of the client, using the Refund API call.
+
+Progress is checkpointed to a ``'pypal.store.Store'``. Every payment is
+marked as pending before its refund is submitted. Payments which are
+still pending when a run is resumed, i.e the process crashed or the
+outcome was unknown, are reconciled using the PaymentDetails API call
+before anything is resubmitted. A payment is therefore never refunded
+twice.
+"""
+
+import time
+
+from pypal.metrics import Counters
+from pypal.service import adaptive_payment
+from pypal.store import Store
+from pypal.util import concurrent_imap
+
+DEFAULT_WORKERS = 4
+
+#: Prefix of pay keys, anything else is considered a transaction id
+PAY_KEY_PREFIX = 'AP-'
+
+STATE_PENDING = 'pending'
+STATE_REFUNDED = 'refunded'
+STATE_FAILED = 'failed'
+
+OUTCOME_REFUNDED = 'refunded'
+OUTCOME_FAILED = 'failed'
+OUTCOME_SKIPPED = 'skipped'
+OUTCOME_UNKNOWN = 'unknown'
+OUTCOME_NOT_SENT = 'not_sent'
+
+#: Transaction statuses of PaymentDetails which prove a refund
+REFUNDED_TRANSACTION_STATUSES = frozenset(['REFUNDED', 'PARTIALLY_REFUNDED'])
+
+class Outcome(object):
+    __slots__ = ('key', 'outcome', 'response')
+
+    def __init__(self, key, outcome, response=None):
+        """
+        :param key: The pay key or transaction id
+        :param outcome: Either of the OUTCOME_* constants
+        :param response: The response of the last API call, or the
+                         exception raised by it.
+        """
+        self.key = key
+        self.outcome = outcome
+        self.response = response
+
+    def __repr__(self):
+        return 'Outcome(%r, %r)' % (self.key, self.outcome)
+
+
+def get_key_params(key):
+    if key.startswith(PAY_KEY_PREFIX):
+        return {'pay_key': key}
+    return {'transaction_id': key}
+
+def is_refunded(details):
+    """Check whether the PaymentDetails response proves that the payment
+    has been refunded.
+    """
+    info_list = details.get('paymentInfoList', None) or {}
+    for info in adaptive_payment.ensure_list(info_list.get('paymentInfo')):
+        status = (info.get('transactionStatus', None) or '').upper()
+        if status in REFUNDED_TRANSACTION_STATUSES:
+            return True
+        if info.get('refundedAmount', None) not in (None, '', '0', '0.00'):
+            return True
+    return False
+
+
+class BulkRefund(object):
+    def __init__(self,
+                 client,
+                 checkpoint=None,
+                 workers=DEFAULT_WORKERS,
+                 credentials=None,
+                 deadline=None):
+        """
+        :param client: An instance of ``'pypal.Client'``, preferably given
+                       a ``'pypal.limiter.Limiter'``.
+        :param checkpoint: Instance of ``'pypal.store.Store'``, or the path
+                           of the sqlite database, to checkpoint progress
+                           in. Progress is only kept in memory if not given.
+        :param workers: Amount of refunds to submit concurrently
+        :param credentials: Tuple of access token and token secret in case
+                            the refunds are executed on behalf of another
+                            account.
+        :param deadline: Instance of ``'pypal.deadline.Deadline'`` bounding
+                         every API call.
+        """
+        if not isinstance(checkpoint, Store):
+            checkpoint = Store(checkpoint, table='refunds')
+
+        self.client = client
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.credentials = credentials
+        self.deadline = deadline
+        self.metrics = Counters()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def throughput(self):
+        """Amount of payments processed per second."""
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return sum(self.metrics.snapshot().values()) / elapsed
+
+    def get_report(self):
+        report = self.metrics.snapshot()
+        report.update(elapsed=self.elapsed, throughput=self.throughput)
+        return report
+
+    def run(self, keys):
+        """Refund the payments and lazily yield an instance of ``'Outcome'``
+        per payment as soon as it is known.
+
+        :param keys: Iterable of pay keys and transaction ids
+        """
+        self.started_at = time.time()
+        self.finished_at = None
+        try:
+            for outcome in concurrent_imap(self.process, keys,
+                                           workers=self.workers,
+                                           ordered=False):
+                self.metrics.incr(outcome.outcome)
+                yield outcome
+        finally:
+            self.finished_at = time.time()
+
+    def process(self, key):
+        """Refund a single payment unless the checkpoint proves it has
+        already been handled. Returns an instance of ``'Outcome'``.
+        """
+        state = self.checkpoint.get(key)
+        if state in (STATE_REFUNDED, STATE_FAILED):
+            return Outcome(key, OUTCOME_SKIPPED)
+
+        if state == STATE_PENDING:
+            # Refund might have been submitted before; ask PayPal first
+            try:
+                details = adaptive_payment.payment_details(
+                    self.client, deadline=self.deadline,
+                    **get_key_params(key))
+            except Exception as e:
+                # Still pending; reconciled once the run is resumed again
+                return Outcome(key, OUTCOME_UNKNOWN, e)
+            if not details.success:
+                return Outcome(key, OUTCOME_UNKNOWN, details)
+            if is_refunded(details):
+                self.checkpoint.set(key, STATE_REFUNDED)
+                return Outcome(key, OUTCOME_REFUNDED, details)
+        else:
+            self.checkpoint.set(key, STATE_PENDING)
+
+        try:
+            response = adaptive_payment.refund(self.client,
+                                               credentials=self.credentials,
+                                               deadline=self.deadline,
+                                               **get_key_params(key))
+        except Exception as e:
+            # Keep it pending; it is reconciled once the run is resumed
+            return Outcome(key, OUTCOME_UNKNOWN, e)
+
+        if response.is_rate_limited:
+            # Never sent, thus safe to submit again
+            self.checkpoint.delete(key)
+            return Outcome(key, OUTCOME_NOT_SENT, response)
+
+        if response.error or response.http_error:
+            return Outcome(key, OUTCOME_UNKNOWN, response)
+
+        statuses = adaptive_payment.get_refund_statuses(response)
+        refunded = (response.success and statuses and
+                    all(status in adaptive_payment.SUCCESSFUL_REFUND_STATUSES
+                        for status in statuses))
+        if refunded:
+            self.checkpoint.set(key, STATE_REFUNDED)
+            return Outcome(key, OUTCOME_REFUNDED, response)
+
+        self.checkpoint.set(key, STATE_FAILED)
+        return Outcome(key, OUTCOME_FAILED, response)
+
+def refund_all(client, keys, checkpoint=None, workers=DEFAULT_WORKERS,
+               credentials=None, deadline=None):
+    """Refund every payment and return a tuple of the list of outcomes and
+    the report of the run. See ``'BulkRefund'`` for the arguments.
+    """
+    runner = BulkRefund(client, checkpoint=checkpoint, workers=workers,
+                        credentials=credentials, deadline=deadline)
+    outcomes = list(runner.run(keys))
+    return (outcomes, runner.get_report())
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Implementation of the MassPay API call of the classic Name-Value Pair API
+which sends payments to a large amount of receivers.
+
+PayPal accepts at most ``'MAX_RECEIVERS_PER_CALL'`` receivers per call.
+Payout sources of any size are therefore streamed, validated and rendered
+into the indexed NVP format one chunk at a time. The chunks are submitted
+concurrently and the outcome of every row is kept in a ``'Result'``.
+"""
+
+import bisect
+import csv
+
+from pypal import currency, nvp
+from pypal.util import concurrent_imap
+
+MAX_RECEIVERS_PER_CALL = 250
+
+RECEIVER_TYPE_EMAIL = 'EmailAddress'
+RECEIVER_TYPE_USER_ID = 'UserID'
+RECEIVER_TYPE_PHONE = 'PhoneNumber'
+
+SUPPORTED_RECEIVER_TYPES = frozenset([RECEIVER_TYPE_EMAIL,
+                                      RECEIVER_TYPE_USER_ID,
+                                      RECEIVER_TYPE_PHONE])
+
+#: The key in each row which identifies the receiver per receiver type
+RECEIVER_KEY_MAPPING = {RECEIVER_TYPE_EMAIL: ('email', 'EMAIL'),
+                        RECEIVER_TYPE_USER_ID: ('receiver_id', 'RECEIVERID'),
+                        RECEIVER_TYPE_PHONE: ('phone', 'RECEIVERPHONE')}
+
+#: Optional row keys and the indexed NVP fields they are rendered into
+OPTIONAL_FIELDS = (('unique_id', 'UNIQUEID'),
+                   ('note', 'NOTE'))
+
+DEFAULT_WORKERS = 4
+
+STATUS_PAID = 'paid'
+STATUS_FAILED = 'failed'
+#: The chunk timed out, failed on the HTTP level or raised an exception,
+#: thus PayPal might or might not have executed it.
+STATUS_UNKNOWN = 'unknown'
+
+##############################################################################
+# FUNCTIONS WHICH FURTHER AIDS IMPLEMENTATION OF THIS SERVICE
+##############################################################################
+
+class Result(object):
+    """Outcome of a mass payment per row of the payout source.
+
+    Rows are mapped to the response of the chunk they were sent in rather
+    than stored one by one, which keeps the index small for large payouts.
+    """
+    def __init__(self):
+        self.rejected = {}
+        self._starts = []
+        self._chunks = []
+
+    def add_chunk(self, start, indexes, response):
+        """Record the response of a submitted chunk.
+
+        :param start: Row index of the first row in the chunk
+        :param indexes: List of the row indexes contained in the chunk
+        :param response: The ``'pypal.NVPResponse'`` or raised exception
+        """
+        position = bisect.bisect(self._starts, start)
+        self._starts.insert(position, start)
+        self._chunks.insert(position, (frozenset(indexes), response))
+
+    def get(self, index):
+        """Retrieve tuple of whether the row was paid and either the
+        response of its chunk or the reason it was rejected.
+
+        :param index: The index of the row in the payout source
+        """
+        status, response = self.get_status(index)
+        return (status == STATUS_PAID, response)
+
+    def get_status(self, index):
+        """Retrieve tuple of the status of the row, i.e either of the
+        STATUS_* constants, and either the response of its chunk or the
+        reason it was rejected. Rows of unknown status must be reconciled
+        before being paid again.
+
+        :param index: The index of the row in the payout source
+        """
+        if index in self.rejected:
+            return (STATUS_FAILED, self.rejected[index])
+
+        position = bisect.bisect(self._starts, index) - 1
+        if position >= 0:
+            indexes, response = self._chunks[position]
+            if index in indexes:
+                return (get_status(response), response)
+        raise KeyError(index)
+
+    @property
+    def responses(self):
+        return [response for indexes, response in self._chunks]
+
+    def _count(self, status):
+        return sum(len(indexes) for indexes, response in self._chunks
+                   if get_status(response) == status)
+
+    @property
+    def paid_count(self):
+        return self._count(STATUS_PAID)
+
+    @property
+    def failed_count(self):
+        return self._count(STATUS_FAILED) + len(self.rejected)
+
+    @property
+    def unknown_count(self):
+        return self._count(STATUS_UNKNOWN)
+
+def get_status(response):
+    """Determine the STATUS_* of a chunk given its response or the
+    exception raised while submitting it.
+    """
+    if isinstance(response, Exception):
+        return STATUS_UNKNOWN
+    if response.success:
+        return STATUS_PAID
+    if response.is_rate_limited:
+        # Rejected before being sent
+        return STATUS_FAILED
+    if response.error or response.http_error:
+        return STATUS_UNKNOWN
+    return STATUS_FAILED
+
+def read_csv(fileobj, **kwargs):
+    """Lazily read the rows of a payout file containing a header row, e.g
+    ``email,amount,unique_id,note``.
+
+    :param fileobj: The opened file
+    :param kwargs: Additional arguments to pass along to ``csv.DictReader``
+    """
+    return csv.DictReader(fileobj, **kwargs)
+
+def chunk_rows(rows, size=MAX_RECEIVERS_PER_CALL):
+    """Lazily group the rows into lists of ``(index, row)`` tuples."""
+    chunk = []
+    for item in enumerate(rows):
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def render_receivers(rows, currency_code, receiver_type=RECEIVER_TYPE_EMAIL):
+    """Validate the rows and render the valid ones into the indexed NVP
+    format. Returns a tuple of the rendered body, the indexes of the
+    rendered rows and a dictionary of the errors keyed by row index.
+
+    :param rows: List of ``(index, row)`` tuples
+    :param currency_code: The currency of all amounts
+    :param receiver_type: Identifies the key of the receiver in each row
+    """
+    amounts = [row.get('amount', None) for index, row in rows]
+    amounts, errors = currency.validate_amounts(amounts, currency_code)
+    receiver_key, receiver_field = RECEIVER_KEY_MAPPING[receiver_type]
+
+    rendered = []
+    indexes = []
+    rejected = {}
+    for position, (index, row) in enumerate(rows):
+        if position in errors:
+            rejected[index] = errors[position]
+            continue
+        if not row.get(receiver_key, None):
+            rejected[index] = 'No value given for %s' % receiver_key
+            continue
+
+        prepared = {receiver_key: row[receiver_key],
+                    'amount': amounts[position]}
+        for key, field in OPTIONAL_FIELDS:
+            prepared[key] = row.get(key, None)
+        rendered.append(prepared)
+        indexes.append(index)
+
+    fields = ((receiver_key, receiver_field), ('amount', 'AMT'))
+    body = nvp.render_indexed(rendered, fields + OPTIONAL_FIELDS)
+    return (body, indexes, rejected)
+
+##############################################################################
+# FUNCTIONS WHICH DIRECTLY CORRESPONDS TO PAYPAL API CALLS
+##############################################################################
+
+def call(client, params, body=None, deadline=None):
+    """Execute a single MassPay API call.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param params: Dictionary of the non-indexed arguments
+    :param body: The receivers rendered using ``'render_receivers'``
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    """
+    return client.call_nvp('MassPay', params=params, body=body,
+                           deadline=deadline)
+
+def mass_pay(client,
+             rows,
+             currency_code,
+             receiver_type=RECEIVER_TYPE_EMAIL,
+             email_subject=None,
+             workers=DEFAULT_WORKERS,
+             chunk_size=MAX_RECEIVERS_PER_CALL,
+             deadline=None):
+    """Execute the MassPay API call for every chunk of the given rows.
+    Each row is a dictionary containing the receiver, i.e email,
+    receiver_id or phone depending on receiver type, the amount and
+    optionally a unique_id and a note.
+
+    Returns an instance of ``'Result'`` once all chunks have been sent.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param rows: Iterable of rows, e.g ``'read_csv'``
+    :param currency_code: The currency of all amounts
+    :param receiver_type: How receivers are identified
+    :param email_subject: Subject of the email sent to the receivers
+    :param workers: Amount of chunks to submit concurrently
+    :param chunk_size: Amount of receivers per call
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    """
+    if not currency.is_valid_code(currency_code):
+        raise ValueError('Given currency code (%s) '
+                         'is not supported' % currency_code)
+
+    if receiver_type not in SUPPORTED_RECEIVER_TYPES:
+        raise ValueError('Given receiver type (%s) is not any of the '
+                         'supported types; %s' % (receiver_type,
+                                                  SUPPORTED_RECEIVER_TYPES))
+
+    chunk_size = min(chunk_size, MAX_RECEIVERS_PER_CALL)
+    params = {'RECEIVERTYPE': receiver_type, 'CURRENCYCODE': currency_code}
+    if email_subject:
+        params['EMAILSUBJECT'] = email_subject
+
+    result = Result()
+
+    def submit(chunk):
+        body, indexes, rejected = render_receivers(chunk, currency_code,
+                                                   receiver_type)
+        if not indexes:
+            return (chunk[0][0], indexes, rejected, None)
+
+        try:
+            response = call(client, params, body, deadline=deadline)
+        except Exception as e:
+            # Kept as the response; the chunk is of unknown status
+            response = e
+        return (chunk[0][0], indexes, rejected, response)
+
+    chunks = chunk_rows(rows, size=chunk_size)
+    for start, indexes, rejected, response in concurrent_imap(
+            submit, chunks, workers=workers, ordered=False):
+        result.rejected.update(rejected)
+        if indexes:
+            result.add_chunk(start, indexes, response)
+    return result
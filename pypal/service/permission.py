@@ -2,13 +2,31 @@
 """
 """
 
-import logging
+import threading
+import time
+import weakref
+
+from pypal.deadline import Timeout
+from pypal.util import concurrent_imap, lazy_module
+
+urllib2 = lazy_module('urllib2')
 
 PRODUCTION_ENDPOINT = 'https://svcs.paypal.com'
 SANDBOX_ENDPOINT = 'https://svcs.sandbox.paypal.com'
 
 REQUEST_TOKEN_TTL = 900
 
+#: Amount of seconds the scopes granted to an access token are considered
+#: fresh by ``'GrantCache'`` before they are refreshed in the background.
+GRANT_CACHE_TTL = 300
+
+#: Amount of seconds a failure to fetch the scopes of an access token is
+#: remembered by ``'GrantCache'`` before it is fetched again.
+GRANT_CACHE_FAILURE_TTL = 30
+
+#: Amount of seconds personal data is cached by ``'PersonalDataCache'``
+PERSONAL_DATA_CACHE_TTL = 3600
+
 EXPRESS_CHECKOUT = 'EXPRESS_CHECKOUT'
 DIRECT_PAYMENT = 'DIRECT_PAYMENT'
 SETTLEMENT_CONSOLIDATION = 'SETTLEMENT_CONSOLIDATION'
@@ -45,6 +63,32 @@ REQUIRES_APPROVAL = frozenset([SETTLEMENT_CONSOLIDATION,
                                ENCRYPTED_WEBSITE_PAYMENTS,
                                NON_REFERENCED_CREDIT])
 
+ALL_GROUPS = frozenset([EXPRESS_CHECKOUT,
+                        DIRECT_PAYMENT,
+                        SETTLEMENT_CONSOLIDATION,
+                        SETTLEMENT_REPORTING,
+                        AUTH_CAPTURE,
+                        MOBILE_CHECKOUT,
+                        BILLING_AGREEMENT,
+                        REFERENCE_TRANSACTION,
+                        AIR_TRAVEL,
+                        MASS_PAY,
+                        TRANSACTION_DETAILS,
+                        TRANSACTION_SEARCH,
+                        RECURRING_PAYMENTS,
+                        ACCOUNT_BALANCE,
+                        ENCRYPTED_WEBSITE_PAYMENTS,
+                        REFUND,
+                        NON_REFERENCED_CREDIT,
+                        BUTTON_MANAGER,
+                        MANAGE_PENDING_TRANSACTION_STATUS,
+                        RECURRING_PAYMENT_REPORT,
+                        EXTENDED_PRO_PROCESSING_REPORT,
+                        EXCEPTION_PROCESSING_REPORT,
+                        ACCOUNT_MANAGEMENT_PERMISSION,
+                        ACCESS_BASIC_PERSONAL_DATA,
+                        ACCESS_ADVANCED_PERSONAL_DATA])
+
 REQUEST_PERMISSION_MAPPING = {
     # Express checkout mappings
     'SetExpressCheckout': EXPRESS_CHECKOUT,
@@ -122,15 +166,70 @@ REQUEST_PERMISSION_MAPPING = {
     'GetAdvancedPersonalData': ACCESS_ADVANCED_PERSONAL_DATA
 }
 
+# Attributes of the basic personal data
+ATTRIBUTE_FIRST_NAME = 'http://axschema.org/namePerson/first'
+ATTRIBUTE_LAST_NAME = 'http://axschema.org/namePerson/last'
+ATTRIBUTE_EMAIL = 'http://axschema.org/contact/email'
+ATTRIBUTE_FULL_NAME = 'http://schema.openid.net/contact/fullname'
+ATTRIBUTE_BUSINESS_NAME = 'http://axschema.org/company/name'
+ATTRIBUTE_COUNTRY = 'http://axschema.org/contact/country/home'
+ATTRIBUTE_PAYER_ID = 'https://www.paypal.com/webapps/auth/schema/payerID'
+
+# Attributes of the advanced personal data
+ATTRIBUTE_DATE_OF_BIRTH = 'http://axschema.org/birthDate'
+ATTRIBUTE_POSTAL_CODE = 'http://axschema.org/contact/postalCode/home'
+ATTRIBUTE_STREET_1 = 'http://schema.openid.net/contact/street1'
+ATTRIBUTE_STREET_2 = 'http://schema.openid.net/contact/street2'
+ATTRIBUTE_CITY = 'http://axschema.org/contact/city/home'
+ATTRIBUTE_STATE = 'http://axschema.org/contact/state/home'
+ATTRIBUTE_PHONE = 'http://axschema.org/contact/phone/default'
+
+BASIC_ATTRIBUTES = frozenset([ATTRIBUTE_FIRST_NAME,
+                              ATTRIBUTE_LAST_NAME,
+                              ATTRIBUTE_EMAIL,
+                              ATTRIBUTE_FULL_NAME,
+                              ATTRIBUTE_BUSINESS_NAME,
+                              ATTRIBUTE_COUNTRY,
+                              ATTRIBUTE_PAYER_ID])
+
+ADVANCED_ATTRIBUTES = frozenset([ATTRIBUTE_DATE_OF_BIRTH,
+                                 ATTRIBUTE_POSTAL_CODE,
+                                 ATTRIBUTE_STREET_1,
+                                 ATTRIBUTE_STREET_2,
+                                 ATTRIBUTE_CITY,
+                                 ATTRIBUTE_STATE,
+                                 ATTRIBUTE_PHONE])
+
+#: Caches keyed by access token, which are invalidated once the
+#: permissions of a token are cancelled using ``'cancel'``.
+_token_caches = weakref.WeakSet()
+
+#: Bit assigned to each permission group. A set of granted groups is
+#: represented as a single integer by OR-ing the bits of its members.
+GROUP_BITS = dict((group, 1 << index)
+                  for index, group in enumerate(sorted(ALL_GROUPS)))
+
+#: Precomputed bitmask of the group each operation belongs to
+OPERATION_MASKS = dict((operation, GROUP_BITS[group])
+                       for operation, group
+                       in REQUEST_PERMISSION_MAPPING.items())
+
+#: Bitmask of all groups which require approval by PayPal
+APPROVAL_MASK = 0
+for _group in REQUIRES_APPROVAL:
+    APPROVAL_MASK |= GROUP_BITS[_group]
+del _group
+
 
 ##############################################################################
 # FUNCTIONS WHICH FURTHER AIDS IMPLEMENTATION OF THIS SERVICE
 ##############################################################################
 
-def call(client, method, params):
+def call(client, method, params, credentials=None, deadline=None):
     endpoint = (PRODUCTION_ENDPOINT, SANDBOX_ENDPOINT)
     endpoint = endpoint[int(client.config.in_sandbox)]
-    return client.call('Permissions', method, endpoint=endpoint, **params)
+    return client.call('Permissions', method, endpoint=endpoint,
+                       credentials=credentials, deadline=deadline, **params)
 
 
 def is_approval_required(group):
@@ -138,16 +237,279 @@ def is_approval_required(group):
 
 
 def is_operation_approval_required(operation):
-    group = get_corresponding_group(operation)
-    return is_approval_required(group)
+    return bool(OPERATION_MASKS.get(operation, 0) & APPROVAL_MASK)
 
 
 def get_corresponding_group(operation):
     return REQUEST_PERMISSION_MAPPING.get(operation)
 
 
-def get_grant_url(client, groups, callback_url):
-    response = request(client, groups, callback_url)
+def get_groups_mask(groups):
+    """Convert an iterable of permission groups into its bitmask.
+    Unknown groups are ignored.
+
+    :param groups: The permission groups, e.g the scope of a token
+    """
+    mask = 0
+    for group in groups:
+        mask |= GROUP_BITS.get(group, 0)
+    return mask
+
+
+def is_operation_granted(mask, operation):
+    """Check whether the group of given operation is part of the bitmask.
+
+    :param mask: Bitmask of granted groups, see ``'get_groups_mask'``
+    :param operation: The API operation, e.g GetTransactionDetails
+    """
+    return bool(OPERATION_MASKS.get(operation, 0) & mask)
+
+
+class GrantCache(object):
+    """Cache of the permission groups granted to access tokens.
+
+    Lookups are answered from memory. Tokens which have never been seen
+    are fetched using the GetPermissions API call, while entries older
+    than the TTL keep answering from memory while being refreshed in
+    the background. Tokens which failed to be fetched are considered to
+    have no groups granted until the failure TTL has passed.
+    """
+    def __init__(self, client, ttl=GRANT_CACHE_TTL,
+                 failure_ttl=GRANT_CACHE_FAILURE_TTL):
+        """
+        :param client: An instance of ``'pypal.Client'``
+        :param ttl: Amount of seconds before an entry is refreshed
+        :param failure_ttl: Amount of seconds before a token which failed
+                            to be fetched is fetched again.
+        """
+        self.client = client
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self._entries = {}
+        self._failures = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        _token_caches.add(self)
+
+    def set(self, access_token, groups):
+        """Store the groups granted to given access token.
+
+        :param access_token: The access token of the merchant
+        :param groups: The permission groups granted
+        """
+        self._entries[access_token] = (get_groups_mask(groups), time.time())
+
+    def invalidate(self, access_token):
+        self._entries.pop(access_token, None)
+        self._failures.pop(access_token, None)
+
+    def refresh(self, access_token):
+        """Fetch the granted groups for given access token from PayPal.
+        Returns the new bitmask or ``None`` on failure.
+
+        :param access_token: The access token of the merchant
+        """
+        try:
+            response = get(self.client, access_token)
+        except (urllib2.URLError, Timeout):
+            response = None
+        finally:
+            with self._lock:
+                self._refreshing.discard(access_token)
+
+        if response is None or not response.success:
+            self._failures[access_token] = time.time()
+            return None
+
+        self._failures.pop(access_token, None)
+        scope = response.get('scope', None) or []
+        if isinstance(scope, basestring):
+            scope = [scope]
+        self.set(access_token, scope)
+        return self._entries[access_token][0]
+
+    def get_mask(self, access_token):
+        """Retrieve the bitmask of groups granted to given access token.
+
+        :param access_token: The access token of the merchant
+        """
+        entry = self._entries.get(access_token, None)
+        if entry is None:
+            if self._has_failed_recently(access_token):
+                return 0
+            return self.refresh(access_token) or 0
+
+        mask, fetched_at = entry
+        if time.time() - fetched_at > self.ttl:
+            self._refresh_in_background(access_token)
+        return mask
+
+    def check(self, access_token, operation):
+        return is_operation_granted(self.get_mask(access_token), operation)
+
+    def check_many(self, merchants, operations, workers=4):
+        """Check whether each merchant has granted the group required
+        to execute the operation at the same position. Tokens which have
+        never been seen are fetched concurrently.
+
+        :param merchants: Sequence of access tokens
+        :param operations: Sequence of operations of equal length, or a
+                           single operation which applies to all merchants.
+        :param workers: Amount of tokens to fetch concurrently
+        """
+        if isinstance(operations, basestring):
+            operations = [operations] * len(merchants)
+
+        cold = set(access_token for access_token in merchants
+                   if access_token not in self._entries and
+                   not self._has_failed_recently(access_token))
+        for _ in concurrent_imap(self.refresh, cold, workers=workers,
+                                 ordered=False):
+            pass
+
+        masks = {}
+        ret = []
+        for access_token, operation in zip(merchants, operations):
+            mask = masks.get(access_token, None)
+            if mask is None:
+                mask = masks[access_token] = self.get_mask(access_token)
+            ret.append(is_operation_granted(mask, operation))
+        return ret
+
+    def _has_failed_recently(self, access_token):
+        failed_at = self._failures.get(access_token, None)
+        return (failed_at is not None and
+                time.time() - failed_at <= self.failure_ttl)
+
+    def _refresh_in_background(self, access_token):
+        with self._lock:
+            if access_token in self._refreshing:
+                return
+            self._refreshing.add(access_token)
+
+        thread = threading.Thread(target=self.refresh, args=(access_token,))
+        thread.daemon = True
+        thread.start()
+
+
+class PersonalDataCache(object):
+    """Cache of the personal data of the accounts which have granted
+    access to it, keyed by access token.
+
+    Only the attributes which are missing or older than the TTL are
+    fetched, using GetBasicPersonalData and GetAdvancedPersonalData
+    depending on the attributes. Entries of an access token are removed
+    once its permissions are cancelled using ``'cancel'``.
+    """
+    def __init__(self, client, ttl=PERSONAL_DATA_CACHE_TTL):
+        """
+        :param client: An instance of ``'pypal.Client'``
+        :param ttl: Amount of seconds an attribute is cached
+        """
+        self.client = client
+        self.ttl = ttl
+        self._entries = {}
+        _token_caches.add(self)
+
+    def invalidate(self, access_token):
+        self._entries.pop(access_token, None)
+
+    def get(self, credentials, attributes=BASIC_ATTRIBUTES, deadline=None):
+        """Retrieve dictionary of the given attributes of the account.
+        Attributes the account lacks are None while the ones which could
+        not be fetched are omitted.
+
+        :param credentials: Tuple of access token and token secret
+        :param attributes: The attribute URIs to retrieve
+        :param deadline: Instance of ``'pypal.deadline.Deadline'``
+        """
+        access_token = credentials[0]
+        entry = self._entries.get(access_token, None) or {}
+        threshold = time.time() - self.ttl
+
+        missing = [attribute for attribute in attributes
+                   if entry.get(attribute, (None, 0))[1] <= threshold]
+        if missing:
+            fetched = fetch_personal_data(self.client, credentials, missing,
+                                          deadline=deadline)
+            fetched_at = time.time()
+            entry = dict(self._entries.get(access_token, None) or {})
+            for attribute, value in fetched.items():
+                entry[attribute] = (value, fetched_at)
+            self._entries[access_token] = entry
+
+        return dict((attribute, entry[attribute][0])
+                    for attribute in attributes if attribute in entry)
+
+    def get_many(self, credentials_list, attributes=BASIC_ATTRIBUTES,
+                 workers=4, deadline=None):
+        """Retrieve the attributes of many accounts at once, fetching the
+        ones which are not cached concurrently. Returns a dictionary of
+        the attributes keyed by access token, which are None for the
+        accounts PayPal could not be reached for.
+
+        :param credentials_list: List of access token and secret tuples
+        :param workers: Amount of accounts to fetch concurrently
+        """
+        def fetch(credentials):
+            try:
+                data = self.get(credentials, attributes, deadline=deadline)
+            except (urllib2.URLError, Timeout):
+                data = None
+            return (credentials[0], data)
+
+        return dict(concurrent_imap(fetch, credentials_list,
+                                    workers=workers))
+
+
+def fetch_personal_data(client, credentials, attributes, deadline=None):
+    """Fetch the given attributes of the account using the least amount of
+    API calls. Returns a dictionary of the attribute values, which omits
+    the attributes of failed calls.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param credentials: Tuple of access token and token secret
+    :param attributes: The attribute URIs to retrieve
+    """
+    basic = [attribute for attribute in attributes
+             if attribute not in ADVANCED_ATTRIBUTES]
+    advanced = [attribute for attribute in attributes
+                if attribute in ADVANCED_ATTRIBUTES]
+
+    ret = {}
+    responses = []
+    if basic:
+        responses.append((basic, get_basic_personal_data(
+            client, credentials, basic, deadline=deadline)))
+    if advanced:
+        responses.append((advanced, get_advanced_personal_data(
+            client, credentials, advanced, deadline=deadline)))
+
+    for requested, response in responses:
+        if not response.success:
+            continue
+        # Attributes the account lacks are None, rather than refetched
+        ret.update(dict.fromkeys(requested))
+        ret.update(get_personal_data(response))
+    return ret
+
+
+def get_personal_data(response):
+    """Convert the personal data of a GetBasicPersonalData or
+    GetAdvancedPersonalData response into a dictionary.
+    """
+    if not response.success:
+        return {}
+
+    data = (response.get('response', None) or {}).get('personalData', None)
+    if isinstance(data, dict):
+        data = [data]
+    return dict((item.get('personalDataKey'), item.get('personalDataValue'))
+                for item in data or ())
+
+
+def get_grant_url(client, groups, callback_url, deadline=None):
+    response = request(client, groups, callback_url, deadline=deadline)
     if not response.success:
         return None
 
@@ -158,8 +520,9 @@ def get_grant_url(client, groups, callback_url):
                                  '&request_token=%s' % request_token)
 
 
-def get_credentials(client, request_token, verification_code):
-    response = get_access_token(client, request_token, verification_code)
+def get_credentials(client, request_token, verification_code, deadline=None):
+    response = get_access_token(client, request_token, verification_code,
+                                deadline=deadline)
     if not response.success:
         return (None, None)
 
@@ -173,19 +536,21 @@ def get_credentials(client, request_token, verification_code):
 # FUNCTIONS WHICH DIRECTLY CORRESPONDS TO PAYPAL API CALLS
 ##############################################################################
 
-def get_access_token(client, request_token, verification_code):
+def get_access_token(client, request_token, verification_code,
+                     deadline=None):
     if not (request_token or verification_code):
         raise ValueError('Invalid arguments given')
 
     params = dict(token=request_token, verifier=verification_code)
-    return call(client, 'GetAccessToken', params)
+    return call(client, 'GetAccessToken', params, deadline=deadline)
 
 
-def get(client, access_token):
-    return call(client, 'GetPermissions', dict(token=access_token))
+def get(client, access_token, deadline=None):
+    return call(client, 'GetPermissions', dict(token=access_token),
+                deadline=deadline)
 
 
-def request(client, groups, callback_url):
+def request(client, groups, callback_url, deadline=None):
     if not groups:
         raise ValueError('No groups given and therefore no request to'
                          'grant them is necessary')
@@ -194,8 +559,27 @@ def request(client, groups, callback_url):
         raise ValueError('No callback URL specified; aborting request')
 
     params = dict(scope=groups, callback=callback_url)
-    return call(client, 'RequestPermissions', params)
+    return call(client, 'RequestPermissions', params, deadline=deadline)
+
+
+def cancel(client, access_token, deadline=None):
+    response = call(client, 'CancelPermissions', dict(token=access_token),
+                    deadline=deadline)
+    if response.success:
+        for cache in list(_token_caches):
+            cache.invalidate(access_token)
+    return response
+
+
+def get_basic_personal_data(client, credentials, attributes=BASIC_ATTRIBUTES,
+                            deadline=None):
+    params = dict(attributeList=dict(attribute=list(attributes)))
+    return call(client, 'GetBasicPersonalData', params,
+                credentials=credentials, deadline=deadline)
 
 
-def cancel(client, access_token):
-    return call(client, 'CancelPermissions', dict(token=access_token))
+def get_advanced_personal_data(client, credentials,
+                               attributes=ADVANCED_ATTRIBUTES, deadline=None):
+    params = dict(attributeList=dict(attribute=list(attributes)))
+    return call(client, 'GetAdvancedPersonalData', params,
+                credentials=credentials, deadline=deadline)
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Implementation of the TransactionSearch and GetTransactionDetails API
+calls of the classic Name-Value Pair API.
+
+PayPal truncates search results at ``'MAX_SEARCH_RESULTS'`` transactions.
+``'search'`` therefore splits the date range into windows, fetches them
+concurrently and splits every truncated window in halves until each one
+fits. Transactions are yielded lazily, window by window, in chronological
+order; memory usage does not depend on the size of the range.
+
+``'Hydrator'`` retrieves the details of a stream of transaction ids,
+e.g the results of a search, utilizing a local cache of settled
+transactions and fetching the rest concurrently.
+"""
+
+import threading
+
+from collections import OrderedDict
+from datetime import timedelta
+
+from pypal import NVPResponse, nvp, util
+from pypal.deadline import Timeout
+from pypal.store import Store
+from pypal.util import concurrent_imap
+
+logging = util.lazy_module('logging')
+urllib2 = util.lazy_module('urllib2')
+
+#: Maximum amount of transactions returned per search
+MAX_SEARCH_RESULTS = 100
+
+#: Error code of the warning returned along with truncated search results
+ERROR_CODE_RESULTS_TRUNCATED = '11002'
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+#: Default size of the windows the date range is initially split into
+DEFAULT_WINDOW = timedelta(days=1)
+
+#: Windows are not split further than this even if truncated
+MIN_WINDOW = timedelta(seconds=1)
+
+DEFAULT_WORKERS = 4
+
+#: Amount of failed lookups kept by ``'Hydrator'``, oldest are dropped first
+DEFAULT_MAX_FAILURES = 1000
+
+#: Payment statuses of transactions which are cached by ``'Hydrator'``
+#: since their details are not expected to change.
+SETTLED_PAYMENT_STATUSES = frozenset(['Completed',
+                                      'Denied',
+                                      'Expired',
+                                      'Failed',
+                                      'Refunded',
+                                      'Reversed',
+                                      'Voided',
+                                      'Canceled-Reversal'])
+
+#: The indexed fields of each transaction in the search results
+SEARCH_RESULT_FIELDS = ('TIMESTAMP',
+                        'TIMEZONE',
+                        'TYPE',
+                        'EMAIL',
+                        'NAME',
+                        'TRANSACTIONID',
+                        'STATUS',
+                        'AMT',
+                        'CURRENCYCODE',
+                        'FEEAMT',
+                        'NETAMT')
+
+##############################################################################
+# FUNCTIONS WHICH FURTHER AIDS IMPLEMENTATION OF THIS SERVICE
+##############################################################################
+
+def format_date(value):
+    """Format given datetime, assumed to be in UTC, for PayPal."""
+    return value.strftime(DATE_FORMAT)
+
+def split_range(start, end, window):
+    """Split the inclusive range into consecutive, non-overlapping
+    windows of the given size with a resolution of one second.
+
+    :param start: The first datetime of the range
+    :param end: The last datetime of the range
+    :param window: The size of each window as a timedelta
+    """
+    windows = []
+    step = window - MIN_WINDOW
+    while start <= end:
+        windows.append((start, min(start + step, end)))
+        start = start + window
+    return windows
+
+def split_window(window):
+    """Split the window in halves, returns None if too small to split.
+    The midpoint is floored to whole seconds, the resolution of PayPal.
+    """
+    start, end = window
+    first = start.replace(microsecond=0)
+    last = end.replace(microsecond=0)
+    if last - first <= MIN_WINDOW:
+        return None
+
+    seconds = int((last - first).total_seconds())
+    middle = first + timedelta(seconds=seconds // 2)
+    return [(start, middle), (middle + MIN_WINDOW, end)]
+
+def is_truncated(response):
+    """Check whether the search results of the response are truncated."""
+    if response.get_ack(as_upper=True) != 'SUCCESSWITHWARNING':
+        return False
+    return any(error.get('ERRORCODE') == ERROR_CODE_RESULTS_TRUNCATED
+               for error in response.get_errors())
+
+def search(client,
+           start,
+           end,
+           filters=None,
+           window=DEFAULT_WINDOW,
+           workers=DEFAULT_WORKERS,
+           credentials=None):
+    """Lazily yield every transaction within the date range as a
+    dictionary keyed by the fields in ``'SEARCH_RESULT_FIELDS'``.
+
+    Raises ``ValueError`` in case PayPal responds with a failure.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param start: The first datetime of the range, in UTC
+    :param end: The last datetime of the range, in UTC
+    :param filters: Dictionary of additional search arguments,
+                    e.g ``{'STATUS': 'Success'}``.
+    :param window: The size of the windows to initially fetch
+    :param workers: Amount of windows to fetch concurrently
+    :param credentials: Tuple of access token and token secret in case
+                        the search is executed on behalf of another account.
+    """
+    def fetch(window):
+        response = transaction_search(client, window[0], window[1],
+                                      filters=filters,
+                                      credentials=credentials)
+        if not response.success:
+            raise ValueError('TransactionSearch failed between %s and %s: '
+                             '%s' % (window[0], window[1],
+                                     response.get_errors()))
+
+        if is_truncated(response):
+            windows = split_window(window)
+            if windows:
+                return (windows, None)
+            logging.warning('Truncated results within minimal window '
+                            'starting %s', window[0])
+
+        rows = nvp.parse_indexed(response, SEARCH_RESULT_FIELDS)
+        # PayPal returns the most recent transaction first
+        rows.reverse()
+        return (None, rows)
+
+    def iterate(windows):
+        for splits, rows in concurrent_imap(fetch, windows, workers=workers):
+            if splits:
+                for row in iterate(splits):
+                    yield row
+                continue
+            for row in rows:
+                yield row
+
+    return iterate(split_range(start, end, window))
+
+class Hydrator(object):
+    """Retrieves the details of transactions using GetTransactionDetails.
+
+    Settled transactions are kept in a store, persistent if given one
+    backed by sqlite, and are answered from it on subsequent lookups.
+    """
+    def __init__(self,
+                 client,
+                 store=None,
+                 workers=DEFAULT_WORKERS,
+                 credentials=None,
+                 settled_statuses=SETTLED_PAYMENT_STATUSES,
+                 max_failures=DEFAULT_MAX_FAILURES):
+        """
+        :param client: An instance of ``'pypal.Client'``
+        :param store: Instance of ``'pypal.store.Store'`` to cache in
+        :param workers: Amount of details to fetch concurrently
+        :param credentials: Tuple of access token and token secret
+        :param settled_statuses: Payment statuses of details to cache
+        :param max_failures: Amount of failed lookups to keep
+        """
+        self.client = client
+        self.store = store if store is not None else Store()
+        self.workers = workers
+        self.credentials = credentials
+        self.settled_statuses = settled_statuses
+        self.hits = 0
+        self.misses = 0
+        self.max_failures = max_failures
+        #: Responses of the most recent failed lookups keyed by
+        #: transaction id, at most ``'max_failures'`` of them.
+        self.failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def get(self, transaction_id):
+        """Retrieve the details of a transaction as a dictionary,
+        ``None`` in case the lookup failed.
+
+        :param transaction_id: The PayPal transaction id
+        """
+        details = self.store.get(transaction_id)
+        if details is not None:
+            with self._lock:
+                self.hits += 1
+            return details
+
+        with self._lock:
+            self.misses += 1
+
+        try:
+            response = get_transaction_details(client=self.client,
+                                               transaction_id=transaction_id,
+                                               credentials=self.credentials)
+        except (urllib2.URLError, Timeout) as e:
+            response = NVPResponse(None, None, error=e)
+
+        if not response.success:
+            with self._lock:
+                self.failures.pop(transaction_id, None)
+                self.failures[transaction_id] = response
+                while len(self.failures) > self.max_failures:
+                    self.failures.popitem(last=False)
+            return None
+
+        with self._lock:
+            self.failures.pop(transaction_id, None)
+        details = dict(response)
+        if details.get('PAYMENTSTATUS') in self.settled_statuses:
+            self.store.set(transaction_id, details)
+        return details
+
+    def hydrate(self, transaction_ids):
+        """Lazily yield tuples of transaction id and details, as retrieved
+        by ``'get'``, in the order they become available. Duplicated ids
+        are only looked up once.
+
+        :param transaction_ids: Iterable of transaction ids
+        """
+        def unique(ids):
+            seen = set()
+            for transaction_id in ids:
+                if transaction_id in seen:
+                    continue
+                seen.add(transaction_id)
+                yield transaction_id
+
+        def lookup(transaction_id):
+            return (transaction_id, self.get(transaction_id))
+
+        return concurrent_imap(lookup, unique(transaction_ids),
+                               workers=self.workers, ordered=False)
+
+##############################################################################
+# FUNCTIONS WHICH DIRECTLY CORRESPONDS TO PAYPAL API CALLS
+##############################################################################
+
+def call(client, method, params, credentials=None, deadline=None):
+    return client.call_nvp(method, params=params, credentials=credentials,
+                           deadline=deadline)
+
+def transaction_search(client,
+                       start,
+                       end=None,
+                       filters=None,
+                       credentials=None,
+                       deadline=None):
+    """Execute the TransactionSearch API call.
+
+    :param client: An instance of ``'pypal.Client'``
+    :param start: The earliest datetime to search from, in UTC
+    :param end: The latest datetime to search until, in UTC
+    :param filters: Dictionary of additional search arguments
+    :param credentials: Tuple of access token and token secret
+    :param deadline: Instance of ``'pypal.deadline.Deadline'``
+    """
+    params = dict(filters or {})
+    params['STARTDATE'] = format_date(start)
+    if end:
+        params['ENDDATE'] = format_date(end)
+    return call(client, 'TransactionSearch', params,
+                credentials=credentials, deadline=deadline)
+
+def get_transaction_details(client,
+                            transaction_id,
+                            credentials=None,
+                            deadline=None):
+    return call(client, 'GetTransactionDetails',
+                {'TRANSACTIONID': transaction_id},
+                credentials=credentials, deadline=deadline)
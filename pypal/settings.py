@@ -8,15 +8,26 @@ SANDBOX_CERTIFICATE_ENDPOINT = 'https://api.sandbox.paypal.com/nvp'
 PRODUCTION_3TOKEN_ENDPOINT = 'https://api-3t.paypal.com/nvp'
 PRODUCTION_CERTIFICATE_ENDPOINT = 'https://api.paypal.com/nvp'
 
+#: Version of the classic Name-Value Pair API to target
+NVP_API_VERSION = '98.0'
+
 NVP_FORMAT = 'NV'
 XML_FORMAT = 'XML'
 JSON_FORMAT = 'JSON'
 
 SUPPORTED_FORMATS = {JSON_FORMAT: True,
-                     NVP_FORMAT: True}
+                     NVP_FORMAT: True,
+                     XML_FORMAT: True}
 
 DEFAULT_REQUEST_ENVELOPE = {'errorLanguage': 'en_US'}
 
+#: Amount of seconds to wait for PayPal to respond to a request
+DEFAULT_TIMEOUT = 30
+
+#: Minimum size in bytes of request bodies to compress, given that request
+#: compression has been enabled for the endpoint.
+DEFAULT_COMPRESSION_THRESHOLD = 1024
+
 class Config(object):
     """
     """
@@ -25,10 +36,15 @@ class Config(object):
                  api_password=None,
                  api_signature=None,
                  application_id=None,
+                 api_subject=None,
                  token_authentication=True,
                  in_sandbox=True,
                  api_format=JSON_FORMAT,
                  request_envelope=DEFAULT_REQUEST_ENVELOPE,
+                 timeout=DEFAULT_TIMEOUT,
+                 accept_compression=True,
+                 compress_requests=False,
+                 compression_threshold=DEFAULT_COMPRESSION_THRESHOLD,
                  **kwargs):
         """
         """
@@ -36,15 +52,58 @@ class Config(object):
         self.api_password = api_password
         self.api_signature = api_signature
         self.application_id = application_id
+        self.api_subject = api_subject
         self.token_authentication = token_authentication
         self.in_sandbox = in_sandbox
         self.api_format = api_format
         self.request_envelope = request_envelope
+        self.timeout = timeout
+        self.accept_compression = accept_compression
+        self.compress_requests = compress_requests
+        self.compression_threshold = compression_threshold
 
         if kwargs:
             for k, v in kwargs.items():
                 setattr(self, k, v)
 
+    def __setattr__(self, name, value):
+        if self.__dict__.get('_frozen', False):
+            raise AttributeError('Configuration is frozen and cannot '
+                                 'be modified')
+        object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, Config):
+            return NotImplemented
+        return self.identity == other.identity
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    @property
+    def identity(self):
+        """Hashable representation of all configured values."""
+        items = ((k, _make_hashable(v)) for k, v in self.__dict__.items()
+                 if k != '_frozen')
+        return tuple(sorted(items))
+
+    def freeze(self):
+        """Prevent further modification of the configuration. Required
+        before it is utilized as a key, e.g in ``'pypal.registry'``.
+        """
+        self.__dict__['_frozen'] = True
+        return self
+
+    @property
+    def is_frozen(self):
+        return self.__dict__.get('_frozen', False)
+
     def get_format(self):
         return self.api_format
 
@@ -70,3 +129,12 @@ class Config(object):
         if self.token_authentication:
             return PRODUCTION_3TOKEN_ENDPOINT
         return PRODUCTION_CERTIFICATE_ENDPOINT
+
+def _make_hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _make_hashable(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(_make_hashable(v) for v in value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_make_hashable(v) for v in value)
+    return value
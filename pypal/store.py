@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Simple key-value store utilized to keep local state, e.g cached API
+responses, in memory or persisted to disk using sqlite.
+
+Values are serialized as JSON when persisted.
+"""
+
+import json
+import threading
+
+from pypal.util import lazy_module
+
+sqlite3 = lazy_module('sqlite3')
+
+class Store(object):
+    def __init__(self, path=None, table='store'):
+        """
+        :param path: Path of the sqlite database to persist values in,
+                     values are only kept in memory if not given.
+        :param table: Name of the table to utilize in the database
+        """
+        self.path = path
+        self.table = table
+        self._values = {}
+        self._lock = threading.RLock()
+        self._connection = None
+
+        if path:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS %s '
+                                     '(key TEXT PRIMARY KEY, value TEXT)'
+                                     % table)
+            self._connection.commit()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        if not self._connection:
+            return len(self._values)
+
+        with self._lock:
+            cursor = self._connection.execute('SELECT COUNT(*) FROM %s'
+                                              % self.table)
+            return cursor.fetchone()[0]
+
+    def get(self, key, default=None):
+        if not self._connection:
+            return self._values.get(key, default)
+
+        with self._lock:
+            cursor = self._connection.execute('SELECT value FROM %s '
+                                              'WHERE key = ?' % self.table,
+                                              (key,))
+            row = cursor.fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        if not self._connection:
+            self._values[key] = value
+            return
+
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO %s (key, value) '
+                                     'VALUES (?, ?)' % self.table,
+                                     (key, json.dumps(value)))
+            self._connection.commit()
+
+    def delete(self, key):
+        if not self._connection:
+            self._values.pop(key, None)
+            return
+
+        with self._lock:
+            self._connection.execute('DELETE FROM %s WHERE key = ?'
+                                     % self.table, (key,))
+            self._connection.commit()
+
+    def items(self):
+        """Retrieve list of all key-value tuples."""
+        if not self._connection:
+            return list(self._values.items())
+
+        with self._lock:
+            cursor = self._connection.execute('SELECT key, value FROM %s'
+                                              % self.table)
+            rows = cursor.fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def close(self):
+        if self._connection:
+            self._connection.close()
+            self._connection = None
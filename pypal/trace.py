@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Structured tracing of the client, the NVP codec and the IPN listener.
+
+Every subsystem, e.g ``'client'``, ``'nvp'`` and ``'ipn'``, has its own
+level and sample rate. All subsystems are disabled by default. Call sites
+check ``'enabled'`` before building an event, which means nothing is
+formatted or even collected unless the subsystem is traced::
+
+    if trace.enabled(SUBSYSTEM):
+        trace.event(SUBSYSTEM, 'render', params=params)
+
+Values of fields may be callables, which are only invoked once the event
+has passed sampling. Credentials and personal data are redacted from all
+fields before events reach the handlers.
+"""
+
+import time
+
+from pypal.util import lazy_module
+
+logging = lazy_module('logging')
+random = lazy_module('random')
+
+LEVEL_DEBUG = 10
+LEVEL_INFO = 20
+LEVEL_WARNING = 30
+LEVEL_ERROR = 40
+LEVEL_OFF = 100
+
+REDACTED = '***'
+
+#: Keys, compared in lowercase, whose values are always redacted
+SENSITIVE_KEYS = frozenset(['user', 'pwd', 'subject', 'token', 'verifier'])
+
+#: Keys containing any of these lowercase fragments are redacted, e.g
+#: the X-PAYPAL-SECURITY-* headers, the transaction[n].receiver fields of
+#: notifications and the personalDataValue of personal data responses.
+SENSITIVE_KEY_FRAGMENTS = ('password',
+                           'signature',
+                           'secret',
+                           'security',
+                           'authorization',
+                           'userid',
+                           'email',
+                           'phone',
+                           'address',
+                           'first_name',
+                           'last_name',
+                           'payer',
+                           'receiver',
+                           'personaldatavalue')
+
+#: Level of each traced subsystem
+_levels = {}
+
+#: Sample rate of each traced subsystem, between 0 and 1
+_sample_rates = {}
+
+#: Callables which receive every emitted event
+_handlers = []
+
+def configure(subsystem, level=LEVEL_DEBUG, sample_rate=1.0):
+    """Enable tracing of a subsystem.
+
+    :param subsystem: Name of the subsystem, e.g nvp
+    :param level: Minimum level of the events to emit,
+                  ``'LEVEL_OFF'`` disables the subsystem.
+    :param sample_rate: Fraction of the events to emit
+    """
+    if level >= LEVEL_OFF:
+        _levels.pop(subsystem, None)
+        _sample_rates.pop(subsystem, None)
+        return
+    _levels[subsystem] = level
+    _sample_rates[subsystem] = sample_rate
+
+def disable(subsystem):
+    configure(subsystem, level=LEVEL_OFF)
+
+def add_handler(handler):
+    """Register a callable which is given each event as a dictionary.
+    Events are passed along to the logging module if none is registered.
+    """
+    _handlers.append(handler)
+
+def remove_handler(handler):
+    _handlers.remove(handler)
+
+def enabled(subsystem, level=LEVEL_DEBUG):
+    return _levels.get(subsystem, LEVEL_OFF) <= level
+
+def event(subsystem, name, level=LEVEL_DEBUG, **fields):
+    """Emit an event in case the subsystem is traced at given level
+    and the event is sampled.
+
+    :param subsystem: Name of the subsystem
+    :param name: Name of the event
+    :param level: The level of the event
+    :param fields: The data of the event
+    """
+    if not enabled(subsystem, level):
+        return
+
+    sample_rate = _sample_rates.get(subsystem, 1.0)
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+
+    for key, value in fields.items():
+        if callable(value):
+            fields[key] = value()
+
+    data = {'subsystem': subsystem,
+            'name': name,
+            'level': level,
+            'time': time.time(),
+            'fields': redact(fields)}
+
+    for handler in (_handlers or (log_handler,)):
+        handler(data)
+
+def is_sensitive_key(key):
+    if not isinstance(key, basestring):
+        return False
+
+    key = key.lower()
+    if key in SENSITIVE_KEYS:
+        return True
+    return any(fragment in key for fragment in SENSITIVE_KEY_FRAGMENTS)
+
+def redact(value):
+    """Recursively replace the values of sensitive keys in dictionaries
+    and key-value tuples, e.g the prepared NVP pairs.
+
+    :param value: The value to redact
+    """
+    if isinstance(value, dict):
+        return dict((k, REDACTED if is_sensitive_key(k) else redact(v))
+                    for k, v in value.items())
+
+    if isinstance(value, (list, tuple)):
+        if (isinstance(value, tuple) and len(value) == 2 and
+                is_sensitive_key(value[0])):
+            return (value[0], REDACTED)
+        return type(value)(redact(v) for v in value)
+    return value
+
+def log_handler(data):
+    """Pass the event along to the pypal.<subsystem> logger."""
+    logger = logging.getLogger('pypal.%s' % data['subsystem'])
+    logger.log(data['level'], '%s %r', data['name'], data['fields'])
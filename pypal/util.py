@@ -1,9 +1,151 @@
 # -*- coding: utf-8 -*-
 
-import json
+import re
+import sys
+import time
+
+from datetime import datetime
 
 TIME_FORMAT = '%a %b %d %H:%M:%S %Y'
 
+#: Matches the ISO 8601 timestamps of the Adaptive APIs, e.g
+#: 2013-03-01T00:00:00.000-08:00
+ISO_TIMESTAMP = re.compile(r'^(\d{4})-(\d{2})-(\d{2})'
+                           r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?)?'
+                           r'\s*(Z|[+-]\d{2}:?\d{2})?$')
+
+EPOCH = datetime(1970, 1, 1)
+
+#: Timezones utilized in conversion of PayPal timestamps; loaded on demand
+#: since pytz is an optional dependency.
+_timezones = {}
+
+class LazyModule(object):
+    """Proxy of a module which is imported on first attribute access.
+
+    Utilized in order to keep ``import pypal`` fast for short-lived
+    processes which might never touch the heavier dependencies.
+    The imported module is cached in the proxy.
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            name = self.__dict__['_name']
+            __import__(name)
+            module = self.__dict__['_module'] = sys.modules[name]
+        return module
+
+    def __getattr__(self, name):
+        value = getattr(self.load(), name)
+        # Cache the attribute in the proxy; subsequent lookups of it
+        # no longer reach this method.
+        self.__dict__[name] = value
+        return value
+
+def lazy_module(name):
+    return LazyModule(name)
+
+def load_module(module):
+    """Import the module behind a ``'LazyModule'`` proxy right away.
+    Modules which are no longer proxied, e.g submodules of pypal whose
+    import replaced the proxy on the package, are returned as is.
+    """
+    if isinstance(module, LazyModule):
+        return module.load()
+    return module
+
+Queue = lazy_module('Queue')
+threading = lazy_module('threading')
+
+def concurrent_imap(func, iterable, workers=4, ordered=True):
+    """Apply given function to every item of the iterable using a pool of
+    threads and yield the results, either in the order of the items or
+    as soon as they are available.
+
+    Items are consumed lazily and at most twice the amount of workers are
+    pending at any time, which keeps memory usage constant no matter the
+    length of the iterable. Exceptions raised by the function are raised
+    by the generator.
+
+    :param func: Function which is given one item at a time
+    :param iterable: The items to process
+    :param workers: Amount of threads
+    :param ordered: Whether to yield results in the order of the items
+    """
+    if workers <= 1:
+        for item in iterable:
+            yield func(item)
+        return
+
+    sentinel = object()
+    tasks = Queue.Queue()
+    results = Queue.Queue()
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is sentinel:
+                return
+            index, item = task
+            try:
+                results.put((index, True, func(item)))
+            except Exception as e:
+                results.put((index, False, e))
+
+    threads = [threading.Thread(target=work) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    iterator = iter(iterable)
+    window = workers * 2
+    submitted = 0
+    completed = 0
+    exhausted = False
+    buffered = {}
+    try:
+        while True:
+            while not exhausted and submitted - completed < window:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tasks.put((submitted, item))
+                submitted += 1
+
+            if completed == submitted:
+                return
+
+            index, succeeded, value = results.get()
+            if not succeeded:
+                raise value
+
+            if not ordered:
+                completed += 1
+                yield value
+                continue
+
+            buffered[index] = value
+            while completed in buffered:
+                yield buffered.pop(completed)
+                completed += 1
+    finally:
+        for _ in threads:
+            tasks.put(sentinel)
+
+def get_timezones():
+    """Retrieve tuple of the UTC and PayPal (US/Pacific) timezones."""
+    if not _timezones:
+        import pytz
+        _timezones['utc'] = pytz.timezone('UTC')
+        _timezones['paypal'] = pytz.timezone('US/Pacific')
+    return (_timezones['utc'], _timezones['paypal'])
+
 def convert_timestamp_into_utc(timestamp):
     """Convert given PayPal timestamp into UTC.
 
@@ -14,11 +156,7 @@ def convert_timestamp_into_utc(timestamp):
 
     :param timestamp: The PayPal timestamp
     """
-    import time, pytz
-    from datetime import datetime
-
-    utc = pytz.timezone('UTC')
-    paypal_timezone = pytz.timezone('US/Pacific')
+    utc, paypal_timezone = get_timezones()
 
     # This is a dragon. In the code. Hatching an egg.
     # This is in order to remove the timezone which cannot be
@@ -34,6 +172,27 @@ def convert_timestamp_into_utc(timestamp):
     normalized = paypal_timezone.normalize(localized)
     return normalized.astimezone(utc)
 
+def parse_iso_timestamp(timestamp):
+    """Convert given ISO 8601 timestamp into seconds since the epoch,
+    or None in case it cannot be parsed. Timestamps without an offset
+    are assumed to be in UTC.
+
+    :param timestamp: The timestamp, e.g 2013-03-01T00:00:00.000-08:00
+    """
+    match = ISO_TIMESTAMP.match(timestamp or '')
+    if match is None:
+        return None
+
+    year, month, day, hour, minute, second, offset = match.groups()
+    moment = datetime(int(year), int(month), int(day),
+                      int(hour or 0), int(minute or 0), int(second or 0))
+    seconds = (moment - EPOCH).total_seconds()
+    if offset and offset != 'Z':
+        offset = offset.replace(':', '')
+        sign = -1 if offset[0] == '-' else 1
+        seconds -= sign * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+    return seconds
+
 def check_required(arguments, required):
     for required_argument in required:
         v = arguments.get(required_argument, None)
@@ -48,8 +207,9 @@ def set_nonempty_param(params, key, value):
     return True
 
 def is_iterable(obj):
-    import collections
-    return (isinstance(obj, collections.Iterable) and not
+    # Equivalent of checking against collections.Iterable without
+    # having to import the collections module.
+    return (hasattr(obj, '__iter__') and not
             isinstance(obj, basestring))
 
 def ensure_unicode(obj):
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+This module handles processing of the PayPal XML format.
+
+Responses are parsed incrementally using an event based parser which
+discards every element once it has been converted, so the document tree
+is never held in memory. The resulting dictionary reflects the same
+hierarchy as the one retrieved by parsing the equivalent JSON response,
+with the root element omitted and namespaces stripped.
+
+Repeated elements are converted into lists. Since XML cannot express
+the difference, a list containing a single item is parsed as the item.
+"""
+
+from StringIO import StringIO
+from xml.etree import cElementTree
+from xml.sax.saxutils import escape
+
+#: Name of the root element rendered unless it can be determined
+DEFAULT_ROOT_ELEMENT = 'request'
+
+XML_DECLARATION = u'<?xml version="1.0" encoding="utf-8"?>'
+
+def parse(response):
+    """Convert the XML response into a dictionary.
+
+    :param response: The raw response or a file-like object to read it from
+    """
+    if not hasattr(response, 'read'):
+        if isinstance(response, unicode):
+            response = response.encode('utf-8')
+        response = StringIO(response)
+
+    # Stacks of the elements currently being parsed and the dictionaries
+    # which contain their children; the root element is at the bottom.
+    elements = []
+    stack = []
+    for event, element in cElementTree.iterparse(response, ('start', 'end')):
+        if event == 'start':
+            elements.append(element)
+            stack.append({})
+            continue
+
+        elements.pop()
+        children = stack.pop()
+        if not stack:
+            return children
+
+        if children:
+            value = children
+        else:
+            value = (element.text or '').strip()
+        _add_value(stack[-1], _strip_namespace(element.tag), value)
+        # Detach the converted element from its parent as well, which
+        # would otherwise keep every cleared element of the document.
+        element.clear()
+        elements[-1].remove(element)
+    return {}
+
+def render(dictionary, root=None):
+    """Render the dictionary into an XML document.
+
+    :param dictionary: The parameters to render
+    :param root: Name of the root element. In case it is not given and
+                 the dictionary only contains one nested dictionary its
+                 key is utilized, otherwise ``'DEFAULT_ROOT_ELEMENT'``.
+    """
+    if root is None:
+        root = DEFAULT_ROOT_ELEMENT
+        if len(dictionary) == 1:
+            key, value = list(dictionary.items())[0]
+            if isinstance(value, dict):
+                root, dictionary = key, value
+
+    # Parts are kept as unicode and encoded once, since tags and values
+    # might be given as either unicode or utf-8 encoded strings.
+    parts = [XML_DECLARATION]
+    _render_element(parts, _to_unicode(root), dictionary)
+    return u''.join(parts).encode('utf-8')
+
+def _add_value(target, key, value):
+    if key not in target:
+        target[key] = value
+        return
+
+    existing = target[key]
+    if isinstance(existing, list):
+        existing.append(value)
+    else:
+        target[key] = [existing, value]
+
+def _strip_namespace(tag):
+    if tag[0] == '{':
+        tag = tag[tag.index('}') + 1:]
+    return tag.rsplit(':', 1)[-1]
+
+def _render_element(parts, tag, value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            _render_element(parts, tag, item)
+        return
+
+    parts.append(u'<%s>' % tag)
+    if isinstance(value, dict):
+        for key, inner_value in value.items():
+            _render_element(parts, _to_unicode(key), inner_value)
+    elif value is not None:
+        parts.append(_render_value(value))
+    parts.append(u'</%s>' % tag)
+
+def _render_value(value):
+    if isinstance(value, bool):
+        return (u'false', u'true')[value]
+    return escape(_to_unicode(value))
+
+def _to_unicode(value):
+    if isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
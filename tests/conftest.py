@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+pypal targets Python 2. Run the tests using its unittest runner, i.e
+``python2 -m unittest discover -s tests -t .``
+"""
+
+import sys
+
+collect_ignore_glob = []
+if sys.version_info[0] > 2:
+    collect_ignore_glob.append('test_*.py')
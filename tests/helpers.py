@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the tests.
+"""
+
+import BaseHTTPServer
+import json
+import threading
+import urllib
+
+from pypal import Client, NVPResponse, Response, nvp, settings
+
+SUCCESS = {'responseEnvelope': {'ack': 'Success'}}
+FAILURE = {'responseEnvelope': {'ack': 'Failure'}}
+
+class FakeClient(Client):
+    """Client which answers calls using a handler rather than PayPal.
+
+    The handler is given the API action and the parsed request and
+    returns either a dictionary, which becomes the response, or an
+    instance of ``'pypal.Response'``. The deadline of every call is kept
+    in ``'deadlines'``.
+    """
+    def __init__(self, handler, **kwargs):
+        kwargs.setdefault('api_username', 'username')
+        kwargs.setdefault('api_password', 'password')
+        kwargs.setdefault('api_signature', 'signature')
+        Client.__init__(self, **kwargs)
+        self.handler = handler
+        self.calls = []
+        self.deadlines = []
+
+    def _execute(self, limiter_key, url, request_body, headers, timeout,
+                 deadline, format=None, response_class=None):
+        response_class = response_class or Response
+        if format == settings.NVP_FORMAT:
+            params = nvp.parse(request_body)
+            action = params['METHOD']
+        else:
+            params = json.loads(request_body)
+            action = url.rsplit('/', 1)[-1]
+
+        self.calls.append((action, params))
+        self.deadlines.append(deadline)
+        ret = self.handler(action, params)
+        if isinstance(ret, Response):
+            return ret
+        return response_class('', ret)
+
+class PostbackClient(Client):
+    """Client answering the IPN verification postback itself. The answer
+    is either the body to respond with or an exception to raise.
+    """
+    def __init__(self, answer='VERIFIED', **kwargs):
+        kwargs.setdefault('api_username', 'username')
+        kwargs.setdefault('api_password', 'password')
+        kwargs.setdefault('api_signature', 'signature')
+        Client.__init__(self, **kwargs)
+        self.answer = answer
+        self.postbacks = []
+
+    def send(self, url, body, headers=None, timeout=None):
+        self.postbacks.append(body)
+        answer = self.answer
+        if callable(answer):
+            answer = answer(body)
+        if isinstance(answer, Exception):
+            raise answer
+        return _PostbackResponse(answer)
+
+
+class _PostbackResponse(object):
+    def __init__(self, body):
+        self.body = body
+
+    def getcode(self):
+        return 200
+
+    def read(self):
+        return self.body
+
+def generate_ipn(pay_key='AP-1', status='COMPLETED', **fields):
+    """Generate the body of an Adaptive Payment IPN."""
+    fields.setdefault('transaction_type', 'Adaptive Payment PAY')
+    fields.update(pay_key=pay_key, status=status)
+    return urllib.urlencode(sorted(fields.items()))
+
+def nvp_success(**fields):
+    fields['ACK'] = 'Success'
+    return NVPResponse('', fields)
+
+class LoopbackServer(BaseHTTPServer.HTTPServer):
+    """HTTP server on the loopback interface answering every POST request
+    using the ``'respond'`` function, which is given the request handler
+    and returns a tuple of the status code, headers and body. Returning
+    ``None`` closes the connection without answering.
+    """
+    def __init__(self, respond):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _LoopbackHandler)
+        self.respond = respond
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _LoopbackHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        body = self.rfile.read(length)
+        self.server.requests.append((self.path, self.headers, body))
+        answer = self.server.respond(self)
+        if answer is None:
+            self.close_connection = 1
+            return
+        status, headers, body = answer
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
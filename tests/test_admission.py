@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from pypal import ipn
+from pypal.deadline import Deadline, Timeout
+from pypal.ipn import admission
+from pypal.ipn.admission import AdmissionController
+
+from tests.helpers import PostbackClient, generate_ipn
+
+class ListenerTest(unittest.TestCase):
+    def dispatch(self, answer):
+        listener = ipn.Listener(PostbackClient(answer))
+        events = []
+        listener.add(ipn.EVENT_ADAPTIVE, events.append)
+        listener.add(ipn.EVENT_INVALID_NOTIFICATION,
+                     lambda *args: events.append(args))
+        return listener.dispatch(generate_ipn()), events
+
+    def test_verified_notification_is_dispatched(self):
+        handled, events = self.dispatch('VERIFIED')
+        self.assertTrue(handled)
+        self.assertEqual(events[0]['pay_key'], 'AP-1')
+
+    def test_invalid_notification(self):
+        handled, events = self.dispatch('INVALID')
+        self.assertFalse(handled)
+        self.assertEqual(events[0][0], 200)
+
+    def test_timeout_propagates(self):
+        self.assertRaises(Timeout, self.dispatch, Timeout('timed out'))
+
+    def test_unexpected_answer_raises(self):
+        self.assertRaises(ipn.VerificationError, self.dispatch, '<html>')
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def make_controller(self, answer='VERIFIED', **kwargs):
+        listener = ipn.Listener(PostbackClient(answer))
+        self.dispatched = []
+        listener.add(ipn.EVENT_ADAPTIVE,
+                     lambda response: self.dispatched.append(response.status))
+        return AdmissionController(listener, **kwargs)
+
+    def test_dispatch(self):
+        controller = self.make_controller()
+        self.assertEqual(controller.handle(generate_ipn()), admission.HTTP_OK)
+        self.assertEqual(controller.handle(''), admission.HTTP_OK)
+        self.assertEqual(self.dispatched, ['COMPLETED'])
+
+    def test_invalid_notification_is_acknowledged(self):
+        controller = self.make_controller('INVALID')
+        self.assertEqual(controller.handle(generate_ipn()), admission.HTTP_OK)
+
+    def test_verification_timeout_is_not_acknowledged(self):
+        controller = self.make_controller(Timeout('timed out'))
+        self.assertEqual(controller.handle(generate_ipn()),
+                         admission.HTTP_SERVICE_UNAVAILABLE)
+        self.assertEqual(controller.get_metrics()['timeouts'], 1)
+        self.assertEqual(controller.get_metrics()['running'], 0)
+
+    def test_unexpected_answer_is_not_acknowledged(self):
+        controller = self.make_controller('<html>')
+        self.assertEqual(controller.handle(generate_ipn()),
+                         admission.HTTP_SERVICE_UNAVAILABLE)
+
+    def test_priority(self):
+        self.assertEqual(admission.get_priority(ipn.parse(generate_ipn())),
+                         admission.PRIORITY_COMPLETED)
+        self.assertEqual(admission.get_priority(ipn.parse(
+            generate_ipn(status='CREATED'))), admission.PRIORITY_PAYMENT)
+        self.assertEqual(admission.get_priority(ipn.parse(
+            generate_ipn(transaction_type='Adjustment'))),
+            admission.PRIORITY_INFORMATIONAL)
+
+    def test_shedding_and_priority_order(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def answer(body):
+            if 'BLOCK' in body:
+                started.set()
+                release.wait(5)
+            return 'VERIFIED'
+
+        controller = self.make_controller(answer, concurrency=1, max_queue=4,
+                                          informational_ratio=0.5)
+        codes = {}
+
+        def handle(name, body):
+            codes[name] = controller.handle(body)
+
+        def start(name, body):
+            thread = threading.Thread(target=handle, args=(name, body))
+            thread.start()
+            return thread
+
+        threads = [start('blocking', generate_ipn('BLOCK'))]
+        started.wait(5)
+        for index, status in enumerate(['CREATED', 'CREATED', 'COMPLETED']):
+            threads.append(start(status + str(index),
+                                 generate_ipn('AP-%d' % index, status)))
+            while controller.queue_depth < index + 1:
+                time.sleep(0.001)
+
+        # Informational notifications may only fill half of the queue
+        informational = generate_ipn(transaction_type='Adjustment')
+        self.assertEqual(controller.handle(informational),
+                         admission.HTTP_SERVICE_UNAVAILABLE)
+        threads.append(start('payment', generate_ipn('AP-3', 'PENDING')))
+        while controller.queue_depth < 4:
+            time.sleep(0.001)
+        # The queue is full
+        self.assertEqual(controller.handle(generate_ipn()),
+                         admission.HTTP_SERVICE_UNAVAILABLE)
+
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(set(codes.values()), set([admission.HTTP_OK]))
+        self.assertEqual(self.dispatched, ['COMPLETED', 'COMPLETED',
+                                           'CREATED', 'CREATED', 'PENDING'])
+        self.assertEqual(controller.get_metrics()['shed'], 2)
+
+    def test_deadline_bounds_queueing(self):
+        release = threading.Event()
+        controller = self.make_controller(lambda body: release.wait(5)
+                                          and 'VERIFIED', concurrency=1)
+        thread = threading.Thread(target=controller.handle,
+                                  args=(generate_ipn(),))
+        thread.start()
+        while not controller.get_metrics()['running']:
+            time.sleep(0.001)
+        try:
+            self.assertEqual(controller.handle(generate_ipn(),
+                                               deadline=Deadline(0.05)),
+                             admission.HTTP_SERVICE_UNAVAILABLE)
+            self.assertEqual(controller.queue_depth, 0)
+        finally:
+            release.set()
+            thread.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
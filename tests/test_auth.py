@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import hmac
+import unittest
+
+from base64 import b64encode
+from hashlib import sha1
+
+from pypal import Client, auth
+
+URL = 'https://svcs.sandbox.paypal.com/Permissions/GetBasicPersonalData'
+
+class SignatureTest(unittest.TestCase):
+    def setUp(self):
+        auth.clear_caches()
+
+    def test_signature_matches_reference(self):
+        params = ('oauth_consumer_key=user&oauth_signature_method=HMAC-SHA1'
+                  '&oauth_timestamp=1000&oauth_token=to%2Bken'
+                  '&oauth_version=1.0')
+        base = 'POST&%s&%s' % (auth.encode(URL), auth.encode(params))
+        expected = b64encode(hmac.new('pass&sec%2Fret', base, sha1).digest())
+
+        signature = auth.generate_signature('user', 'pass', 'to+ken',
+                                            'sec/ret', URL, 1000)
+        self.assertEqual(signature, expected)
+
+    def test_cached_signer_is_not_mutated(self):
+        first = auth.generate_signature('user', 'pass', 'token', 'secret',
+                                        URL, 1000)
+        second = auth.generate_signature('user', 'pass', 'token', 'secret',
+                                         URL, 1000)
+        self.assertEqual(first, second)
+
+    def test_header_depends_on_timestamp(self):
+        first = auth.get_authorization_header('user', 'pass', 'token',
+                                              'secret', URL, timestamp=1000)
+        second = auth.get_authorization_header('user', 'pass', 'token',
+                                               'secret', URL, timestamp=1001)
+        self.assertTrue(first.startswith('token=token,signature='))
+        self.assertTrue(first.endswith(',timestamp=1000'))
+        self.assertNotEqual(first.split(',')[1], second.split(',')[1])
+
+    def test_client_sends_header_instead_of_credentials(self):
+        client = Client(api_username='user', api_password='pass',
+                        api_signature='sig')
+        headers = client.get_headers(url=URL, credentials=('token', 'secret'))
+        self.assertIn('X-PAYPAL-AUTHORIZATION', headers)
+        self.assertNotIn('X-PAYPAL-SECURITY-PASSWORD', headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from StringIO import StringIO
+
+from pypal import bench
+
+class CompareTest(unittest.TestCase):
+    def test_regressions_beyond_tolerance(self):
+        baseline = {'nvp.small': 10.0, 'nvp.large': 100.0, 'gone': 1.0}
+        results = {'nvp.small': 11.9, 'nvp.large': 121.0, 'new': 5.0}
+        self.assertEqual(bench.compare(results, baseline, tolerance=0.2),
+                         [('nvp.large', 100.0, 121.0)])
+
+    def test_budgets(self):
+        results = {'import.pypal': bench.BUDGETS['import.pypal'] + 1,
+                   'import.pypal.ipn': 1.0,
+                   'nvp.small': 10 ** 9}
+        self.assertEqual(bench.check_budgets(results), ['import.pypal'])
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.benchmarks = bench.BENCHMARKS
+        self.usec = 10.0
+        bench.BENCHMARKS = {'fake': lambda: {'case': self.usec}}
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        bench.BENCHMARKS = self.benchmarks
+        shutil.rmtree(self.directory)
+
+    def test_output_and_baseline(self):
+        path = os.path.join(self.directory, 'results.json')
+        self.assertEqual(bench.main(['--output', path]), 0)
+        with open(path) as f:
+            self.assertEqual(json.load(f), {'fake.case': 10.0})
+
+        self.usec = 11.0
+        self.assertEqual(bench.main(['--baseline', path]), 0)
+        self.usec = 13.0
+        self.assertEqual(bench.main(['--baseline', path]), 1)
+        self.assertTrue('fake.case regressed' in sys.stdout.getvalue())
+        self.assertEqual(bench.main(['--baseline', path,
+                                     '--tolerance', '0.5']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
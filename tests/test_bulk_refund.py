@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+import urllib2
+
+from pypal import Response
+from pypal.deadline import Timeout
+from pypal.limiter import RateLimited
+from pypal.service import bulk_refund
+from pypal.service.bulk_refund import BulkRefund
+
+from tests.helpers import FakeClient, SUCCESS, FAILURE
+
+def refunded(status='REFUNDED'):
+    return dict(SUCCESS, refundInfoList={'refundInfo': [
+        {'refundStatus': status}]})
+
+class FakePayPal(object):
+    """Answers Refund and PaymentDetails calls per pay key."""
+    def __init__(self):
+        self.refunds = {}
+        self.refunded = set()
+        self.unreachable = set()
+
+    def __call__(self, action, params):
+        key = params.get('payKey', None) or params.get('transactionId')
+        if key in self.unreachable:
+            raise urllib2.URLError('connection reset')
+        if action == 'PaymentDetails':
+            status = 'REFUNDED' if key in self.refunded else 'COMPLETED'
+            return dict(SUCCESS, paymentInfoList={'paymentInfo': [
+                {'transactionStatus': status}]})
+
+        answer = self.refunds.get(key, None)
+        if answer is None:
+            answer = refunded()
+        if isinstance(answer, Exception):
+            self.refunded.add(key)
+            raise answer
+        if isinstance(answer, Response):
+            return answer
+        if answer.get('refundInfoList'):
+            self.refunded.add(key)
+        return answer
+
+
+class BulkRefundTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'refunds.db')
+        self.paypal = FakePayPal()
+        self.client = FakeClient(self.paypal)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_refunds(self, keys):
+        outcomes, report = bulk_refund.refund_all(self.client, keys,
+                                                  checkpoint=self.path)
+        return dict((outcome.key, outcome.outcome) for outcome in outcomes)
+
+    def get_actions(self, key):
+        return [action for action, params in self.client.calls
+                if key in (params.get('payKey'), params.get('transactionId'))]
+
+    def test_outcomes(self):
+        self.paypal.refunds.update({
+            'AP-2': refunded('NOT_PAID'),
+            'AP-3': FAILURE,
+            'AP-4': Response(None, None, error=RateLimited('limited'))})
+        outcomes = self.run_refunds(['AP-1', 'AP-2', 'AP-3', 'AP-4', '9X'])
+        self.assertEqual(outcomes, {'AP-1': bulk_refund.OUTCOME_REFUNDED,
+                                    'AP-2': bulk_refund.OUTCOME_FAILED,
+                                    'AP-3': bulk_refund.OUTCOME_FAILED,
+                                    'AP-4': bulk_refund.OUTCOME_NOT_SENT,
+                                    '9X': bulk_refund.OUTCOME_REFUNDED})
+        self.assertEqual(self.client.calls[-1][0], 'Refund')
+        self.assertTrue(any(params.get('transactionId') == '9X'
+                            for action, params in self.client.calls))
+
+    def test_resumed_run_skips_handled_payments(self):
+        self.paypal.refunds['AP-2'] = FAILURE
+        self.run_refunds(['AP-1', 'AP-2'])
+        self.client.calls = []
+
+        outcomes = self.run_refunds(['AP-1', 'AP-2', 'AP-3'])
+        self.assertEqual(outcomes, {'AP-1': bulk_refund.OUTCOME_SKIPPED,
+                                    'AP-2': bulk_refund.OUTCOME_SKIPPED,
+                                    'AP-3': bulk_refund.OUTCOME_REFUNDED})
+        self.assertEqual([action for action, params in self.client.calls],
+                         ['Refund'])
+
+    def test_unknown_outcome_is_reconciled_before_resubmitting(self):
+        # The refund went through although the connection dropped
+        self.paypal.refunds['AP-1'] = IOError('connection reset')
+        self.paypal.refunds['AP-2'] = Response(None, None,
+                                               error=Timeout('timed out'))
+        outcomes = self.run_refunds(['AP-1', 'AP-2'])
+        self.assertEqual(outcomes, {'AP-1': bulk_refund.OUTCOME_UNKNOWN,
+                                    'AP-2': bulk_refund.OUTCOME_UNKNOWN})
+
+        del self.paypal.refunds['AP-1']
+        del self.paypal.refunds['AP-2']
+        self.client.calls = []
+        outcomes = self.run_refunds(['AP-1', 'AP-2'])
+        self.assertEqual(outcomes, {'AP-1': bulk_refund.OUTCOME_REFUNDED,
+                                    'AP-2': bulk_refund.OUTCOME_REFUNDED})
+        # Only the refund which did not reach PayPal is sent again
+        self.assertEqual(self.get_actions('AP-1'), ['PaymentDetails'])
+        self.assertEqual(self.get_actions('AP-2'), ['PaymentDetails',
+                                                    'Refund'])
+
+    def test_failed_reconciliation_stays_pending(self):
+        self.paypal.refunds['AP-1'] = IOError('connection reset')
+        self.run_refunds(['AP-1'])
+        del self.paypal.refunds['AP-1']
+
+        self.paypal.unreachable.add('AP-1')
+        outcomes = self.run_refunds(['AP-1', 'AP-2'])
+        self.assertEqual(outcomes, {'AP-1': bulk_refund.OUTCOME_UNKNOWN,
+                                    'AP-2': bulk_refund.OUTCOME_REFUNDED})
+
+        self.paypal.unreachable.clear()
+        self.client.calls = []
+        outcomes = self.run_refunds(['AP-1', 'AP-2'])
+        self.assertEqual(outcomes, {'AP-1': bulk_refund.OUTCOME_REFUNDED,
+                                    'AP-2': bulk_refund.OUTCOME_SKIPPED})
+        self.assertEqual(self.get_actions('AP-1'), ['PaymentDetails'])
+
+    def test_report(self):
+        runner = BulkRefund(self.client, workers=2)
+        outcomes = list(runner.run('AP-%d' % index for index in xrange(20)))
+        self.assertEqual(len(outcomes), 20)
+        report = runner.get_report()
+        self.assertEqual(report[bulk_refund.OUTCOME_REFUNDED], 20)
+        self.assertTrue(report['throughput'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import zlib
+
+from pypal import Client, gzip_compress
+from pypal.pool import ConnectionPool
+
+from tests.helpers import LoopbackServer
+
+BODY = '{"responseEnvelope": {"ack": "Success"}, "padding": "%s"}' % ('x' * 4096)
+
+class ResponseDecodingTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool()
+        self.server = None
+
+    def tearDown(self):
+        self.pool.clear()
+        if self.server is not None:
+            self.server.stop()
+
+    def fetch(self, encoding, body, amt=None):
+        headers = {'Content-Encoding': encoding}
+        self.server = LoopbackServer(lambda handler: (200, headers, body))
+        self.server.start()
+        response = self.pool.urlopen(self.server.url, '', {})
+        if amt is None:
+            return response, response.read()
+
+        chunks = []
+        while True:
+            chunk = response.read(amt)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return response, ''.join(chunks)
+
+    def test_gzip_body_is_decoded(self):
+        compressed = gzip_compress(BODY)
+        response, data = self.fetch('gzip', compressed)
+        self.assertEqual(data, BODY)
+        self.assertEqual(response.bytes_received, len(compressed))
+        self.assertEqual(response.bytes_decoded, len(BODY))
+
+    def test_deflate_body_is_decoded(self):
+        response, data = self.fetch('deflate', zlib.compress(BODY))
+        self.assertEqual(data, BODY)
+
+    def test_streamed_read_is_decoded(self):
+        response, data = self.fetch('gzip', gzip_compress(BODY), amt=16)
+        self.assertEqual(data, BODY)
+
+
+class RequestCompressionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LoopbackServer(lambda handler: (200, {}, 'ok')).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def send(self, body, **kwargs):
+        client = Client(api_username='username', api_password='password',
+                        api_signature='signature', **kwargs)
+        try:
+            client.send(self.server.url, body, headers={}).read()
+        finally:
+            client.pool.clear()
+        return client, self.server.requests[-1]
+
+    def test_large_body_is_gzipped(self):
+        client, (path, headers, body) = self.send(
+            BODY, compress_requests=True, compression_threshold=1024)
+        self.assertEqual(headers.getheader('content-encoding'), 'gzip')
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS), BODY)
+        metrics = client.metrics.snapshot()
+        self.assertEqual(metrics['request_bytes'], len(BODY))
+        self.assertEqual(metrics['request_bytes_sent'], len(body))
+
+    def test_small_body_is_sent_as_is(self):
+        client, (path, headers, body) = self.send(
+            '{}', compress_requests=True, compression_threshold=1024)
+        self.assertEqual(headers.getheader('content-encoding'), None)
+        self.assertEqual(body, '{}')
+
+    def test_compression_is_opt_in(self):
+        client, (path, headers, body) = self.send(BODY)
+        self.assertEqual(body, BODY)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from decimal import Decimal
+
+from pypal import currency
+from pypal.currency import Money
+
+class ToDecimalTest(unittest.TestCase):
+    def test_quantizes_to_minor_units(self):
+        self.assertEqual(currency.to_decimal('10', 'USD'), Decimal('10.00'))
+        self.assertEqual(currency.to_decimal(0.1, 'USD'), Decimal('0.10'))
+        self.assertEqual(currency.to_decimal(100, 'JPY'), Decimal('100'))
+
+    def test_code_is_case_insensitive(self):
+        self.assertEqual(currency.to_decimal('1.5', 'usd'), Decimal('1.50'))
+        self.assertEqual(currency.format_amount('1.5', 'eur'), '1.50')
+        self.assertEqual(currency.to_decimal(Money('2', 'USD'), 'usd'),
+                         Decimal('2.00'))
+
+    def test_rejects_excess_precision(self):
+        self.assertRaises(ValueError, currency.to_decimal, '1.001', 'USD')
+        self.assertRaises(ValueError, currency.to_decimal, '1.5', 'JPY')
+
+    def test_rejects_inexact_floats(self):
+        try:
+            currency.to_decimal(0.1 + 0.2, 'USD')
+        except ValueError as e:
+            self.assertTrue('0.30000000000000004' in str(e))
+        else:
+            self.fail('ValueError not raised')
+
+        normalized, errors = currency.validate_amounts([0.1 + 0.2], 'USD')
+        self.assertEqual(normalized, [None])
+        self.assertTrue('0.30000000000000004' in errors[0])
+
+    def test_rejects_invalid_input(self):
+        self.assertRaises(ValueError, currency.to_decimal, 'abc', 'USD')
+        self.assertRaises(ValueError, currency.to_decimal, '1', 'XXX')
+
+
+class MoneyTest(unittest.TestCase):
+    def test_arithmetic_is_exact(self):
+        total = Money(0.1, 'usd') + Money(0.2, 'USD')
+        self.assertEqual(total, Money('0.30', 'USD'))
+        self.assertEqual(sum([Money('1.10', 'USD')] * 3), Money('3.3', 'USD'))
+
+    def test_currency_mismatch(self):
+        self.assertRaises(ValueError, lambda: Money(1, 'USD') + Money(1, 'EUR'))
+        self.assertNotEqual(Money(1, 'USD'), Money(1, 'EUR'))
+
+    def test_immutable(self):
+        money = Money(1, 'USD')
+        self.assertRaises(AttributeError, setattr, money, 'amount', 2)
+
+
+class ValidateAmountsTest(unittest.TestCase):
+    def test_normalizes_and_reports_errors(self):
+        normalized, errors = currency.validate_amounts(
+            ['1', '2.5', '0', '1.234', 'x', 3], 'usd')
+        self.assertEqual(normalized, ['1.00', '2.50', None, None, None,
+                                      '3.00'])
+        self.assertEqual(sorted(errors), [2, 3, 4])
+
+    def test_allow_zero(self):
+        normalized, errors = currency.validate_amounts(['0'], 'USD',
+                                                       allow_zero=True)
+        self.assertEqual(normalized, ['0.00'])
+        self.assertEqual(errors, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pypal import Response
+from pypal.deadline import Deadline, DeadlineExceeded, Timeout
+from pypal.service import adaptive_payment, permission
+
+from tests.helpers import SUCCESS, FakeClient, LoopbackServer
+
+class DeadlineTest(unittest.TestCase):
+    def test_timeout_capped_by_remaining(self):
+        deadline = Deadline(5)
+        self.assertTrue(deadline.get_timeout(1) == 1)
+        self.assertTrue(deadline.get_timeout(10) <= 5)
+        self.assertTrue(deadline.get_timeout() <= 5)
+        self.assertFalse(deadline.expired)
+
+    def test_expired_deadline_raises(self):
+        deadline = Deadline(0)
+        self.assertTrue(deadline.expired)
+        self.assertEqual(deadline.remaining(), 0.0)
+        self.assertRaises(DeadlineExceeded, deadline.get_timeout, 1)
+
+    def test_deadline_exceeded_is_timeout(self):
+        self.assertTrue(issubclass(DeadlineExceeded, Timeout))
+
+
+class ClientDeadlineTest(unittest.TestCase):
+    def test_expired_deadline_fails_without_sending(self):
+        server = LoopbackServer(lambda handler: (200, {}, '{}')).start()
+        try:
+            client = FakeClient(None)
+            # Bypass the fake transport so the real deadline checks run
+            response = client._send_and_parse(
+                server.url, '{}', {}, 5, Deadline(0), None, Response)
+        finally:
+            server.stop()
+        self.assertTrue(isinstance(response.error, DeadlineExceeded))
+        self.assertFalse(response.success)
+        self.assertEqual(server.requests, [])
+
+    def test_helpers_pass_deadline(self):
+        client = FakeClient(lambda action, params: SUCCESS)
+        deadline = Deadline(5)
+        adaptive_payment.get_payment_options(client, 'AP-1', deadline=deadline)
+        adaptive_payment.set_payment_options(client, 'AP-1', {}, extra={},
+                                             deadline=deadline)
+        adaptive_payment.execute(client, 'AP-1', deadline=deadline)
+        adaptive_payment.get_shipping_addresses(client, 'AP-1',
+                                                deadline=deadline)
+        permission.get(client, 'token', deadline=deadline)
+        permission.cancel(client, 'token', deadline=deadline)
+        self.assertEqual(client.deadlines, [deadline] * 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
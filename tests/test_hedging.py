@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+import time
+import unittest
+
+from pypal import Response
+from pypal.hedging import Hedger, RECALCULATE_INTERVAL
+
+from tests.helpers import SUCCESS
+
+KEY = ('AdaptivePayments', 'PaymentDetails')
+
+def slow_then_fast(slow=0.3):
+    """Function whose first call is slow and every other call is fast."""
+    counter = itertools.count()
+    finished = threading.Event()
+
+    def func():
+        if next(counter) == 0:
+            time.sleep(slow)
+            finished.set()
+            return 'slow'
+        return 'fast'
+    return func, finished
+
+class HedgerTest(unittest.TestCase):
+    def test_hedge_wins_over_slow_attempt(self):
+        hedger = Hedger(budget=1.0, initial_delay=0.02)
+        func, finished = slow_then_fast()
+        self.assertEqual(hedger.run(KEY, func), 'fast')
+        metrics = hedger.get_metrics()
+        self.assertEqual(metrics['hedges'], 1)
+        self.assertEqual(metrics['hedge_wins'], 1)
+
+    def test_losing_attempt_latency_is_recorded(self):
+        hedger = Hedger(budget=1.0, initial_delay=0.02)
+        func, finished = slow_then_fast()
+        hedger.run(KEY, func)
+        finished.wait(1)
+        time.sleep(0.05)
+        latencies = sorted(hedger._keys[KEY].latencies)
+        self.assertEqual(len(latencies), 2)
+        self.assertTrue(latencies[-1] >= 0.3)
+
+    def test_budget_limits_hedges(self):
+        hedger = Hedger(budget=0.0, initial_delay=0.02)
+        func, finished = slow_then_fast(0.1)
+        self.assertEqual(hedger.run(KEY, func), 'slow')
+        self.assertEqual(hedger.get_metrics()['hedges'], 0)
+
+    def test_failed_attempt_waits_for_the_other(self):
+        counter = itertools.count()
+
+        def func():
+            if next(counter) == 0:
+                time.sleep(0.1)
+                return Response('', SUCCESS)
+            return Response(None, None, error=IOError('reset'))
+
+        hedger = Hedger(budget=1.0, initial_delay=0.02)
+        self.assertTrue(hedger.run(KEY, func).success)
+
+    def test_http_error_waits_for_the_other(self):
+        counter = itertools.count()
+
+        def func():
+            if next(counter) == 0:
+                time.sleep(0.1)
+                return Response('', SUCCESS)
+            return Response(None, None, http_error=IOError('503'))
+
+        hedger = Hedger(budget=1.0, initial_delay=0.02)
+        self.assertTrue(hedger.run(KEY, func).success)
+        self.assertEqual(hedger.get_metrics()['hedge_wins'], 0)
+
+    def test_exception_is_raised(self):
+        def func():
+            raise ValueError('failed')
+
+        hedger = Hedger(budget=0.0)
+        self.assertRaises(ValueError, hedger.run, KEY, func)
+
+    def test_delay_follows_percentile(self):
+        hedger = Hedger(percentile=50, initial_delay=1.0)
+        for index in xrange(RECALCULATE_INTERVAL):
+            hedger._record(KEY, index / 1000.0)
+        self.assertEqual(hedger.get_delay(KEY), 0.025)
+        self.assertEqual(hedger.get_delay(('Other', 'Action')), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
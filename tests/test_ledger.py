@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pypal import Response
+from pypal.deadline import Timeout
+from pypal.service import adaptive_payment
+from pypal.service.adaptive_payment import PaymentLedger
+from pypal.store import Store
+
+from tests.helpers import FakeClient, SUCCESS, FAILURE
+
+RECEIVERS = [{'email': 'seller@example.com', 'amount': '10.00'}]
+
+TRACKING_ID_REJECTED = dict(FAILURE, error=[{
+    'errorId': '580022',
+    'message': 'Invalid request parameter: trackingId with value t-1',
+    'parameter': ['trackingId', 't-1']}])
+
+class FakePayPal(object):
+    """Creates payments per tracking id and answers PaymentDetails.
+
+    :param answers: List of answers of the Pay calls in order, either
+                    ``'create'``, ``'lost'`` which creates the payment but
+                    times out, or a response to return without creating.
+    :param lag: Amount of PaymentDetails calls which do not know about a
+                created payment yet.
+    """
+    def __init__(self, answers=None, lag=0):
+        self.answers = list(answers or [])
+        self.lag = lag
+        self.payments = {}
+
+    def __call__(self, action, params):
+        tracking_id = params.get('trackingId')
+        if action == 'PaymentDetails':
+            if tracking_id not in self.payments or self.lag > 0:
+                self.lag -= 1
+                return FAILURE
+            return dict(SUCCESS, payKey=self.payments[tracking_id],
+                        status='CREATED')
+
+        if tracking_id in self.payments:
+            return TRACKING_ID_REJECTED
+
+        answer = self.answers.pop(0) if self.answers else 'create'
+        if answer in ('create', 'lost'):
+            pay_key = 'AP-%d' % (len(self.payments) + 1)
+            self.payments[tracking_id] = pay_key
+            if answer == 'lost':
+                return Response(None, None, error=Timeout('timed out'))
+            return dict(SUCCESS, payKey=pay_key,
+                        paymentExecStatus='CREATED')
+        return answer
+
+
+class PayOnceTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.ledger = PaymentLedger(Store(os.path.join(self.directory,
+                                                       'ledger.db')))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def pay(self, paypal, tracking_id='t-1', **kwargs):
+        client = FakeClient(paypal)
+        kwargs.setdefault('ledger', self.ledger)
+        kwargs.setdefault('backoff', 0)
+        response = adaptive_payment.pay_once(
+            client, 'PAY', 'USD', 'http://cancel', 'http://return',
+            'http://ipn', receivers=RECEIVERS, tracking_id=tracking_id,
+            **kwargs)
+        return response, [action for action, params in client.calls]
+
+    def test_empty_persistent_store_is_used(self):
+        store = Store(os.path.join(self.directory, 'empty.db'))
+        self.assertTrue(PaymentLedger(store).store is store)
+
+    def test_ledger_is_required(self):
+        self.assertRaises(ValueError, self.pay, FakePayPal(), ledger=None)
+
+    def test_created_once(self):
+        paypal = FakePayPal()
+        response, actions = self.pay(paypal)
+        self.assertEqual(response['payKey'], 'AP-1')
+        self.assertEqual(actions, ['Pay'])
+        self.assertEqual(self.ledger.get('t-1')['pay_key'], 'AP-1')
+
+        response, actions = self.pay(paypal)
+        self.assertEqual(response['payKey'], 'AP-1')
+        self.assertEqual(actions, ['PaymentDetails'])
+        self.assertEqual(len(paypal.payments), 1)
+
+    def test_lost_response_is_not_resubmitted(self):
+        paypal = FakePayPal(['lost'])
+        response, actions = self.pay(paypal)
+        self.assertEqual(response['payKey'], 'AP-1')
+        self.assertEqual(actions, ['Pay', 'PaymentDetails'])
+        self.assertEqual(self.ledger.get_state('t-1'),
+                         adaptive_payment.LEDGER_STATE_CREATED)
+
+    def test_unsent_payment_is_resubmitted(self):
+        timeout = Response(None, None, error=Timeout('timed out'))
+        paypal = FakePayPal([timeout])
+        response, actions = self.pay(paypal)
+        self.assertEqual(response['payKey'], 'AP-1')
+        self.assertEqual(actions, ['Pay', 'PaymentDetails', 'Pay'])
+
+    def test_definite_failure(self):
+        paypal = FakePayPal([FAILURE])
+        response, actions = self.pay(paypal)
+        self.assertFalse(response.success)
+        self.assertEqual(actions, ['Pay'])
+        self.assertEqual(self.ledger.get_state('t-1'),
+                         adaptive_payment.LEDGER_STATE_FAILED)
+
+    def test_lagging_details_and_rejected_resubmit(self):
+        # PaymentDetails does not know about the lost payment yet, hence
+        # it is resubmitted and PayPal rejects the reused tracking id.
+        paypal = FakePayPal(['lost'], lag=2)
+        response, actions = self.pay(paypal, retries=3)
+        self.assertEqual(response['payKey'], 'AP-1')
+        self.assertEqual(actions, ['Pay', 'PaymentDetails', 'Pay',
+                                   'PaymentDetails', 'PaymentDetails'])
+        self.assertEqual(self.ledger.get_state('t-1'),
+                         adaptive_payment.LEDGER_STATE_CREATED)
+        self.assertEqual(len(paypal.payments), 1)
+
+    def test_rejected_tracking_id_is_never_failed(self):
+        paypal = FakePayPal(['lost'], lag=100)
+        response, actions = self.pay(paypal, retries=2)
+        self.assertFalse(response.success)
+        self.assertTrue(adaptive_payment.is_tracking_id_rejected(response))
+        self.assertEqual(actions.count('Pay'), 2)
+        self.assertEqual(self.ledger.get_state('t-1'),
+                         adaptive_payment.LEDGER_STATE_PENDING)
+
+        paypal.lag = 0
+        response, actions = self.pay(paypal)
+        self.assertEqual(response['payKey'], 'AP-1')
+        self.assertEqual(actions, ['PaymentDetails'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pypal import Client
+from pypal.limiter import Limiter, RateLimited, TokenBucket
+
+from tests.helpers import SUCCESS
+
+KEY = ('AdaptivePayments', 'https://svcs.paypal.com')
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_empty(self):
+        bucket = TokenBucket(rate=1, capacity=2)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+    def test_reserve_returns_wait(self):
+        bucket = TokenBucket(rate=10, capacity=1)
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+
+
+class LimiterTest(unittest.TestCase):
+    def test_rejects_beyond_limit(self):
+        limiter = Limiter(initial_limit=2, block=False)
+        limiter.acquire(KEY)
+        limiter.acquire(KEY)
+        self.assertRaises(RateLimited, limiter.acquire, KEY)
+        self.assertEqual(limiter.get_metrics()[KEY]['rejected'], 1)
+
+    def test_additive_increase(self):
+        limiter = Limiter(initial_limit=2, max_limit=4)
+        for _ in range(20):
+            limiter.acquire(KEY)
+            limiter.release(KEY, True)
+        self.assertEqual(limiter.get_metrics()[KEY]['limit'], 4)
+
+    def test_multiplicative_decrease(self):
+        limiter = Limiter(initial_limit=8, min_limit=1, backoff=0.5)
+        limiter.acquire(KEY)
+        limiter.release(KEY, False)
+        self.assertEqual(limiter.get_metrics()[KEY]['limit'], 4)
+        for _ in range(5):
+            limiter.acquire(KEY)
+            limiter.release(KEY, False)
+        self.assertEqual(limiter.get_metrics()[KEY]['limit'], 1)
+
+    def test_release_frees_slot(self):
+        limiter = Limiter(initial_limit=1, block=False)
+        limiter.acquire(KEY)
+        limiter.release(KEY, True)
+        limiter.acquire(KEY)
+        self.assertEqual(limiter.get_metrics()[KEY]['in_flight'], 1)
+
+    def test_client_returns_rate_limited_response(self):
+        limiter = Limiter(initial_limit=1, block=False)
+        client = SentClient(limiter=limiter)
+        limiter.acquire(KEY)
+        response = client.call('AdaptivePayments', 'Pay', endpoint=KEY[1])
+        self.assertFalse(response.success)
+        self.assertTrue(response.is_rate_limited)
+        self.assertEqual(client.sent, 0)
+
+        limiter.release(KEY, True)
+        response = client.call('AdaptivePayments', 'Pay', endpoint=KEY[1])
+        self.assertTrue(response.success)
+        self.assertEqual(client.sent, 1)
+        self.assertEqual(limiter.get_metrics()[KEY]['in_flight'], 0)
+
+
+class SentClient(Client):
+    """Client answering every call successfully without sending it."""
+    def __init__(self, **kwargs):
+        Client.__init__(self, api_username='username',
+                        api_password='password', api_signature='signature',
+                        **kwargs)
+        self.sent = 0
+
+    def _send_and_parse(self, url, request_body, headers, timeout, deadline,
+                        format, response_class):
+        self.sent += 1
+        return response_class('', SUCCESS)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pypal import NVPResponse
+from pypal.deadline import Timeout
+from pypal.limiter import RateLimited
+from pypal.service import mass_pay
+
+from tests.helpers import FakeClient
+
+def make_rows(count):
+    return [{'email': 'receiver%d@example.com' % index, 'amount': '1.00'}
+            for index in xrange(count)]
+
+class ChunkingTest(unittest.TestCase):
+    def test_rows_are_chunked(self):
+        chunks = list(mass_pay.chunk_rows(make_rows(5), size=2))
+        self.assertEqual([[index for index, row in chunk]
+                          for chunk in chunks], [[0, 1], [2, 3], [4]])
+
+    def test_render_rejects_invalid_rows(self):
+        rows = list(enumerate([{'email': 'a@example.com', 'amount': '1.5'},
+                               {'email': 'b@example.com', 'amount': '1.001'},
+                               {'email': '', 'amount': '1'}]))
+        body, indexes, rejected = mass_pay.render_receivers(rows, 'USD')
+        self.assertEqual(indexes, [0])
+        self.assertEqual(sorted(rejected), [1, 2])
+        self.assertEqual(body, 'L_EMAIL0=a%40example.com&L_AMT0=1.50')
+
+
+class MassPayTest(unittest.TestCase):
+    def test_chunks_are_submitted(self):
+        client = FakeClient(lambda action, params: {'ACK': 'Success'})
+        rows = make_rows(7)
+        rows[3]['amount'] = 'x'
+        result = mass_pay.mass_pay(client, rows, 'USD', chunk_size=3,
+                                   workers=2)
+
+        self.assertEqual(len(client.calls), 3)
+        for action, params in client.calls:
+            self.assertEqual(action, 'MassPay')
+            self.assertEqual(params['RECEIVERTYPE'], 'EmailAddress')
+        self.assertEqual(result.paid_count, 6)
+        self.assertEqual(result.failed_count, 1)
+        self.assertEqual(result.unknown_count, 0)
+        self.assertEqual(result.get(0)[0], True)
+        self.assertEqual(result.get_status(3)[0], mass_pay.STATUS_FAILED)
+
+    def test_unknown_chunks_are_not_failed(self):
+        def handler(action, params):
+            email = params['L_EMAIL0']
+            if email == 'receiver0@example.com':
+                return NVPResponse(None, None, error=Timeout('timed out'))
+            if email == 'receiver2@example.com':
+                raise RuntimeError('connection reset')
+            if email == 'receiver4@example.com':
+                return NVPResponse(None, None, error=RateLimited('limited'))
+            return {'ACK': 'Failure'}
+
+        client = FakeClient(handler)
+        result = mass_pay.mass_pay(client, make_rows(8), 'USD', chunk_size=2)
+
+        self.assertEqual(result.paid_count, 0)
+        self.assertEqual(result.unknown_count, 4)
+        self.assertEqual(result.failed_count, 4)
+        self.assertEqual(result.get_status(1)[0], mass_pay.STATUS_UNKNOWN)
+        self.assertEqual(result.get_status(3)[0], mass_pay.STATUS_UNKNOWN)
+        self.assertEqual(result.get_status(5)[0], mass_pay.STATUS_FAILED)
+        self.assertEqual(result.get_status(7)[0], mass_pay.STATUS_FAILED)
+        self.assertEqual(result.get(1)[0], False)
+
+    def test_invalid_arguments(self):
+        client = FakeClient(None)
+        self.assertRaises(ValueError, mass_pay.mass_pay, client, [], 'XXX')
+        self.assertRaises(ValueError, mass_pay.mass_pay, client, [], 'USD',
+                          receiver_type='Name')
+
+
+if __name__ == '__main__':
+    unittest.main()
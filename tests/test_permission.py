@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+import urllib2
+
+from pypal.service import permission
+
+from tests.helpers import FAILURE, SUCCESS, FakeClient
+
+class GroupsMaskTest(unittest.TestCase):
+    def test_operation_granted(self):
+        mask = permission.get_groups_mask([permission.REFUND])
+        self.assertTrue(permission.is_operation_granted(mask, 'Refund'))
+        self.assertFalse(permission.is_operation_granted(mask, 'MassPay'))
+
+    def test_unknown_groups_are_ignored(self):
+        self.assertEqual(permission.get_groups_mask(['UNKNOWN']), 0)
+
+    def test_approval_required(self):
+        self.assertTrue(permission.is_operation_approval_required('MassPay'))
+        self.assertFalse(permission.is_operation_approval_required('Refund'))
+
+
+class GrantCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.fetched = []
+
+        def handler(action, params):
+            with self.lock:
+                self.fetched.append(params['token'])
+            if params['token'] == 'broken':
+                return FAILURE
+            if params['token'] == 'unreachable':
+                raise urllib2.URLError('connection reset')
+            return dict(SUCCESS, scope=[permission.REFUND])
+
+        self.client = FakeClient(handler)
+        self.cache = permission.GrantCache(self.client)
+
+    def test_check_fetches_once(self):
+        self.assertTrue(self.cache.check('token', 'Refund'))
+        self.assertFalse(self.cache.check('token', 'MassPay'))
+        self.assertEqual(self.fetched, ['token'])
+
+    def test_check_many_fetches_cold_tokens_once(self):
+        tokens = ['a', 'b', 'c', 'a', 'b']
+        ret = self.cache.check_many(tokens, 'Refund')
+        self.assertEqual(ret, [True] * 5)
+        self.assertEqual(sorted(self.fetched), ['a', 'b', 'c'])
+
+    def test_failures_are_cached(self):
+        self.assertFalse(self.cache.check('broken', 'Refund'))
+        self.assertEqual(self.cache.check_many(['broken'] * 3, 'Refund'),
+                         [False] * 3)
+        self.assertEqual(self.fetched, ['broken'])
+
+    def test_transport_errors_are_cached(self):
+        ret = self.cache.check_many(['token', 'unreachable'], 'Refund')
+        self.assertEqual(ret, [True, False])
+        self.assertFalse(self.cache.check('unreachable', 'Refund'))
+        self.assertEqual(sorted(self.fetched), ['token', 'unreachable'])
+
+    def test_failures_expire(self):
+        self.cache.failure_ttl = 0
+        self.cache.check('broken', 'Refund')
+        time.sleep(0.01)
+        self.cache.check('broken', 'Refund')
+        self.assertEqual(self.fetched, ['broken', 'broken'])
+
+    def test_cancel_invalidates(self):
+        self.cache.check('token', 'Refund')
+        permission.cancel(self.client, 'token')
+        self.cache.check('token', 'Refund')
+        self.assertEqual(self.fetched, ['token', 'token', 'token'])
+
+
+class PersonalDataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.failing = set()
+        self.unreachable = False
+        self.client = FakeClient(self.handler)
+
+    def handler(self, action, params):
+        if action in self.failing:
+            return FAILURE
+        if self.unreachable:
+            raise urllib2.URLError('connection reset')
+        if action == 'CancelPermissions':
+            return SUCCESS
+        data = [{'personalDataKey': attribute,
+                 'personalDataValue': attribute.rsplit('/', 1)[-1]}
+                for attribute in params['attributeList']['attribute']
+                if attribute != permission.ATTRIBUTE_BUSINESS_NAME]
+        return dict(SUCCESS, response={'personalData': data})
+
+    def get_actions(self):
+        return [action for action, params in self.client.calls]
+
+    def test_attributes_are_cached(self):
+        cache = permission.PersonalDataCache(self.client)
+        credentials = ('token', 'secret')
+        attributes = [permission.ATTRIBUTE_EMAIL,
+                      permission.ATTRIBUTE_BUSINESS_NAME,
+                      permission.ATTRIBUTE_CITY]
+        data = cache.get(credentials, attributes)
+        self.assertEqual(data, {permission.ATTRIBUTE_EMAIL: 'email',
+                                permission.ATTRIBUTE_BUSINESS_NAME: None,
+                                permission.ATTRIBUTE_CITY: 'home'})
+        self.assertEqual(sorted(self.get_actions()),
+                         ['GetAdvancedPersonalData', 'GetBasicPersonalData'])
+
+        # Lacking attributes are cached as None rather than refetched
+        self.assertEqual(cache.get(credentials, attributes), data)
+        self.assertEqual(len(self.client.calls), 2)
+
+        cache.get(credentials, [permission.ATTRIBUTE_EMAIL,
+                                permission.ATTRIBUTE_COUNTRY])
+        self.assertEqual(self.client.calls[-1][1]['attributeList'],
+                         {'attribute': [permission.ATTRIBUTE_COUNTRY]})
+
+    def test_failed_calls_are_omitted(self):
+        self.failing.add('GetAdvancedPersonalData')
+        cache = permission.PersonalDataCache(self.client)
+        data = cache.get(('token', 'secret'), [permission.ATTRIBUTE_EMAIL,
+                                               permission.ATTRIBUTE_CITY])
+        self.assertEqual(data, {permission.ATTRIBUTE_EMAIL: 'email'})
+
+        self.failing.clear()
+        data = cache.get(('token', 'secret'), [permission.ATTRIBUTE_EMAIL,
+                                               permission.ATTRIBUTE_CITY])
+        self.assertEqual(data[permission.ATTRIBUTE_CITY], 'home')
+        self.assertEqual(self.get_actions()[-1], 'GetAdvancedPersonalData')
+
+    def test_expired_attributes_are_refetched(self):
+        cache = permission.PersonalDataCache(self.client, ttl=-1)
+        cache.get(('token', 'secret'), [permission.ATTRIBUTE_EMAIL])
+        cache.get(('token', 'secret'), [permission.ATTRIBUTE_EMAIL])
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_cancel_invalidates(self):
+        cache = permission.PersonalDataCache(self.client)
+        cache.get(('token', 'secret'))
+        permission.cancel(self.client, 'token')
+        cache.get(('token', 'secret'))
+        self.assertEqual(self.get_actions(), ['GetBasicPersonalData',
+                                              'CancelPermissions',
+                                              'GetBasicPersonalData'])
+
+    def test_get_many(self):
+        cache = permission.PersonalDataCache(self.client)
+        credentials_list = [('token%d' % index, 'secret')
+                            for index in xrange(5)]
+        data = cache.get_many(credentials_list, [permission.ATTRIBUTE_EMAIL])
+        self.assertEqual(sorted(data), ['token%d' % index
+                                        for index in xrange(5)])
+        self.assertEqual(len(self.client.calls), 5)
+
+    def test_get_many_omits_unreachable_accounts(self):
+        cache = permission.PersonalDataCache(self.client)
+        cache.get(('cached', 'secret'), [permission.ATTRIBUTE_EMAIL])
+        self.unreachable = True
+        data = cache.get_many([('cached', 'secret'), ('cold', 'secret')],
+                              [permission.ATTRIBUTE_EMAIL])
+        self.assertEqual(data, {'cached': {permission.ATTRIBUTE_EMAIL: 'email'},
+                                'cold': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
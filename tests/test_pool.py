@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import urllib2
+
+from pypal.pool import ConnectionPool
+
+from tests.helpers import LoopbackServer
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool()
+        self.server = None
+
+    def tearDown(self):
+        self.pool.clear()
+        if self.server is not None:
+            self.server.stop()
+
+    def start(self, respond):
+        self.server = LoopbackServer(respond).start()
+        return self.server
+
+    def test_default_content_type(self):
+        server = self.start(lambda handler: (200, {}, 'ok'))
+        self.pool.urlopen(server.url, 'a=b', {}).read()
+        self.pool.urlopen(server.url, '{}',
+                          {'content-type': 'application/json'}).read()
+
+        headers = [headers for path, headers, body in server.requests]
+        self.assertEqual(headers[0].getheader('content-type'),
+                         'application/x-www-form-urlencoded')
+        self.assertEqual(headers[1].getheader('content-type'),
+                         'application/json')
+
+    def test_connections_are_reused(self):
+        server = self.start(lambda handler: (200, {}, 'ok'))
+        self.assertEqual(self.pool.urlopen(server.url, '', {}).read(), 'ok')
+        self.assertEqual(len(self.pool._idle[('http', server.server_address[0]
+                                              + ':%d' % server.server_port)]),
+                         1)
+
+    def test_discards_connection_closed_while_idle(self):
+        def respond(handler):
+            # Close the connection once answered without telling the client
+            handler.close_connection = 1
+            return (200, {}, 'ok')
+
+        server = self.start(respond)
+        for _ in range(3):
+            self.assertEqual(self.pool.urlopen(server.url, '', {}).read(),
+                             'ok')
+            # Give the server time to close the idle connection
+            time.sleep(0.05)
+        self.assertEqual(len(server.requests), 3)
+
+    def test_sent_requests_are_never_resent(self):
+        answers = [(200, {}, 'ok'), None]
+        server = self.start(lambda handler: answers.pop(0))
+        self.assertEqual(self.pool.urlopen(server.url, 'a=b', {}).read(), 'ok')
+
+        # The reused connection is closed once the request has been read
+        self.assertRaises(urllib2.URLError,
+                          self.pool.urlopen, server.url, 'c=d', {})
+        self.assertEqual([body for path, headers, body in server.requests],
+                         ['a=b', 'c=d'])
+
+    def test_transport_errors_are_url_errors(self):
+        server = self.start(lambda handler: (200, {}, 'ok'))
+        url = server.url
+        server.stop()
+        self.server = None
+        self.assertRaises(urllib2.URLError, self.pool.urlopen, url, '', {})
+
+    def test_error_status_raises_http_error(self):
+        server = self.start(lambda handler: (500, {}, 'failure'))
+        try:
+            self.pool.urlopen(server.url, '', {})
+        except urllib2.HTTPError as e:
+            self.assertEqual(e.code, 500)
+            self.assertEqual(e.read(), 'failure')
+        else:
+            self.fail('HTTPError not raised')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from pypal import Response, ipn
+from pypal.service import adaptive_payment
+from pypal.service.adaptive_payment import PreapprovalStore
+from pypal.store import Store
+
+from tests.helpers import FakeClient, PostbackClient, SUCCESS
+
+RECEIVERS = [{'email': 'seller@example.com', 'amount': '10.00'}]
+
+def details(**fields):
+    response = dict(SUCCESS, approved='true', senderEmail='buyer@example.com',
+                    currencyCode='USD', status='ACTIVE',
+                    maxTotalAmountOfAllPayments='50.00',
+                    maxAmountPerPayment='20.00', curPaymentsAmount='0.00',
+                    curPayments='0', maxNumberOfPayments='3',
+                    endingDate='2030-01-01T00:00:00.000-08:00')
+    response.update(fields)
+    return Response('', response)
+
+class PreapprovalStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_empty_persistent_store_is_used(self):
+        store = Store(os.path.join(self.directory, 'preapprovals.db'))
+        self.assertEqual(len(store), 0)
+        preapprovals = PreapprovalStore(store)
+        self.assertTrue(preapprovals.store is store)
+
+        preapprovals.update_from_details('PA-1', details())
+        reopened = PreapprovalStore(
+            Store(os.path.join(self.directory, 'preapprovals.db')))
+        self.assertEqual(reopened.get_key('buyer@example.com'), 'PA-1')
+
+    def test_limits(self):
+        preapprovals = PreapprovalStore()
+        preapprovals.update_from_details('PA-1', details())
+        get_key = preapprovals.get_key
+        self.assertEqual(get_key('buyer@example.com', '20.00', 'USD'), 'PA-1')
+        self.assertEqual(get_key('buyer@example.com', '20.01', 'USD'), None)
+        self.assertEqual(get_key('buyer@example.com', '1.00', 'EUR'), None)
+        self.assertEqual(get_key('other@example.com', '1.00', 'USD'), None)
+
+        preapprovals.record_payment('PA-1', '20.00')
+        preapprovals.record_payment('PA-1', '20.00')
+        self.assertEqual(str(preapprovals.get_remaining('PA-1')), '10.00')
+        self.assertEqual(get_key('buyer@example.com', '15.00', 'USD'), None)
+        self.assertEqual(get_key('buyer@example.com', '10.00', 'USD'), 'PA-1')
+        preapprovals.record_payment('PA-1', '1.00')
+        # The maximum amount of payments has been reached
+        self.assertEqual(get_key('buyer@example.com', '1.00', 'USD'), None)
+
+    def test_expired_and_canceled(self):
+        preapprovals = PreapprovalStore()
+        preapprovals.update_from_details(
+            'PA-1', details(endingDate='2013-01-01T00:00:00Z'))
+        self.assertEqual(preapprovals.get_key('buyer@example.com'), None)
+
+        preapprovals.update_from_details('PA-2', details())
+        self.assertEqual(preapprovals.get_key('buyer@example.com'), 'PA-2')
+        preapprovals.cancel('PA-2')
+        self.assertEqual(preapprovals.get_key('buyer@example.com'), None)
+
+    def test_notifications_update_the_store(self):
+        preapprovals = PreapprovalStore()
+        listener = ipn.Listener(PostbackClient())
+        preapprovals.attach(listener)
+        preapprovals.update_from_details('PA-1', details())
+
+        self.assertTrue(listener.dispatch(
+            'transaction_type=Adaptive+Payment+PREAPPROVAL&'
+            'preapproval_key=PA-1&approved=true&status=CANCELED&'
+            'sender_email=buyer%40example.com&currency_code=USD'))
+        self.assertEqual(preapprovals.get('PA-1')['status'], 'CANCELED')
+
+
+class PayPreapprovedTest(unittest.TestCase):
+    def handler(self, action, params):
+        return dict(SUCCESS, payKey='AP-1', paymentExecStatus='COMPLETED')
+
+    def pay(self, preapprovals, amount='10.00'):
+        client = FakeClient(self.handler)
+        response = adaptive_payment.pay_preapproved(
+            client, preapprovals, 'buyer@example.com', 'USD',
+            'http://cancel', 'http://return', 'http://ipn',
+            receivers=[dict(RECEIVERS[0], amount=amount)])
+        return client, response
+
+    def test_payment_uses_preapproval(self):
+        preapprovals = PreapprovalStore()
+        preapprovals.update_from_details('PA-1', details())
+        client, response = self.pay(preapprovals)
+        self.assertTrue(response.success)
+        action, params = client.calls[0]
+        self.assertEqual(action, 'Pay')
+        self.assertEqual(params['preapprovalKey'], 'PA-1')
+        self.assertEqual(params['senderEmail'], 'buyer@example.com')
+        self.assertEqual(preapprovals.get('PA-1')['payments'], 1)
+
+    def test_without_valid_preapproval(self):
+        preapprovals = PreapprovalStore()
+        preapprovals.update_from_details('PA-1', details())
+        client, response = self.pay(preapprovals, amount='25.00')
+        self.assertEqual(response, None)
+        self.assertEqual(client.calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+import urllib2
+
+from pypal.currency import Money
+from pypal.service import adaptive_payment
+from pypal.service.adaptive_payment import RateCache
+
+from tests.helpers import FakeClient, SUCCESS, FAILURE
+
+#: Rates per unit of the source currency
+RATES = {('USD', 'EUR'): '0.7525', ('EUR', 'USD'): '1.3289',
+         ('USD', 'JPY'): '98.125', ('JPY', 'USD'): '0.0102',
+         ('EUR', 'JPY'): '130.4', ('JPY', 'EUR'): '0.0077'}
+
+def convert_handler(action, params):
+    conversions = []
+    targets = params['convertToCurrencyList']['currencyCode']
+    for base in params['baseAmountList']['currency']:
+        amount = float(base['amount'])
+        converted = [{'code': code, 'amount': '%.3f' % (
+                         amount * float(RATES[(base['code'], code)]))}
+                     for code in targets if code != base['code']]
+        conversions.append({'baseAmount': base,
+                            'currencyList': {'currency': converted}})
+    return dict(SUCCESS, estimatedAmountTable={
+        'currencyConversionList': conversions})
+
+class RateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient(convert_handler)
+        self.cache = RateCache(self.client, codes=['USD', 'EUR', 'JPY'])
+
+    def test_full_matrix_is_fetched_once(self):
+        self.assertEqual(self.cache.convert('10.00', 'USD', 'EUR'),
+                         Money('7.53', 'EUR'))
+        self.assertEqual(self.cache.convert(100, 'EUR', 'JPY'),
+                         Money('13040', 'JPY'))
+        self.assertEqual(self.cache.convert(5, 'USD', 'USD'),
+                         Money(5, 'USD'))
+        self.assertEqual(len(self.client.calls), 1)
+        action, params = self.client.calls[0]
+        self.assertEqual(action, 'ConvertCurrency')
+        self.assertEqual(len(params['baseAmountList']['currency']), 3)
+
+    def test_convert_many_rounds_half_up(self):
+        # 0.02 * 0.7525 = 0.01505 and 0.10 * 0.7525 = 0.07525
+        amounts = ['0.02', '0.10', 0.02, 2]
+        converted = self.cache.convert_many(amounts, 'USD', 'EUR')
+        self.assertEqual(converted, ['0.02', '0.08', '0.02', '1.51'])
+        self.assertEqual(converted, [self.cache.convert(amount, 'USD', 'EUR')
+                                     .format() for amount in amounts])
+
+    def test_convert_many_accepts_arrays(self):
+        class Array(object):
+            def __init__(self, values):
+                self.values = values
+
+            def tolist(self):
+                return list(self.values)
+
+        self.assertEqual(self.cache.convert_many(Array([0.1, 4.0]), 'USD',
+                                                 'JPY'), ['10', '393'])
+
+    def test_unavailable_rates(self):
+        cache = RateCache(FakeClient(lambda action, params: FAILURE),
+                          codes=['USD', 'EUR'])
+        self.assertEqual(cache.convert(1, 'USD', 'EUR'), None)
+        self.assertEqual(cache.convert_many([1], 'USD', 'EUR'), None)
+
+    def test_stale_rates_are_refreshed_in_background(self):
+        cache = RateCache(self.client, codes=['USD', 'EUR'],
+                          refresh_after=10, max_age=60)
+        cache.get_rates()
+        cache.fetched_at -= 30
+        stale_fetched_at = cache.fetched_at
+        self.assertNotEqual(cache.get_rate('USD', 'EUR'), None)
+        for _ in xrange(100):
+            if cache.fetched_at != stale_fetched_at:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_stale_rates_are_served_during_outage(self):
+        cache = RateCache(self.client, codes=['USD', 'EUR'],
+                          refresh_after=10, max_age=60)
+        rates = dict(cache.get_rates())
+        cache.fetched_at -= 120
+
+        def unreachable(action, params):
+            raise urllib2.URLError('connection refused')
+
+        self.client.handler = unreachable
+        del self.client.calls[:]
+        for _ in xrange(3):
+            self.assertEqual(cache.get_rates(), rates)
+        self.assertEqual(cache.convert('10.00', 'USD', 'EUR'),
+                         Money('7.53', 'EUR'))
+        self.assertEqual(len(self.client.calls), 1)
+
+    def test_concurrent_cold_reads_fetch_once(self):
+        threads = [threading.Thread(target=self.cache.get_rates)
+                   for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.client.calls), 1)
+
+    def test_invalid_code(self):
+        self.assertRaises(ValueError, adaptive_payment.convert_currency,
+                          self.client, [(1, 'XXX')], ['USD'])
+
+
+if __name__ == '__main__':
+    unittest.main()
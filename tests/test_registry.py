@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pypal import settings
+from pypal.registry import ClientRegistry
+
+def make_config(username):
+    return settings.Config(api_username=username, api_password='password',
+                           api_signature='signature')
+
+class ClientRegistryTest(unittest.TestCase):
+    def test_equal_configs_share_client(self):
+        registry = ClientRegistry()
+        first = registry.get(make_config('merchant'))
+        second = registry.get(make_config('merchant'))
+        self.assertIs(first, second)
+        self.assertTrue(first.config.is_frozen)
+        self.assertEqual(len(registry), 1)
+
+    def test_clients_share_pool(self):
+        registry = ClientRegistry()
+        first = registry.get(make_config('first'))
+        second = registry.get(make_config('second'))
+        self.assertIs(first.pool, registry.pool)
+        self.assertIs(second.pool, registry.pool)
+
+    def test_least_recently_used_is_evicted(self):
+        registry = ClientRegistry(max_tenants=2)
+        registry.get(make_config('a'))
+        registry.get(make_config('b'))
+        registry.get(make_config('a'))
+        registry.get(make_config('c'))
+        self.assertIn(make_config('a'), registry)
+        self.assertNotIn(make_config('b'), registry)
+        self.assertEqual(len(registry), 2)
+
+    def test_concurrency_quota(self):
+        registry = ClientRegistry(max_concurrency=2)
+        client = registry.get(make_config('merchant'))
+        self.assertTrue(client.quota.acquire(False))
+        self.assertTrue(client.quota.acquire(False))
+        self.assertFalse(client.quota.acquire(False))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+
+from pypal import ipn
+from pypal.service.adaptive_payment import PaymentStatusIndex
+from pypal.store import Store
+
+from tests.helpers import FakeClient, PostbackClient, SUCCESS, FAILURE, \
+    generate_ipn
+
+class PaymentStatusIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.statuses = {}
+        self.client = FakeClient(self.handler)
+
+    def handler(self, action, params):
+        status = self.statuses.get(params['payKey'], None)
+        if isinstance(status, Exception):
+            raise status
+        if status is None:
+            return FAILURE
+        return dict(SUCCESS, status=status)
+
+    def test_missing_status_is_fetched_once(self):
+        self.statuses['AP-1'] = 'COMPLETED'
+        index = PaymentStatusIndex(self.client)
+        self.assertEqual(index.get_status('AP-1'), 'COMPLETED')
+        self.assertEqual(index.get_status('AP-1'), 'COMPLETED')
+        self.assertEqual(len(self.client.calls), 1)
+        self.assertEqual((index.hits, index.misses), (1, 1))
+        self.assertEqual(index.get_status('AP-2'), None)
+
+    def test_stale_status_is_refreshed(self):
+        self.statuses['AP-1'] = 'COMPLETED'
+        index = PaymentStatusIndex(self.client, ttl=60)
+        index.update('AP-1', 'CREATED', updated_at=time.time() - 61)
+        self.assertEqual(index.get_status('AP-1'), 'COMPLETED')
+        # Final statuses never become stale
+        index.update('AP-1', 'COMPLETED', updated_at=0)
+        self.assertEqual(index.get_status('AP-1'), 'COMPLETED')
+        self.assertEqual(len(self.client.calls), 1)
+
+    def test_stale_status_is_kept_when_refresh_fails(self):
+        index = PaymentStatusIndex(self.client, ttl=60)
+        index.update('AP-1', 'PROCESSING', updated_at=time.time() - 61)
+        self.assertEqual(index.get_status('AP-1'), 'PROCESSING')
+
+    def test_transport_errors_do_not_fail_the_batch(self):
+        self.statuses.update({'AP-1': 'COMPLETED',
+                              'AP-2': urllib2.URLError('connection reset')})
+        index = PaymentStatusIndex(self.client, ttl=60)
+        index.update('AP-3', 'PROCESSING', updated_at=time.time() - 61)
+        self.statuses['AP-3'] = urllib2.URLError('connection reset')
+        self.assertEqual(index.get_statuses(['AP-1', 'AP-2', 'AP-3']),
+                         {'AP-1': 'COMPLETED', 'AP-2': None,
+                          'AP-3': 'PROCESSING'})
+        self.assertEqual(index.get_status('AP-2'), None)
+
+    def test_final_status_is_not_replaced(self):
+        index = PaymentStatusIndex(self.client)
+        index.update('AP-1', 'completed')
+        self.assertEqual(index.update('AP-1', 'PENDING'), 'COMPLETED')
+        self.assertEqual(index.peek('AP-1'), 'COMPLETED')
+
+    def test_notifications_feed_the_index(self):
+        index = PaymentStatusIndex(self.client)
+        listener = ipn.Listener(PostbackClient())
+        index.attach(listener)
+        listener.dispatch(generate_ipn('AP-1', 'COMPLETED'))
+        self.assertEqual(index.get_status('AP-1'), 'COMPLETED')
+        self.assertEqual(self.client.calls, [])
+
+    def test_concurrent_refreshes_are_coalesced(self):
+        release = threading.Event()
+
+        def handler(action, params):
+            release.wait(5)
+            return dict(SUCCESS, status='COMPLETED')
+
+        client = FakeClient(handler)
+        index = PaymentStatusIndex(client)
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(index.get_status('AP-1')))
+            for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        while not client.calls:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ['COMPLETED'] * 8)
+        self.assertEqual(len(client.calls), 1)
+
+    def test_get_statuses(self):
+        self.statuses.update({'AP-2': 'COMPLETED', 'AP-3': 'ERROR'})
+        index = PaymentStatusIndex(self.client)
+        index.update('AP-1', 'CREATED')
+        self.assertEqual(index.get_statuses(['AP-1', 'AP-2', 'AP-3', 'AP-4']),
+                         {'AP-1': 'CREATED', 'AP-2': 'COMPLETED',
+                          'AP-3': 'ERROR', 'AP-4': None})
+
+    def test_persisted_statuses_are_loaded(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'statuses.db')
+            index = PaymentStatusIndex(self.client, store=Store(path))
+            index.update('AP-1', 'COMPLETED')
+            index = PaymentStatusIndex(self.client, store=Store(path))
+            self.assertEqual(index.get_status('AP-1'), 'COMPLETED')
+            self.assertEqual(self.client.calls, [])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
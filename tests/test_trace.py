@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pypal import ipn, nvp, trace
+
+class RedactTest(unittest.TestCase):
+    def test_credentials_and_headers(self):
+        headers = {'X-PAYPAL-SECURITY-USERID': 'user',
+                   'X-PAYPAL-SECURITY-PASSWORD': 'password',
+                   'X-PAYPAL-SECURITY-SIGNATURE': 'signature',
+                   'X-PAYPAL-SECURITY-SUBJECT': 'merchant@example.com',
+                   'X-PAYPAL-AUTHORIZATION': 'token=abc',
+                   'X-PAYPAL-APPLICATION-ID': 'APP-1'}
+        redacted = trace.redact(headers)
+        self.assertEqual(redacted['X-PAYPAL-APPLICATION-ID'], 'APP-1')
+        del redacted['X-PAYPAL-APPLICATION-ID']
+        self.assertEqual(set(redacted.values()), set([trace.REDACTED]))
+
+    def test_nvp_pairs(self):
+        pairs = [('USER', 'user'), ('PWD', 'password'), ('METHOD', 'MassPay'),
+                 ('L_EMAIL0', 'a@example.com')]
+        self.assertEqual(trace.redact(pairs),
+                         [('USER', trace.REDACTED), ('PWD', trace.REDACTED),
+                          ('METHOD', 'MassPay'),
+                          ('L_EMAIL0', trace.REDACTED)])
+
+    def test_notification_fields(self):
+        arguments = ipn.parse('transaction%5B0%5D.receiver=a%40example.com&'
+                              'transaction%5B0%5D.amount=USD+1.00&'
+                              'sender_email=b%40example.com&'
+                              'payer_id=PAYER1&'
+                              'transaction_type=Adaptive+Payment+PAY')
+        redacted = trace.redact(arguments)
+        self.assertEqual(redacted['transaction'][0],
+                         {'receiver': trace.REDACTED, 'amount': 'USD 1.00'})
+        self.assertEqual(redacted['sender_email'], trace.REDACTED)
+        self.assertEqual(redacted['payer_id'], trace.REDACTED)
+        self.assertEqual(redacted['transaction_type'], 'Adaptive Payment PAY')
+
+    def test_personal_data(self):
+        response = {'response': {'personalData': [
+            {'personalDataKey': 'http://axschema.org/contact/email',
+             'personalDataValue': 'a@example.com'}]}}
+        data = trace.redact(response)['response']['personalData'][0]
+        self.assertEqual(data['personalDataValue'], trace.REDACTED)
+        self.assertEqual(data['personalDataKey'],
+                         'http://axschema.org/contact/email')
+
+
+class EventTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        trace.add_handler(self.events.append)
+
+    def tearDown(self):
+        trace.remove_handler(self.events.append)
+        trace.disable('test')
+
+    def test_disabled_subsystem_emits_nothing(self):
+        trace.event('test', 'call', value=lambda: self.fail('evaluated'))
+        self.assertEqual(self.events, [])
+
+    def test_callables_are_evaluated_and_redacted(self):
+        trace.configure('test', level=trace.LEVEL_INFO)
+        trace.event('test', 'debug')
+        trace.event('test', 'call', level=trace.LEVEL_INFO,
+                    params=lambda: {'PWD': 'password', 'AMT': '1.00'})
+        self.assertEqual(len(self.events), 1)
+        self.assertEqual(self.events[0]['fields'],
+                         {'params': {'PWD': trace.REDACTED, 'AMT': '1.00'}})
+
+    def test_nvp_render_is_redacted(self):
+        trace.configure(nvp.TRACE_SUBSYSTEM)
+        try:
+            nvp.render({'USER': 'user', 'METHOD': 'MassPay'})
+        finally:
+            trace.disable(nvp.TRACE_SUBSYSTEM)
+        self.assertTrue(self.events)
+        self.assertFalse('user' in repr(self.events[-1]['fields']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from pypal import Response, ipn
+from pypal.ipn.tracking import PaymentTracker
+from pypal.metrics import Histogram
+from pypal.service import adaptive_payment
+
+from tests.helpers import FakeClient, PostbackClient, generate_ipn
+
+def pay_response(pay_key, status='CREATED'):
+    return Response('', {'responseEnvelope': {'ack': 'Success',
+                                              'correlationId': 'c-' + pay_key},
+                         'payKey': pay_key,
+                         'paymentExecStatus': status})
+
+class HistogramTest(unittest.TestCase):
+    def test_percentiles(self):
+        histogram = Histogram(buckets=(1, 2, 5))
+        self.assertEqual(histogram.get_percentile(50), None)
+        for value in (0.5, 0.5, 1.5, 4, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.get_percentile(40), 1)
+        self.assertEqual(histogram.get_percentile(60), 2)
+        self.assertEqual(histogram.get_percentile(99), 10)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 5)
+        self.assertEqual(snapshot['buckets'], {1: 2, 2: 1, 5: 1, 'inf': 1})
+        histogram.reset()
+        self.assertEqual(histogram.count, 0)
+
+
+class PaymentTrackerTest(unittest.TestCase):
+    def test_notifications_are_joined(self):
+        tracker = PaymentTracker()
+        payment = tracker.record(pay_response('AP-1'), tracking_id='t-1')
+        self.assertEqual(payment.correlation_id, 'c-AP-1')
+        self.assertTrue(tracker.get(tracking_id='t-1') is payment)
+
+        tracker.observe(ipn.parse(generate_ipn('AP-1', 'PENDING')))
+        self.assertEqual(payment.status, 'PENDING')
+        self.assertEqual(tracker.completion.count, 0)
+        # Joined by tracking id in case the pay key is missing
+        tracker.observe({'tracking_id': 't-1', 'status': 'COMPLETED'})
+        self.assertEqual(payment.status, 'COMPLETED')
+
+        metrics = tracker.get_metrics()
+        self.assertEqual(metrics['notified'], 2)
+        self.assertEqual(metrics['ipn_delay']['count'], 1)
+        self.assertEqual(metrics['completion']['count'], 1)
+        self.assertEqual(tracker.observe({'pay_key': 'AP-2'}), None)
+        self.assertEqual(tracker.get_metrics()['unknown'], 1)
+
+    def test_listener_callbacks(self):
+        tracker = PaymentTracker()
+        listener = ipn.Listener(PostbackClient())
+        seen = []
+        listener.add(ipn.EVENT_ADAPTIVE, lambda response: seen.append(
+            tracker.get('AP-1').completed_at is not None))
+        tracker.attach(listener)
+
+        tracker.record(pay_response('AP-1'))
+        self.assertTrue(listener.dispatch(generate_ipn('AP-1')))
+        self.assertEqual(seen, [True])
+        self.assertEqual(tracker.callbacks.count, 1)
+
+    def test_missing_notifications(self):
+        tracker = PaymentTracker(ipn_deadline=60)
+        tracker.record(pay_response('AP-1'))
+        tracker.record(pay_response('AP-2'))
+        tracker.observe({'pay_key': 'AP-2', 'status': 'COMPLETED'})
+
+        self.assertEqual(tracker.check_missing(), [])
+        missing = tracker.check_missing(now=time.time() + 61)
+        self.assertEqual([payment.pay_key for payment in missing], ['AP-1'])
+        # Flagged only once
+        self.assertEqual(tracker.check_missing(now=time.time() + 61), [])
+
+        tracker.observe({'pay_key': 'AP-1', 'status': 'COMPLETED'})
+        self.assertEqual(tracker.get_metrics()['late'], 1)
+
+    def test_oldest_payments_are_evicted(self):
+        tracker = PaymentTracker(max_payments=2)
+        for index in xrange(3):
+            tracker.record(pay_response('AP-%d' % index),
+                           tracking_id='t-%d' % index)
+        self.assertEqual(len(tracker), 2)
+        self.assertEqual(tracker.get('AP-0'), None)
+        self.assertEqual(tracker.get(tracking_id='t-0'), None)
+        self.assertEqual(tracker.get_metrics()['evicted_unnotified'], 1)
+
+    def test_pay_records_payment(self):
+        client = FakeClient(lambda action, params: pay_response('AP-1'))
+        tracker = PaymentTracker()
+        adaptive_payment.pay(client, 'PAY', 'USD', 'http://cancel',
+                             'http://return', 'http://ipn',
+                             receivers=[{'email': 'a@example.com',
+                                         'amount': '1.00'}],
+                             extra={'trackingId': 't-1'}, tracker=tracker)
+        self.assertEqual(tracker.get(tracking_id='t-1').pay_key, 'AP-1')
+
+    def test_failed_pay_is_not_recorded(self):
+        tracker = PaymentTracker()
+        self.assertEqual(tracker.record(Response('', {})), None)
+        self.assertEqual(len(tracker), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
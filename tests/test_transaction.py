@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+import urllib2
+
+from datetime import datetime, timedelta
+
+from pypal.service import transaction
+from pypal.store import Store
+
+from tests.helpers import FakeClient
+
+START = datetime(2013, 3, 1)
+
+class SplitTest(unittest.TestCase):
+    def test_split_range(self):
+        windows = transaction.split_range(START, START + timedelta(days=2),
+                                          timedelta(days=1))
+        self.assertEqual(windows, [
+            (START, START + timedelta(days=1, seconds=-1)),
+            (START + timedelta(days=1), START + timedelta(days=2, seconds=-1)),
+            (START + timedelta(days=2), START + timedelta(days=2))])
+
+    def test_split_window_floors_midpoint(self):
+        end = START + timedelta(seconds=5, microseconds=900000)
+        start = START + timedelta(microseconds=500000)
+        first, second = transaction.split_window((start, end))
+        self.assertEqual(first, (start, START + timedelta(seconds=2)))
+        self.assertEqual(second, (START + timedelta(seconds=3), end))
+
+    def test_split_window_stops_at_min_window(self):
+        end = START + timedelta(seconds=1, microseconds=999999)
+        self.assertEqual(transaction.split_window((START, end)), None)
+        self.assertEqual(transaction.split_window((START, START)), None)
+        self.assertNotEqual(transaction.split_window(
+            (START, START + timedelta(seconds=2))), None)
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self):
+        # One transaction every ten minutes over two days
+        self.timestamps = [START + timedelta(minutes=10 * index)
+                           for index in xrange(6 * 48)]
+        # strptime is not thread-safe until its module has been imported
+        datetime.strptime('2013', '%Y')
+
+    def handler(self, action, params):
+        start = datetime.strptime(params['STARTDATE'], transaction.DATE_FORMAT)
+        end = datetime.strptime(params['ENDDATE'], transaction.DATE_FORMAT)
+        matches = [timestamp for timestamp in self.timestamps
+                   if start <= timestamp <= end]
+        matches.reverse()
+
+        response = {'ACK': 'Success'}
+        if len(matches) > 50:
+            matches = matches[:50]
+            response.update(ACK='SuccessWithWarning',
+                            L_ERRORCODE0=transaction.ERROR_CODE_RESULTS_TRUNCATED)
+        for index, timestamp in enumerate(matches):
+            response['L_TIMESTAMP%d' % index] = \
+                transaction.format_date(timestamp)
+            response['L_TRANSACTIONID%d' % index] = \
+                timestamp.strftime('%d%H%M')
+        return response
+
+    def test_truncated_windows_are_split(self):
+        client = FakeClient(self.handler)
+        rows = list(transaction.search(client, START,
+                                       START + timedelta(days=2, seconds=-1),
+                                       workers=2))
+        self.assertEqual([row['TIMESTAMP'] for row in rows],
+                         [transaction.format_date(timestamp)
+                          for timestamp in self.timestamps])
+        self.assertTrue(len(client.calls) > 2)
+
+    def test_failure_raises(self):
+        client = FakeClient(lambda action, params: {'ACK': 'Failure'})
+        rows = transaction.search(client, START, START + timedelta(hours=1))
+        self.assertRaises(ValueError, list, rows)
+
+
+class HydratorTest(unittest.TestCase):
+    def setUp(self):
+        self.failing = set()
+        self.unreachable = set()
+        self.client = FakeClient(self.handler)
+
+    def handler(self, action, params):
+        transaction_id = params['TRANSACTIONID']
+        if transaction_id in self.failing:
+            return {'ACK': 'Failure'}
+        if transaction_id in self.unreachable:
+            raise urllib2.URLError('connection reset')
+        status = 'Pending' if transaction_id.startswith('P') else 'Completed'
+        return {'ACK': 'Success', 'TRANSACTIONID': transaction_id,
+                'PAYMENTSTATUS': status}
+
+    def test_settled_details_are_cached(self):
+        hydrator = transaction.Hydrator(self.client, store=Store())
+        ids = ['A', 'B', 'P1', 'A']
+        results = dict(hydrator.hydrate(ids))
+        self.assertEqual(sorted(results), ['A', 'B', 'P1'])
+        self.assertEqual(len(self.client.calls), 3)
+
+        dict(hydrator.hydrate(ids))
+        self.assertEqual(len(self.client.calls), 4)
+        self.assertEqual(hydrator.hits, 2)
+        self.assertEqual(hydrator.misses, 4)
+
+    def test_failures_are_capped(self):
+        self.failing.update(str(index) for index in xrange(10))
+        hydrator = transaction.Hydrator(self.client, workers=1,
+                                        max_failures=3)
+        results = list(hydrator.hydrate(str(index) for index in xrange(10)))
+        self.assertEqual([details for _, details in results], [None] * 10)
+        self.assertEqual(list(hydrator.failures), ['7', '8', '9'])
+
+        self.failing.discard('9')
+        self.assertNotEqual(hydrator.get('9'), None)
+        self.assertEqual(list(hydrator.failures), ['7', '8'])
+
+    def test_transport_errors_are_failures(self):
+        self.unreachable.add('B')
+        hydrator = transaction.Hydrator(self.client)
+        results = dict(hydrator.hydrate(['A', 'B', 'C']))
+        self.assertEqual(results['B'], None)
+        self.assertEqual(results['C']['TRANSACTIONID'], 'C')
+        self.assertTrue(isinstance(hydrator.failures['B'].error,
+                                   urllib2.URLError))
+
+
+if __name__ == '__main__':
+    unittest.main()
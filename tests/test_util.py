@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+import subprocess
+import sys
+import unittest
+
+from pypal import util
+
+class LazyModuleTest(unittest.TestCase):
+    def test_import_is_deferred_until_first_use(self):
+        proxy = util.lazy_module('colorsys')
+        self.assertEqual(proxy.__dict__['_module'], None)
+        self.assertEqual(proxy.rgb_to_hsv(0, 0, 0), (0, 0, 0))
+        self.assertTrue(proxy.load() is sys.modules['colorsys'])
+        # Attributes are cached in the proxy once looked up
+        self.assertTrue('rgb_to_hsv' in proxy.__dict__)
+
+    def test_load_module(self):
+        proxy = util.lazy_module('colorsys')
+        self.assertTrue(util.load_module(proxy) is sys.modules['colorsys'])
+        self.assertTrue(util.load_module(sys) is sys)
+
+    def test_import_pypal_defers_heavy_modules(self):
+        code = ('import sys, pypal, pypal.ipn; '
+                'print(",".join(name for name in ("urllib2", "httplib", '
+                '"ssl", "json", "logging") if name in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-S', '-c', code])
+        self.assertEqual(output.strip(), '')
+
+
+class ConcurrentImapTest(unittest.TestCase):
+    def test_ordered_results(self):
+        results = list(util.concurrent_imap(lambda x: x * 2, range(20),
+                                            workers=4))
+        self.assertEqual(results, [x * 2 for x in range(20)])
+
+    def test_unordered_results(self):
+        results = util.concurrent_imap(lambda x: x * 2, range(20),
+                                       workers=4, ordered=False)
+        self.assertEqual(sorted(results), [x * 2 for x in range(20)])
+
+
+if __name__ == '__main__':
+    unittest.main()
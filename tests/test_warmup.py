@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import sys
+import unittest
+
+from pypal import Client
+from pypal.pool import ConnectionPool
+
+from tests.helpers import LoopbackServer
+
+def get_unused_url():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    url = 'http://127.0.0.1:%d' % sock.getsockname()[1]
+    sock.close()
+    return url
+
+class WarmupClient(Client):
+    def __init__(self, endpoints, **kwargs):
+        kwargs.setdefault('api_username', 'username')
+        kwargs.setdefault('api_password', 'password')
+        kwargs.setdefault('api_signature', 'signature')
+        kwargs.setdefault('pool', ConnectionPool())
+        Client.__init__(self, **kwargs)
+        self.endpoints = endpoints
+
+    def get_endpoints(self):
+        return self.endpoints
+
+
+class WarmupTest(unittest.TestCase):
+    def setUp(self):
+        self.server = LoopbackServer(lambda handler: (200, {}, 'ok')).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connections_are_opened(self):
+        unused = get_unused_url()
+        client = WarmupClient([self.server.url, unused])
+        try:
+            errors = client.warmup(timeout=1)
+            self.assertEqual(errors[self.server.url], None)
+            self.assertNotEqual(errors[unused], None)
+            self.assertTrue('pypal.auth' in sys.modules)
+
+            key = ('http', self.server.url.split('//', 1)[1])
+            self.assertEqual(len(client.pool._idle[key]), 1)
+            # The first request reuses the warm connection
+            client.pool.urlopen(self.server.url, '', {}).read()
+            self.assertEqual(len(client.pool._idle[key]), 1)
+        finally:
+            client.pool.clear()
+
+    def test_production_and_sandbox_endpoints(self):
+        production = Client(api_username='username', api_password='password',
+                            api_signature='signature', in_sandbox=False)
+        sandbox = Client(api_username='username', api_password='password',
+                         api_signature='signature')
+        self.assertTrue('https://www.paypal.com' in production.get_endpoints())
+        self.assertFalse(any('sandbox' in endpoint
+                             for endpoint in production.get_endpoints()))
+        self.assertTrue(all('sandbox' in endpoint
+                            for endpoint in sandbox.get_endpoints()))
+
+
+class ForkTest(unittest.TestCase):
+    def test_inherited_connections_are_dropped(self):
+        server = LoopbackServer(lambda handler: (200, {}, 'ok')).start()
+        pool = ConnectionPool()
+        try:
+            pool.connect(server.url)
+            self.assertEqual(sum(map(len, pool._idle.values())), 1)
+
+            pid = os.fork()
+            if not pid:
+                status = 0 if pool.get_connection(
+                    ('http', 'example.com')) and not pool._idle else 1
+                os._exit(status)
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+            # The parent keeps its connections
+            self.assertEqual(sum(map(len, pool._idle.values())), 1)
+        finally:
+            pool.clear()
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
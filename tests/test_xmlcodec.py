@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from pypal import Client, xmlcodec
+
+class RenderTest(unittest.TestCase):
+    def test_root_is_taken_from_single_nested_dictionary(self):
+        self.assertEqual(xmlcodec.render({'PayRequest': {'a': '1'}}),
+                         xmlcodec.XML_DECLARATION.encode('utf-8') +
+                         '<PayRequest><a>1</a></PayRequest>')
+
+    def test_values_are_escaped(self):
+        rendered = xmlcodec.render({'a': '<b> & "c"'})
+        self.assertTrue('<a>&lt;b&gt; &amp; "c"</a>' in rendered)
+
+    def test_mixed_unicode_and_utf8(self):
+        rendered = xmlcodec.render({u'name': u'J\xf6rg', 'city': 'K\xc3\xb6ln',
+                                    'amount': 1.5, 'flag': True})
+        self.assertTrue(isinstance(rendered, str))
+        self.assertTrue('<name>J\xc3\xb6rg</name>' in rendered)
+        self.assertTrue('<city>K\xc3\xb6ln</city>' in rendered)
+        self.assertTrue('<flag>true</flag>' in rendered)
+
+    def test_client_renders_non_ascii(self):
+        client = Client(api_username='username', api_password='password',
+                        api_signature='signature', api_format='XML')
+        rendered = client.render_request_body({'a': u'\xe9'})
+        self.assertEqual(xmlcodec.parse(rendered), {'a': u'\xe9'})
+
+
+class RoundTripTest(unittest.TestCase):
+    def test_nested_dictionaries_and_lists(self):
+        params = {'receiverList': {'receiver': [
+            {'email': 'a@example.com', 'amount': '1.00'},
+            {'email': 'b@example.com', 'amount': '2.00'}]},
+            'memo': u'€ 10 – caf\xe9',
+            'currencyCode': 'EUR'}
+        self.assertEqual(xmlcodec.parse(xmlcodec.render(params)), params)
+
+    def test_parse_unicode_and_file_objects(self):
+        from StringIO import StringIO
+        document = u'<r><a>\xe9</a></r>'
+        self.assertEqual(xmlcodec.parse(document), {'a': u'\xe9'})
+        self.assertEqual(xmlcodec.parse(StringIO(document.encode('utf-8'))),
+                         {'a': u'\xe9'})
+
+    def test_namespaces_are_stripped(self):
+        document = ('<ns2:PayResponse xmlns:ns2="http://svcs.paypal.com/types">'
+                    '<responseEnvelope><ack>Success</ack></responseEnvelope>'
+                    '<payKey>AP-1</payKey></ns2:PayResponse>')
+        self.assertEqual(xmlcodec.parse(document),
+                         {'responseEnvelope': {'ack': 'Success'},
+                          'payKey': 'AP-1'})
+
+    def test_large_document(self):
+        items = [{'id': str(index)} for index in xrange(5000)]
+        parsed = xmlcodec.parse(xmlcodec.render({'item': items}))
+        self.assertEqual(parsed['item'], items)
+
+
+if __name__ == '__main__':
+    unittest.main()